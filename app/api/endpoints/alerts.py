@@ -1,7 +1,7 @@
 # app/api/endpoints/alerts.py
 from fastapi import APIRouter, HTTPException, status
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from app.services.alert_service import process_alerts
 
 router = APIRouter()
@@ -14,6 +14,10 @@ class AlertDetail(BaseModel):
     description: str
     severity: str
     timestamp: str
+    source: Optional[str] = None  # "log" 表示来自日志规则
+    rule: Optional[str] = None
+    count: Optional[int] = None
+    sample: Optional[str] = None
 
 class HostInfo(BaseModel):
     hostid: str
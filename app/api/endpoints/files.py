@@ -1,16 +1,86 @@
 #app/api/endpoints/files.py
-from fastapi import APIRouter, HTTPException
+import time
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-from app.services.file_service import copy_files_by_group_id
+from app.services.file_service import copy_files_by_group_id, iter_group_files
+from app.services import config_store_service
+from app.utils.archive_stream import iter_tar_gz, iter_zip
 
 router = APIRouter()
 
 class FileCopyRequest(BaseModel):
     group_id: str
 
+class SnapshotRef(BaseModel):
+    host: str
+    snapshot: Optional[str] = None  # 为空时取最新快照
+    root: Optional[str] = None  # 只比较该目录下的文件，路径相对它对齐
+
+class SnapshotDiffRequest(BaseModel):
+    a: SnapshotRef
+    b: SnapshotRef
+    content: bool = False  # 是否附带修改文件的文本 diff
+
 @router.post("/files")
 async def copy_files(request: FileCopyRequest):
     result, status = await copy_files_by_group_id(request.group_id)
     if status != 200:
         raise HTTPException(status_code=status, detail=result["message"])
     return result
+
+@router.get("/files/export")
+async def export_files(
+    group_id: str = Query(...),
+    format: str = Query("tar.gz", pattern=r"^(tar\.gz|zip)$"),
+    refresh: bool = Query(False, description="导出前先同步一次")
+):
+    """把组内已拉取的配置打包成 tar.gz / zip 边生成边返回"""
+    if refresh:
+        result, status = await copy_files_by_group_id(group_id)
+        if status != 200:
+            raise HTTPException(status_code=status, detail=result["message"])
+    entries = iter_group_files(group_id)
+    if entries is None:
+        raise HTTPException(status_code=404, detail=f"No config file found for group_id {group_id}")
+
+    filename = f"group_{group_id}_files_{time.strftime('%Y%m%d%H%M%S')}.{format}"
+    body = iter_zip(entries) if format == "zip" else iter_tar_gz(entries)
+    media_type = "application/zip" if format == "zip" else "application/gzip"
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@router.get("/file_snapshots/{host_ip}")
+async def list_file_snapshots(host_ip: str):
+    try:
+        return {"host": host_ip, "snapshots": await asyncio.to_thread(config_store_service.list_snapshots, host_ip)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/file_snapshots/diff")
+async def diff_file_snapshots(request: SnapshotDiffRequest):
+    def run():
+        a = config_store_service.load_snapshot(request.a.host, request.a.snapshot)
+        b = config_store_service.load_snapshot(request.b.host, request.b.snapshot)
+        return config_store_service.diff_snapshots(a, b, request.a.root, request.b.root, content=request.content)
+    try:
+        return await asyncio.to_thread(run)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.get("/file_snapshots/{host_ip}/{snapshot_id}/file")
+async def get_snapshot_file(host_ip: str, snapshot_id: str, path: str = Query(...)):
+    try:
+        snapshot = await asyncio.to_thread(config_store_service.load_snapshot, host_ip, snapshot_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    entry = snapshot["files"].get(path)
+    if not entry:
+        raise HTTPException(status_code=404, detail=f"{path} not in snapshot {snapshot_id}")
+    return FileResponse(config_store_service.object_path(entry["sha256"]), filename=path.rsplit("/", 1)[-1])
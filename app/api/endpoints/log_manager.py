@@ -1,10 +1,18 @@
 #app/api/endpoints/log_manager.py
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
-from typing import Dict, Any,Optional
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse, FileResponse
+from typing import Dict, Any, List, Optional
 from pydantic import BaseModel
+import os
+import json
 
-from app.services.log_manager_service import LogManagerService
+from app.services.log_manager_service import LogManagerService, locate_mirror, mirror_etag, iter_mirror_range
+from app.services.log_mirror_store import available_start
+from app.services.log_query_service import stream_remote_grep
+from app.services.log_timeline_service import read_merged_timeline
+from app.utils.http_range import parse_byte_range, etag_matches, RangeNotSatisfiable
+from app.utils.log_timestamps import parse_time_arg
+from app.utils.json_stream import stream_grouped_entries
 
 router = APIRouter()
 
@@ -14,7 +22,8 @@ class GroupRequest(BaseModel):
 
 class FullGroupLogsRequest(BaseModel):
     group_id: str
-    offsets: Optional[Dict[str, int]] = None
+    offsets: Optional[Dict[str, int]] = None  # 客户端游标："{ip}:{log_dir}/{log_file}" -> 已读到的偏移
+    stream: bool = False  # 为 True 时边读边输出，内存中只保留一页
 
 class LoadOlderLogsRequest(BaseModel):
     group_id: str
@@ -22,12 +31,68 @@ class LoadOlderLogsRequest(BaseModel):
     host_ip: str
     log_dir: str
     offset: int
+    lines: Optional[int] = None  # 指定时返回 offset 之前的这么多行（offset 可以是任意偏移）
+    pages: Optional[int] = None  # 指定时返回 offset 之前的这么多页（每页 40 行）
 
 class SingleLogRequest(BaseModel):
     group_id: str
     host_ip: str
     log_dir: str
     log_file: str
+    cursor: Optional[int] = None
+
+class SearchLogsRequest(BaseModel):
+    group_id: str
+    query: str
+    host_ip: Optional[str] = None
+    log_dir: Optional[str] = None
+    log_file: Optional[str] = None
+    start_time: Optional[str] = None  # 'YYYY-MM-DD HH:MM:SS' 或秒级时间戳
+    end_time: Optional[str] = None
+    limit: int = 100
+
+class SeekLogsRequest(BaseModel):
+    group_id: str
+    host_ip: str
+    log_dir: str
+    log_file: str
+    time: str  # 'YYYY-MM-DD HH:MM:SS' 或秒级时间戳
+
+class MergedLogsRequest(BaseModel):
+    group_id: str
+    files: Optional[List[str]] = None  # "{ip}:{log_dir}/{log_file}"，不传则合并组内全部文件
+    cursors: Optional[Dict[str, int]] = None  # 上一页返回的 cursors，用于翻到下一页
+    start_time: Optional[str] = None
+    end_time: Optional[str] = None
+    limit: int = 500
+
+class CounterNamesRequest(BaseModel):
+    group_id: str
+    host_ip: str
+    log_dir: str
+    log_file: str
+
+class CounterSeriesRequest(BaseModel):
+    group_id: str
+    host_ip: str
+    log_dir: str
+    log_file: str
+    counters: List[str]
+    start_time: Optional[str] = None
+    end_time: Optional[str] = None
+    step: Optional[float] = None  # 降采样的桶宽（秒），不传时点数过多会自动降采样
+    max_points: int = 1000
+
+class RemoteLogQueryRequest(BaseModel):
+    group_id: str
+    pattern: str
+    host_ip: Optional[str] = None
+    paths: Optional[List[str]] = None  # 远端文件或目录，默认使用配置的 log_dir
+    includes: Optional[List[str]] = None  # 文件名通配，默认 *.log / *.log.* / *.count
+    fixed_strings: bool = False
+    ignore_case: bool = False
+    max_matches_per_host: int = 500
+    timeout: int = 10  # 每台主机的超时（秒）
 
 
 @router.post("/log_manager")
@@ -44,7 +109,21 @@ async def get_logs(request: GroupRequest):
 @router.post("/full_group_logs")
 async def full_group_logs(request: FullGroupLogsRequest):
     try:
-        logs = await LogManagerService.read_full_group_logs(request.group_id)
+        if request.stream:
+            # 先取主机列表，配置错误时还能返回 500 而不是半截的 200
+            await LogManagerService.get_hosts_for_group(request.group_id)
+            cursors: Dict[str, int] = {}
+            items = LogManagerService.iter_full_group_logs(request.group_id, request.offsets, cursors)
+
+            def not_modified():
+                # 文件集合有变化（如文件被删除）时也要返回新的 cursors
+                if request.offsets is not None and set(request.offsets) == set(cursors):
+                    return {"not_modified": True}
+                return None
+
+            body = stream_grouped_entries(items, {"cursors": cursors}, not_modified)
+            return StreamingResponse(body, media_type="application/json")
+        logs = await LogManagerService.read_full_group_logs(request.group_id, request.offsets)
         return JSONResponse(content=logs)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -52,6 +131,12 @@ async def full_group_logs(request: FullGroupLogsRequest):
 @router.post("/load_older_logs")
 async def load_older_logs(request: LoadOlderLogsRequest):
     try:
+        if request.lines or request.pages:
+            logs = await LogManagerService.read_lines_before(
+                request.group_id, request.filename, request.host_ip, request.log_dir, request.offset,
+                request.lines, request.pages
+            )
+            return JSONResponse(content=logs)
         logs = await LogManagerService.load_older_logs(
             request.group_id, request.filename, request.host_ip,request.log_dir,request.offset
         )
@@ -68,8 +153,159 @@ async def read_single_log(request: SingleLogRequest):
             request.group_id,
             request.host_ip,
             request.log_dir,
-            request.log_file
+            request.log_file,
+            request.cursor
+        )
+        return JSONResponse(content=result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/search_logs")
+async def search_logs(request: SearchLogsRequest):
+    try:
+        start_time = parse_time_arg(request.start_time)
+        end_time = parse_time_arg(request.end_time)
+        result = await LogManagerService.search_logs(
+            request.group_id, request.query, request.host_ip, request.log_dir, request.log_file,
+            start_time, end_time, request.limit
+        )
+        return JSONResponse(content=result)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/seek_logs")
+async def seek_logs(request: SeekLogsRequest):
+    try:
+        timestamp = parse_time_arg(request.time)
+        if timestamp is None:
+            raise ValueError("time is required")
+        result = await LogManagerService.seek_logs_by_time(
+            request.group_id, request.host_ip, request.log_dir, request.log_file, timestamp
         )
         return JSONResponse(content=result)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/merged_logs")
+async def merged_logs(request: MergedLogsRequest):
+    try:
+        result = await read_merged_timeline(
+            request.group_id, request.files, request.cursors,
+            parse_time_arg(request.start_time), parse_time_arg(request.end_time),
+            min(max(request.limit, 1), 5000)
+        )
+        return JSONResponse(content=result)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/counter_names")
+async def counter_names(request: CounterNamesRequest):
+    try:
+        counters = await LogManagerService.list_counters(
+            request.group_id, request.host_ip, request.log_dir, request.log_file
+        )
+        return JSONResponse(content={"counters": counters})
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/counter_series")
+async def counter_series(request: CounterSeriesRequest):
+    try:
+        result = await LogManagerService.query_counter_series(
+            request.group_id, request.host_ip, request.log_dir, request.log_file, request.counters,
+            parse_time_arg(request.start_time), parse_time_arg(request.end_time),
+            request.step if request.step and request.step > 0 else None, min(max(request.max_points, 10), 10000)
+        )
+        return JSONResponse(content=result)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/log_query")
+async def remote_log_query(request: RemoteLogQueryRequest):
+    """在远端并发 grep，逐行以 NDJSON 流式返回命中结果，每台主机结束时返回一条 done 汇总"""
+    results = stream_remote_grep(
+        request.group_id, request.pattern, request.host_ip, request.paths, request.includes,
+        min(max(request.max_matches_per_host, 1), 10000), min(max(request.timeout, 1), 120),
+        request.fixed_strings, request.ignore_case
+    )
+    try:
+        first = await results.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def ndjson():
+        if first is not None:
+            yield json.dumps(first, ensure_ascii=False) + "\n"
+        async for item in results:
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@router.get("/log_raw")
+async def read_raw_log(
+    request: Request,
+    group_id: str = Query(...),
+    host_ip: str = Query(...),
+    log_dir: str = Query(...),
+    log_file: str = Query(...)
+):
+    """
+    直接从磁盘返回镜像文件的字节区间，支持 Range / ETag / If-None-Match。
+    偏移与 load_older_logs / single_log 返回的 start_offset、end_offset 一致。
+    """
+    try:
+        path, end = locate_mirror(group_id, host_ip, log_dir, log_file)
+        etag = mirror_etag(path, end)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    headers = {"ETag": etag, "Accept-Ranges": "bytes", "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    total = end
+    first = available_start(path)  # 更早的封存段可能已被保留策略淘汰
+    try:
+        byte_range = parse_byte_range(request.headers.get("range"), total)
+        if byte_range is not None and byte_range[0] < first:
+            raise RangeNotSatisfiable()
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{total}"})
+
+    media_type = "text/plain; charset=utf-8"
+    headers["X-Log-Start-Offset"] = str(first)
+    if byte_range is None:
+        st = os.stat(path)
+        if st.st_size == total:
+            # 整个文件：交给 FileResponse，服务器支持 pathsend 时走 sendfile
+            return FileResponse(path, media_type=media_type, headers=headers, stat_result=st)
+        start = first
+        status_code = 200
+        if start > 0 and end > start:
+            # 开头已被淘汰，只能给出后半段：按部分内容返回，偏移写在 Content-Range 里
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{total}"
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{total}"
+
+    headers["Content-Length"] = str(end - start)
+    return StreamingResponse(iter_mirror_range(path, start, end), status_code=status_code, media_type=media_type, headers=headers)
@@ -0,0 +1,21 @@
+#app/api/endpoints/storage.py
+import asyncio
+from fastapi import APIRouter, HTTPException
+
+from app.services import retention_service
+
+router = APIRouter()
+
+@router.get("/storage/usage")
+async def storage_usage():
+    try:
+        return await asyncio.to_thread(retention_service.collect_usage)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/storage/retention")
+async def run_retention():
+    try:
+        return await retention_service.run_retention_cycle()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,21 +1,29 @@
 #app/api/endpoints/update_file.py
 from fastapi import APIRouter, HTTPException
-from app.services.update_file_service import update_files, update_files_full
-from app.schemas.update_file import UpdateFileRequest, UpdateFileFullRequest
+from app.services.update_file_service import update_files, update_files_full, transform_configs
+from app.schemas.update_file import UpdateFileRequest, UpdateFileFullRequest, ConfigTransformRequest
 
 router = APIRouter()
 
 @router.post("/update_file")
 async def update_file(request: UpdateFileRequest):
-    result, status = await update_files(request.mcc, request.mnc, request.file_paths)
+    result, status = await update_files(request.mcc, request.mnc, request.file_paths, rollback=request.rollback)
     if status != 200:
         raise HTTPException(status_code=status, detail=result.get("message"))
     return result
 
 @router.post("/update_file_full")
 async def update_file_full(request: UpdateFileFullRequest):
-    result, status = await update_files_full(request.files)
+    result, status = await update_files_full(request.files, rollback=request.rollback)
     if status != 200:
         raise HTTPException(status_code=status, detail=result.get("message"))
     return result
 
+
+@router.post("/transform_config")
+async def transform_config(request: ConfigTransformRequest):
+    result, status = await transform_configs(request.rules, request.file_paths,
+                                             dry_run=request.dry_run, rollback=request.rollback)
+    if status != 200:
+        raise HTTPException(status_code=status, detail=result.get("message"))
+    return result
@@ -8,6 +8,18 @@ class Settings(BaseSettings):
     ZABBIX_USER: str
     ZABBIX_PASSWORD: str
     FLASK_ENV: str = "production"  # 保留兼容项，可删
+    LOG_MIRROR_KEEP_RAW: bool = False  # 日志镜像是否额外保留未清洗 ANSI 的原始副本
+    LOG_SEGMENT_SIZE: int = 8 * 1024 * 1024  # 活动段超过该大小后压缩封存
+    LOG_TRANSFER_MODE: str = "sftp"  # 日志拉取方式：sftp / gzip / zstd（远端压缩后经 exec 通道传回），可在 ssh_config.json 按主机用 log_transfer 覆盖
+    LOG_COMPRESSED_CHUNK_SIZE: int = 256 * 1024  # 压缩传输时每次最多拉取的明文字节数
+    FILE_SYNC_MAX_HOSTS: int = 8  # 配置文件同步、推送时同时处理的主机数
+    FILE_SYNC_HOST_TIMEOUT: int = 300  # 单台主机同步的截止时间（秒），0 表示不限
+    FILE_SNAPSHOT_KEEP: int = 100  # 每台主机保留的配置快照数，0 表示不限
+    RETENTION_GROUP_QUOTA_MB: int = 0  # 每组日志镜像配额，0 表示不限
+    RETENTION_GLOBAL_QUOTA_MB: int = 0  # 全部日志镜像配额，0 表示不限
+    RETENTION_MAX_AGE_DAYS: int = 0  # 封存段 / 孤立目录和 offset 文件的最长保留天数，0 表示不限（也不清理孤立数据）
+    RETENTION_INTERVAL_SECONDS: int = 600  # 后台保留任务周期，0 表示不启动
+    RETENTION_COMPACT_IDLE_SECONDS: int = 0  # 活动段空闲超过该时间后压缩封存，0 表示不做
     NET_CONF_DIR: str = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'net-conf'))
 
     class Config:
@@ -7,8 +7,9 @@ from slowapi.middleware import SlowAPIMiddleware
 from app.core.config import settings
 from app.core.logger import logger
 from app.core.limiter import limiter
-from app.api.endpoints import gethost, hostgroups, hosts, alerts, files, update_file, script_manager, log_manager, users
+from app.api.endpoints import gethost, hostgroups, hosts, alerts, files, update_file, script_manager, log_manager, users, storage
 from app.dependencies import zabbix
+from app.services import retention_service
 import os
 from fastapi.staticfiles import StaticFiles
 
@@ -40,11 +41,12 @@ async def root():
 @app.on_event("startup")
 async def startup_event():
     await zabbix.init_zapi_client()
+    retention_service.start_retention_task()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     # 清理任务（如关闭连接池等）可写在这里
-    pass
+    await retention_service.stop_retention_task()
 
 # 设置文件保存目录
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__)))
@@ -63,3 +65,4 @@ app.include_router(update_file.router, prefix="/api")
 app.include_router(script_manager.router, prefix="/api")
 app.include_router(log_manager.router, prefix="/api")
 app.include_router(users.router, prefix="/api")
+app.include_router(storage.router, prefix="/api")
@@ -1,6 +1,6 @@
 # app/schemas/update_file.py
 from pydantic import BaseModel
-from typing import List
+from typing import Any, Dict, List
 
 class FileContentItem(BaseModel):
     path: str
@@ -8,8 +8,16 @@ class FileContentItem(BaseModel):
 
 class UpdateFileFullRequest(BaseModel):
     files: List[FileContentItem]
+    rollback: bool = False  # 任一文件失败时整批放弃或回滚到修改前的本地副本
 
 class UpdateFileRequest(BaseModel):
     mcc: str
     mnc: str
     file_paths: List[str]
+    rollback: bool = False
+
+class ConfigTransformRequest(BaseModel):
+    rules: List[Dict[str, Any]]  # 规则格式见 config_transform_service
+    file_paths: List[str]  # "主机/路径"，支持通配符
+    dry_run: bool = True
+    rollback: bool = False
@@ -2,6 +2,7 @@
 from typing import List, Dict, Any
 from datetime import datetime, timezone, timedelta
 from app.dependencies.zabbix import get_zapi
+from app.services import log_alert_service
 from typing import Dict, List, Tuple, Optional, Any
 import os
 import json
@@ -137,6 +138,13 @@ async def process_alerts(groupid: str) -> Dict[str, Any]:
             'monitoring_option': monitoring_option
         })
 
+    # 日志内容规则触发的告警（由日志拉取时增量检测）
+    host_names = {ip: conf.get("host_name", ip) for ip, conf in (config or {}).get("hosts", {}).items()}
+    log_alerts = log_alert_service.active_alerts(groupid, host_names)
+    if log_alerts:
+        has_alert = True
+        alerts.extend(log_alerts)
+
     return {
         'groupid': groupid,
         'hosts': result,
@@ -9,10 +9,11 @@ from app.utils import async_config_manager as cfg_mgr
 logger = logging.getLogger(__name__)
 
 class ManagedSSHConnection:
-    def __init__(self, host_ip, username, password):
+    def __init__(self, host_ip, username, password, compression_algs=None):
         self.host_ip = host_ip
         self.username = username
         self.password = password
+        self.compression_algs = compression_algs  # SSH 传输层压缩，例如 ["zlib@openssh.com", "none"]
         self.conn = None
         self.lock = asyncio.Lock()
         self._keepalive_task = None
@@ -25,6 +26,9 @@ class ManagedSSHConnection:
                 return
             try:
                 logger.info(f"[SSH_POOL] Connecting to {self.host_ip} as {self.username}")
+                options = {}
+                if self.compression_algs:
+                    options["compression_algs"] = self.compression_algs
                 self.conn = await asyncssh.connect(
                     host=self.host_ip,
                     username=self.username,
@@ -32,6 +36,7 @@ class ManagedSSHConnection:
                     known_hosts=None,
                     keepalive_interval=30,
                     keepalive_count_max=3,
+                    **options,
                 )
                 logger.info(f"[SSH_POOL] Connected to {self.host_ip}")
                 if self._keepalive_task is None or self._keepalive_task.done():
@@ -85,6 +90,16 @@ class ManagedSSHConnection:
                 logger.info(f"[SSH_POOL] Closed connection to {self.host_ip}")
                 self.conn = None
 
+def normalize_compression_algs(value):
+    """ssh_config.json 里的 compression_algs：true 表示优先 zlib，字符串或列表原样使用，其它视为不设置"""
+    if value is True:
+        return ["zlib@openssh.com", "zlib", "none"]
+    if isinstance(value, str) and value:
+        return [value]
+    if isinstance(value, list) and value:
+        return value
+    return None
+
 class AsyncSSHConnectionPool:
     def __init__(self, idle_timeout=3600, cleanup_interval=300):
         self.pool = {}  # host_ip -> ManagedSSHConnection
@@ -112,8 +127,8 @@ class AsyncSSHConnectionPool:
 
     async def get_connection(self, host_ip, username=None, password=None):
         async with self.lock:
+            host_cfg = await cfg_mgr.get_host_config(host_ip) or {}
             if not (username and password):
-                host_cfg = await cfg_mgr.get_host_config(host_ip)
                 if host_cfg:
                     username = host_cfg.get("username")
                     password = host_cfg.get("password")
@@ -121,9 +136,10 @@ class AsyncSSHConnectionPool:
                 else:
                     logger.warning(f"[SSH_POOL] No credentials for {host_ip}")
                     raise ValueError(f"No credentials found for {host_ip}")
+            compression_algs = normalize_compression_algs(host_cfg.get("compression_algs"))
 
             if host_ip not in self.pool:
-                managed_conn = ManagedSSHConnection(host_ip, username, password)
+                managed_conn = ManagedSSHConnection(host_ip, username, password, compression_algs)
                 try:
                     await managed_conn.connect()
                     self.pool[host_ip] = managed_conn
@@ -133,10 +149,11 @@ class AsyncSSHConnectionPool:
             else:
                 managed_conn = self.pool[host_ip]
                 # 确保配置是最新的
-                if managed_conn.username != username or managed_conn.password != password:
-                    logger.info(f"[SSH_POOL] Credentials changed for {host_ip}, reconnecting")
+                if (managed_conn.username != username or managed_conn.password != password
+                        or managed_conn.compression_algs != compression_algs):
+                    logger.info(f"[SSH_POOL] Credentials or compression changed for {host_ip}, reconnecting")
                     await managed_conn.close()
-                    managed_conn = ManagedSSHConnection(host_ip, username, password)
+                    managed_conn = ManagedSSHConnection(host_ip, username, password, compression_algs)
                     try:
                         await managed_conn.connect()
                         self.pool[host_ip] = managed_conn
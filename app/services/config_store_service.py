@@ -0,0 +1,259 @@
+#app/services/config_store_service.py
+"""
+拉取配置的内容寻址存储。
+
+每次同步完成后，把主机当前的文件树记成一个快照：
+- objects/<sha256 前两位>/<sha256>：文件内容，按摘要命名，多台主机、多次同步的相同内容只存一份
+- snapshots/<主机>/<快照 ID>.json：{"id", "host", "created", "files": {远端路径: {"sha256", "size"}}}
+与上一个快照完全相同时不生成新快照，所以快照只在内容变化时出现，代价只是一个小 JSON。
+两个快照（同一主机的不同时间，或两台主机）之间按摘要比较，不需要读文件内容；需要时再对单个文件做文本 diff。
+
+/files 仍然直接挂载 files/<主机>/ 下的最新副本，这里不改动它。
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import difflib
+import logging
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+STORE_DIR = os.path.join(BASE_DIR, 'file-store')
+OBJECTS_DIR = os.path.join(STORE_DIR, 'objects')
+SNAPSHOTS_DIR = os.path.join(STORE_DIR, 'snapshots')
+
+SNAPSHOT_ID_RE = re.compile(r'^\d{8}T\d{6}Z(?:-\d+)?$')
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+MAX_TEXT_DIFF_BYTES = 1024 * 1024  # 超过该大小的文件不做文本 diff
+GC_GRACE_SECONDS = 3600  # 最近写入或引用过的对象不回收，避免和正在生成的快照竞争
+
+
+def object_path(sha256: str) -> str:
+    if not SHA256_RE.match(sha256):
+        raise ValueError(f"Invalid object id {sha256}")
+    return os.path.join(OBJECTS_DIR, sha256[:2], sha256)
+
+
+def put_file(local_path: str, block_size: int = 1024 * 1024) -> str:
+    """把本地文件存进对象库，边复制边计算摘要，返回 sha256；已存在的对象不重复写"""
+    h = hashlib.sha256()
+    tmp_path = os.path.join(OBJECTS_DIR, f".incoming-{os.getpid()}-{time.monotonic_ns()}")
+    try:
+        with open(local_path, "rb") as src, open(tmp_path, "wb") as dst:
+            for block in iter(lambda: src.read(block_size), b""):
+                h.update(block)
+                dst.write(block)
+        sha256 = h.hexdigest()
+        path = object_path(sha256)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return sha256
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _host_dir(host_ip: str) -> str:
+    if not host_ip or os.path.basename(host_ip) != host_ip or host_ip in (".", ".."):
+        raise ValueError(f"Invalid host {host_ip}")
+    return os.path.join(SNAPSHOTS_DIR, host_ip)
+
+
+def _snapshot_order(snapshot_id: str):
+    """同一秒内的快照带 -N 后缀，按 (时间, N) 排序（按字符串排 -10 会排在 -2 前面）"""
+    stamp, _, suffix = snapshot_id.partition("-")
+    return stamp, int(suffix or 0)
+
+
+def list_snapshot_ids(host_ip: str) -> List[str]:
+    """按生成顺序从旧到新"""
+    host_dir = _host_dir(host_ip)
+    if not os.path.isdir(host_dir):
+        return []
+    return sorted((name[:-5] for name in os.listdir(host_dir)
+                   if name.endswith(".json") and SNAPSHOT_ID_RE.match(name[:-5])), key=_snapshot_order)
+
+
+def load_snapshot(host_ip: str, snapshot_id: Optional[str] = None) -> Dict[str, Any]:
+    """读取快照，snapshot_id 为空时取最新的；不存在抛 FileNotFoundError"""
+    if snapshot_id is None:
+        ids = list_snapshot_ids(host_ip)
+        if not ids:
+            raise FileNotFoundError(f"No snapshots for {host_ip}")
+        snapshot_id = ids[-1]
+    if not SNAPSHOT_ID_RE.match(snapshot_id):
+        raise ValueError(f"Invalid snapshot id {snapshot_id}")
+    path = os.path.join(_host_dir(host_ip), f"{snapshot_id}.json")
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def record_snapshot(host_ip: str, manifest: Dict[str, Dict[str, Any]], local_dir: str) -> Optional[str]:
+    """
+    同步完成后调用：把 manifest 里的文件存进对象库并生成快照，返回快照 ID。
+    manifest 中的 sha256 对应的对象已存在时直接引用，否则从本地副本存入（以实际内容的摘要为准）。
+    与最新快照相同时返回最新快照的 ID。
+    """
+    os.makedirs(OBJECTS_DIR, exist_ok=True)
+    files = {}
+    for remote_path, entry in sorted(manifest.items()):
+        local_path = os.path.join(local_dir, remote_path.lstrip('/'))
+        sha256 = entry.get("sha256")
+        try:
+            if sha256 and os.path.exists(object_path(sha256)):
+                os.utime(object_path(sha256))
+            else:
+                sha256 = put_file(local_path)
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            logger.error(f"[FILE_STORE] Failed to store {host_ip}{remote_path}: {e}")
+            continue
+        files[remote_path] = {"sha256": sha256, "size": entry.get("size")}
+
+    try:
+        latest = load_snapshot(host_ip)
+        if latest["files"] == files:
+            return latest["id"]
+    except FileNotFoundError:
+        pass
+
+    host_dir = _host_dir(host_ip)
+    os.makedirs(host_dir, exist_ok=True)
+    snapshot_id = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    suffix = 1
+    while os.path.exists(os.path.join(host_dir, f"{snapshot_id}.json")):
+        snapshot_id = f"{snapshot_id.split('-')[0]}-{suffix}"
+        suffix += 1
+
+    snapshot = {"id": snapshot_id, "host": host_ip, "created": time.time(), "files": files}
+    path = os.path.join(host_dir, f"{snapshot_id}.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+    logger.info(f"[FILE_STORE] Recorded snapshot {snapshot_id} for {host_ip} ({len(files)} files)")
+
+    keep = settings.FILE_SNAPSHOT_KEEP
+    if keep > 0:
+        for old_id in list_snapshot_ids(host_ip)[:-keep]:
+            os.remove(os.path.join(host_dir, f"{old_id}.json"))
+    return snapshot_id
+
+
+def list_snapshots(host_ip: str) -> List[Dict[str, Any]]:
+    result = []
+    for snapshot_id in list_snapshot_ids(host_ip):
+        snapshot = load_snapshot(host_ip, snapshot_id)
+        result.append({
+            "id": snapshot_id,
+            "created": snapshot["created"],
+            "files": len(snapshot["files"]),
+            "bytes": sum(e.get("size") or 0 for e in snapshot["files"].values())
+        })
+    return result
+
+
+def _relative(files: Dict[str, Dict[str, Any]], root: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    if not root:
+        return files
+    prefix = root.rstrip('/') + '/'
+    return {path[len(prefix) - 1:]: entry for path, entry in files.items() if path.startswith(prefix)}
+
+
+def _read_text(sha256: str) -> Optional[List[str]]:
+    path = object_path(sha256)
+    if os.path.getsize(path) > MAX_TEXT_DIFF_BYTES:
+        return None
+    with open(path, "rb") as f:
+        data = f.read()
+    if b"\0" in data:
+        return None
+    return data.decode("utf-8", errors="replace").splitlines(keepends=True)
+
+
+def text_diff(sha_a: str, sha_b: str, path_a: str, path_b: str) -> Optional[str]:
+    """两个对象的 unified diff；二进制或过大的文件返回 None"""
+    a_lines, b_lines = _read_text(sha_a), _read_text(sha_b)
+    if a_lines is None or b_lines is None:
+        return None
+    return "".join(difflib.unified_diff(a_lines, b_lines, fromfile=path_a, tofile=path_b))
+
+
+def diff_snapshots(a: Dict[str, Any], b: Dict[str, Any], a_root: Optional[str] = None, b_root: Optional[str] = None,
+                   content: bool = False) -> Dict[str, Any]:
+    """
+    比较两个快照。给出 root 时只比较该目录下的文件，路径相对 root 对齐
+    （用于比较两台主机上放在不同目录的同一套配置）。content 为 True 时附带修改文件的文本 diff。
+    """
+    a_files, b_files = _relative(a["files"], a_root), _relative(b["files"], b_root)
+    added = sorted(set(b_files) - set(a_files))
+    removed = sorted(set(a_files) - set(b_files))
+    modified = []
+    unchanged = 0
+    for path in sorted(set(a_files) & set(b_files)):
+        sha_a, sha_b = a_files[path]["sha256"], b_files[path]["sha256"]
+        if sha_a == sha_b:
+            unchanged += 1
+            continue
+        item = {"path": path, "a": sha_a, "b": sha_b}
+        if content:
+            item["diff"] = text_diff(sha_a, sha_b, f"a{path}", f"b{path}")
+        modified.append(item)
+    return {
+        "a": {"host": a["host"], "snapshot": a["id"]},
+        "b": {"host": b["host"], "snapshot": b["id"]},
+        "added": added,
+        "removed": removed,
+        "modified": modified,
+        "unchanged": unchanged
+    }
+
+
+def collect_garbage() -> Dict[str, int]:
+    """删除没有任何快照引用、且 GC_GRACE_SECONDS 内没有被写入或引用过的对象"""
+    referenced = set()
+    host_ips = os.listdir(SNAPSHOTS_DIR) if os.path.isdir(SNAPSHOTS_DIR) else []
+    for host_ip in host_ips:
+        for snapshot_id in list_snapshot_ids(host_ip):
+            try:
+                referenced.update(e["sha256"] for e in load_snapshot(host_ip, snapshot_id)["files"].values())
+            except Exception as e:
+                # 读不了的快照可能引用任何对象，这一轮不回收
+                logger.error(f"[FILE_STORE] Failed to read snapshot {host_ip}/{snapshot_id}, skipping GC: {e}")
+                return {"removed_objects": 0, "freed_bytes": 0}
+
+    removed = 0
+    freed = 0
+    cutoff = time.time() - GC_GRACE_SECONDS
+    for root, _, files in os.walk(OBJECTS_DIR):
+        for name in files:
+            if name in referenced or name.startswith(".incoming-"):
+                continue
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            if st.st_mtime > cutoff:
+                continue
+            freed += st.st_size
+            os.remove(path)
+            removed += 1
+    return {"removed_objects": removed, "freed_bytes": freed}
+
+
+def remove_host(host_ip: str) -> None:
+    """主机不再配置时删除它的快照，对象由下一次 GC 回收"""
+    host_dir = _host_dir(host_ip)
+    if os.path.isdir(host_dir):
+        for name in os.listdir(host_dir):
+            os.remove(os.path.join(host_dir, name))
+        os.rmdir(host_dir)
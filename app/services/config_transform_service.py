@@ -0,0 +1,189 @@
+#app/services/config_transform_service.py
+"""
+配置文件改写引擎（MCC/MNC 等批量参数修改）。
+
+规则是声明式的，调用前统一编译，逐行流式处理文件（不整文件读入），一次可作用于多台主机的多个文件：
+- {"type": "key",   "key": "network country code", "value": "001"}
+    osmo 风格 cfg：行首（忽略缩进）为 key 且后面跟空白的行，值替换为 value，保留缩进和对齐空白
+- {"type": "path",  "path": "amf.*.plmn_id.mcc", "value": "001"}
+    open5gs YAML：按缩进跟踪键路径（列表下标忽略），路径用通配符匹配（* 可跨多级），
+    只替换标量值，保留引号风格和行尾注释
+- {"type": "regex", "pattern": "...", "replace": "..."}
+    任意文件逐行 re.sub，replace 支持 \\1 / \\g<name>
+每条规则可带 "files": 相对路径通配符（如 "*.cfg"），只作用于匹配的文件；
+key 规则只用于非 YAML 文件，path 规则只用于 .yaml / .yml。
+
+改写是一行换一行，diff 以 {line, old, new} 列表和零上下文的 unified diff 返回。
+"""
+import os
+import re
+import fnmatch
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+YAML_EXTS = (".yaml", ".yml")
+MAX_DIFF_LINES = 500  # 每个文件返回的改动行数上限
+
+# YAML 的 "key: value" 行：缩进、可选的列表前缀、键、冒号后的空白、值、行尾注释
+_YAML_KEY_RE = re.compile(
+    r'^(?P<indent>\s*)(?P<dash>-\s+)?(?P<key>[^\s#:\-][^:#]*?)\s*:(?P<sep>\s*)(?P<value>[^#\n]*?)(?P<tail>\s*(?:#.*)?)$'
+)
+
+
+def _text(rule: Dict[str, Any], field: str, optional: bool = False) -> Optional[str]:
+    value = rule.get(field) if optional else rule[field]
+    if value is None and optional:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"field {field!r} must be a string")
+    return value
+
+
+def _scalar(rule: Dict[str, Any], field: str) -> str:
+    value = rule[field]
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f"field {field!r} must be a string or number")
+    return str(value)
+
+
+def compile_rules(rules: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """校验并预编译规则，规则写错（缺字段、类型不对、正则无效）抛 ValueError"""
+    compiled = []
+    for i, rule in enumerate(rules):
+        try:
+            if not isinstance(rule, dict):
+                raise ValueError("rule must be an object")
+            kind = rule.get("type")
+            files = _text(rule, "files", optional=True)
+            item = {"type": kind, "files": re.compile(fnmatch.translate(files)) if files else None}
+            if kind == "key":
+                key = _text(rule, "key").strip()
+                if not key:
+                    raise ValueError("field 'key' must not be empty")
+                item["regex"] = re.compile(rf'^(\s*{re.escape(key)}\s+)\S.*?(\s*)$')
+                item["value"] = _scalar(rule, "value")
+            elif kind == "path":
+                item["regex"] = re.compile(fnmatch.translate(_text(rule, "path")))
+                item["value"] = _scalar(rule, "value")
+            elif kind == "regex":
+                item["regex"] = re.compile(_text(rule, "pattern"))
+                item["replace"] = _scalar(rule, "replace")
+                count = rule.get("count", 0)
+                if isinstance(count, bool) or not isinstance(count, int) or count < 0:
+                    raise ValueError("field 'count' must be a non-negative integer")
+                item["count"] = count
+            else:
+                raise ValueError(f"unknown type {kind!r}")
+        except KeyError as e:
+            raise ValueError(f"Rule {i} is missing field {e}")
+        except re.error as e:
+            raise ValueError(f"Rule {i} has an invalid pattern: {e}")
+        except ValueError as e:
+            raise ValueError(f"Rule {i}: {e}")
+        compiled.append(item)
+    return compiled
+
+
+def plmn_rules(mcc: str, mnc: str) -> List[Dict[str, Any]]:
+    """原 update_files 的 MCC/MNC 修改，同时覆盖 open5gs YAML 里的 plmn_id"""
+    return [
+        {"type": "key", "key": "network country code", "value": mcc},
+        {"type": "key", "key": "mobile network code", "value": mnc},
+        {"type": "path", "path": "*.plmn_id.mcc", "value": mcc},
+        {"type": "path", "path": "*.plmn_id.mnc", "value": mnc},
+    ]
+
+
+def rules_for_file(compiled: List[Dict[str, Any]], relative_path: str) -> List[Dict[str, Any]]:
+    is_yaml = relative_path.lower().endswith(YAML_EXTS)
+    selected = []
+    for rule in compiled:
+        if rule["files"] and not rule["files"].match(relative_path.lstrip("/")) \
+                and not rule["files"].match(os.path.basename(relative_path)):
+            continue
+        if (rule["type"] == "key" and is_yaml) or (rule["type"] == "path" and not is_yaml):
+            continue
+        selected.append(rule)
+    return selected
+
+
+def _quoted_like(old: str, new: str) -> str:
+    if len(old) >= 2 and old[0] == old[-1] and old[0] in "'\"":
+        return f"{old[0]}{new}{old[0]}"
+    return new
+
+
+def transform_lines(lines: Iterable[str], rules: List[Dict[str, Any]]) -> Iterable[Tuple[int, str, str]]:
+    """逐行应用规则，产出 (行号, 原行, 新行)；行尾换行符原样保留"""
+    path_rules = [r for r in rules if r["type"] == "path"]
+    stack: List[Tuple[int, str]] = []  # YAML 键路径：(键所在列, 键)
+
+    for lineno, raw in enumerate(lines, 1):
+        body = raw.rstrip("\r\n")
+        eol = raw[len(body):]
+        new = body
+
+        if path_rules and body.strip() and not body.lstrip().startswith("#"):
+            m = _YAML_KEY_RE.match(body)
+            if m:
+                column = len(m.group("indent")) + len(m.group("dash") or "")
+                while stack and stack[-1][0] >= column:
+                    stack.pop()
+                stack.append((column, m.group("key").strip()))
+                value = m.group("value")
+                if value:
+                    key_path = ".".join(k for _, k in stack)
+                    for rule in path_rules:
+                        if rule["regex"].match(key_path):
+                            new = body[:m.start("value")] + _quoted_like(value, rule["value"]) + body[m.end("value"):]
+                            break
+
+        for rule in rules:
+            if rule["type"] == "key":
+                new = rule["regex"].sub(lambda m, v=rule["value"]: m.group(1) + v + m.group(2), new, count=1)
+            elif rule["type"] == "regex":
+                new = rule["regex"].sub(rule["replace"], new, count=rule["count"])
+
+        yield lineno, body, new + eol if new != body else raw
+
+
+def transform_file(src_path: str, rules: List[Dict[str, Any]], dst_path: Optional[str] = None) -> Dict[str, Any]:
+    """
+    流式改写 src_path。dst_path 为 None 时只计算 diff（dry-run）；
+    否则写到 dst_path 的临时文件再 os.replace（dst_path 可以等于 src_path），没有改动时不写。
+    返回 {"changed": 改动行数, "changes": [{line, old, new}], "truncated": bool}。
+    """
+    changes = []
+    changed = 0
+    tmp_path = f"{dst_path}.transform-tmp" if dst_path else None
+    out = open(tmp_path, "w", encoding="utf-8", newline="") if tmp_path else None
+    try:
+        with open(src_path, "r", encoding="utf-8", newline="") as f:
+            for lineno, old, new in transform_lines(f, rules):
+                if out:
+                    out.write(new)
+                new_body = new.rstrip("\r\n")
+                if new_body != old:
+                    changed += 1
+                    if len(changes) < MAX_DIFF_LINES:
+                        changes.append({"line": lineno, "old": old, "new": new_body})
+    except BaseException:
+        if out:
+            out.close()
+            os.remove(tmp_path)
+        raise
+
+    if out:
+        out.close()
+        if changed:
+            os.replace(tmp_path, dst_path)
+        else:
+            os.remove(tmp_path)
+    return {"changed": changed, "changes": changes, "truncated": changed > len(changes)}
+
+
+def unified_diff(path: str, changes: List[Dict[str, Any]]) -> str:
+    """零上下文的 unified diff（改写是一行换一行，行号两边相同）"""
+    out = [f"--- a/{path}", f"+++ b/{path}"]
+    for c in changes:
+        out += [f"@@ -{c['line']} +{c['line']} @@", f"-{c['old']}", f"+{c['new']}"]
+    return "\n".join(out) + "\n"
@@ -1,10 +1,14 @@
 #app/services/file_service.py
 import os
 import json
+import asyncio
+import asyncssh
+from app.core.config import settings
 from app.utils import async_config_manager as cfg_mgr
 from app.dependencies.zabbix import get_zapi
 from app.services.async_ssh_pool import ssh_pool
-from app.services.sftp_utils import sftp_get_dir
+from app.services.sftp_utils import sftp_get_dir, manifest_matches, manifest_entry
+from app.services import config_store_service
 import logging
 
 logger = logging.getLogger(__name__)
@@ -12,9 +16,36 @@ logger = logging.getLogger(__name__)
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 FILES_DIR = os.path.join(BASE_DIR, 'files')
 CONFIG_DIR = os.path.join(BASE_DIR, 'net-conf')
+MANIFEST_DIR = os.path.join(BASE_DIR, 'file-manifests')  # 每台主机上次同步的文件清单，不放在 /files 下避免被直接访问
 
 os.makedirs(FILES_DIR, exist_ok=True)
 os.makedirs(CONFIG_DIR, exist_ok=True)
+os.makedirs(MANIFEST_DIR, exist_ok=True)
+
+def manifest_path(host_ip: str) -> str:
+    return os.path.join(MANIFEST_DIR, f"{host_ip}.json")
+
+def load_manifest(host_ip: str) -> dict:
+    """remote_path -> {"size", "mtime", "sha256"}"""
+    try:
+        with open(manifest_path(host_ip), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"Failed to load manifest for {host_ip}, doing a full sync: {e}")
+        return {}
+
+def save_manifest(host_ip: str, manifest: dict) -> None:
+    path = manifest_path(host_ip)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def remove_local_copy(local_dir: str, remote_path: str) -> None:
+    local_path = os.path.join(local_dir, remote_path.lstrip('/'))
+    if os.path.isfile(local_path):
+        os.remove(local_path)
 
 def find_config_by_group_id(group_id: str):
     for filename in os.listdir(CONFIG_DIR):
@@ -31,6 +62,126 @@ def find_config_by_group_id(group_id: str):
             logger.error(f"Failed to load config file {filepath}: {e}")
     return None
 
+def iter_group_files(group_id: str):
+    """组内各主机已拉取的本地副本，产出 (归档内路径 "<主机>/<远端路径>", 本地路径)；组不存在返回 None"""
+    config = find_config_by_group_id(group_id)
+    if not config:
+        return None
+
+    def walk():
+        for host_ip in sorted(config.get("hosts", {})):
+            host_dir = os.path.join(FILES_DIR, host_ip)
+            for root, dirs, files in os.walk(host_dir):
+                dirs.sort()
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, FILES_DIR).replace(os.sep, "/"), path
+    return walk()
+
+def empty_sync_result() -> dict:
+    return {"copied": [], "deleted": [], "unchanged": 0, "failures": []}
+
+
+async def sync_host_files(host_ip: str, host_conf: dict, result: dict = None) -> dict:
+    """
+    同步单台主机的 conf_dir 和 conf_paths，结果（copied / deleted / unchanged / failures）写进 result 并返回。
+    由调用方传入 result 时，超时取消后已完成的部分仍然可见。
+    """
+    if result is None:
+        result = empty_sync_result()
+    copied_files = result["copied"]
+    deleted_files = result["deleted"]
+    failures = result["failures"]
+
+    conf_dir = host_conf.get("conf_dir")
+    conf_paths = host_conf.get("conf_paths", [])
+
+    ssh = await ssh_pool.get_connection(host_ip)
+    if not ssh:
+        logger.error(f"Unable to establish SSH connection to {host_ip}")
+        failures.append({"host": host_ip, "error": "SSH connection failed"})
+        return result
+
+    manifest = load_manifest(host_ip)
+    seen = set()
+    # 只有列目录 / stat 成功确认文件已不存在时才删本地副本，出错的部分保留
+    unsure_roots = []
+    sftp = None
+
+    try:
+        sftp = await ssh.start_sftp_client()
+        local_dir = os.path.join(FILES_DIR, host_ip)
+        os.makedirs(local_dir, exist_ok=True)
+
+        if conf_dir:
+            try:
+                logger.info(f"Start syncing directory {conf_dir} from {host_ip}")
+                stats = await sftp_get_dir(sftp, conf_dir, local_dir, copied_files, host_ip, logger=logger,
+                                           failures=failures, manifest=manifest, seen=seen)
+                result["unchanged"] += stats["skipped"]
+                unsure_roots.extend(stats["failed_dirs"])
+            except Exception as e:
+                logger.error(f"Failed to copy directory {conf_dir} from {host_ip}: {e}")
+                failures.append({"host": host_ip, "directory": conf_dir, "error": str(e)})
+                unsure_roots.append(os.path.normpath(conf_dir))
+
+        for remote_path in conf_paths:
+            try:
+                relative_path = remote_path.lstrip('/')
+                local_file_path = os.path.join(local_dir, relative_path)
+                try:
+                    attrs = await sftp.stat(remote_path)
+                except asyncssh.SFTPNoSuchFile:
+                    continue  # 远端已删除，下面统一清理
+                seen.add(os.path.normpath(remote_path))
+                if manifest_matches(manifest.get(os.path.normpath(remote_path)), attrs, local_file_path):
+                    result["unchanged"] += 1
+                    continue
+
+                os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+                logger.info(f"Copying file {remote_path} from {host_ip} to {local_file_path}")
+                manifest.pop(os.path.normpath(remote_path), None)
+                await sftp.get(remote_path, local_file_path)
+                manifest[os.path.normpath(remote_path)] = await asyncio.to_thread(
+                    manifest_entry, attrs, local_file_path
+                )
+
+                copied_files.append(f"{host_ip}{remote_path}")
+            except Exception as e:
+                logger.error(f"Failed to copy file {remote_path} from {host_ip}: {e}")
+                failures.append({"host": host_ip, "file": remote_path, "error": str(e)})
+                unsure_roots.append(os.path.normpath(remote_path))
+
+        # ---------- 远端已删除的文件：删除本地副本 ----------
+        for remote_path in list(manifest):
+            if remote_path in seen:
+                continue
+            if any(remote_path == root or remote_path.startswith(root.rstrip('/') + '/') for root in unsure_roots):
+                continue
+            remove_local_copy(local_dir, remote_path)
+            manifest.pop(remote_path)
+            deleted_files.append(f"{host_ip}{remote_path}")
+            logger.info(f"Removed local copy of deleted remote file {host_ip}{remote_path}")
+
+    except Exception as e:
+        logger.error(f"General SSH/SFTP error on {host_ip}: {e}")
+        failures.append({"host": host_ip, "error": str(e)})
+    finally:
+        if sftp:
+            sftp.exit()
+        # 超时被取消时也把已经下载的文件记进清单
+        save_manifest(host_ip, manifest)
+
+    # 完整走完一次同步后记录快照（被取消时不会执行到这里）
+    try:
+        result["snapshot"] = await asyncio.to_thread(
+            config_store_service.record_snapshot, host_ip, manifest, os.path.join(FILES_DIR, host_ip)
+        )
+    except Exception as e:
+        logger.error(f"Failed to record file snapshot for {host_ip}: {e}")
+    return result
+
+
 async def copy_files_by_group_id(group_id: str):
     config = find_config_by_group_id(group_id)
     if not config:
@@ -42,59 +193,52 @@ async def copy_files_by_group_id(group_id: str):
     if not hosts:
         return {"status": "error", "message": "No hosts found in the specified group."}, 404
 
-    copied_files = []
-    failures = []
-
+    semaphore = asyncio.Semaphore(max(settings.FILE_SYNC_MAX_HOSTS, 1))
+    timeout = settings.FILE_SYNC_HOST_TIMEOUT or None
+
+    async def run_host(host_ip: str, host_conf: dict) -> dict:
+        result = empty_sync_result()
+        async with semaphore:
+            try:
+                await asyncio.wait_for(sync_host_files(host_ip, host_conf, result), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"Syncing files from {host_ip} timed out after {timeout}s")
+                result["failures"].append({"host": host_ip, "error": f"Timed out after {timeout}s"})
+            except Exception as e:
+                logger.error(f"Syncing files from {host_ip} failed: {e}")
+                result["failures"].append({"host": host_ip, "error": str(e)})
+        return result
+
+    tasks = []
+    host_ips = []
     for host in hosts:
         host_ip = host['interfaces'][0]['ip']
         host_conf = config.get("hosts", {}).get(host_ip)
         if not host_conf:
             logger.warning(f"No config entry for host IP {host_ip}, skipping")
             continue
+        tasks.append(run_host(host_ip, host_conf))
+        host_ips.append(host_ip)
 
-        conf_dir = host_conf.get("conf_dir")
-        conf_paths = host_conf.get("conf_paths", [])
-
-        ssh = await ssh_pool.get_connection(host_ip)
-        if not ssh:
-            logger.error(f"Unable to establish SSH connection to {host_ip}")
-            failures.append({"host": host_ip, "error": "SSH connection failed"})
-            continue
-
-        try:
-            sftp = await ssh.start_sftp_client()
-            local_dir = os.path.join(FILES_DIR, host_ip)
-            os.makedirs(local_dir, exist_ok=True)
-
-            if conf_dir:
-                try:
-                    logger.info(f"Start copying directory {conf_dir} from {host_ip}")
-                    await sftp_get_dir(sftp, conf_dir, local_dir, copied_files, host_ip, logger=logger)
-                except Exception as e:
-                    logger.error(f"Failed to copy directory {conf_dir} from {host_ip}: {e}")
-                    failures.append({"host": host_ip, "directory": conf_dir, "error": str(e)})
-
-            for remote_path in conf_paths:
-                try:
-                    relative_path = remote_path.lstrip('/')
-                    local_file_path = os.path.join(local_dir, relative_path)
-                    os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-
-                    logger.info(f"Copying file {remote_path} from {host_ip} to {local_file_path}")
-                    await sftp.get(remote_path, local_file_path)
-
-                    copied_files.append(f"{host_ip}{remote_path}")
-                except Exception as e:
-                    logger.error(f"Failed to copy file {remote_path} from {host_ip}: {e}")
-                    failures.append({"host": host_ip, "file": remote_path, "error": str(e)})
-            sftp.exit()
-
-        except Exception as e:
-            logger.error(f"General SSH/SFTP error on {host_ip}: {e}")
-            failures.append({"host": host_ip, "error": str(e)})
+    # 各主机并发同步，结果按主机顺序合并
+    copied_files = []
+    deleted_files = []
+    failures = []
+    unchanged = 0
+    snapshots = {}
+    for host_ip, result in zip(host_ips, await asyncio.gather(*tasks)):
+        if result.get("snapshot"):
+            snapshots[host_ip] = result["snapshot"]
+        copied_files.extend(result["copied"])
+        deleted_files.extend(result["deleted"])
+        failures.extend(result["failures"])
+        unchanged += result["unchanged"]
 
     return {
         "status": "success",
         "copied": copied_files,
+        "deleted": deleted_files,
+        "unchanged": unchanged,
+        "snapshots": snapshots,
         "failures": failures
     }, 200
@@ -0,0 +1,184 @@
+#app/services/log_alert_service.py
+"""
+基于日志内容的告警。
+
+fetch_logs 每次追加到镜像的新内容交给 scan_chunk 检查一遍（只看新内容，不回扫旧数据）。
+每条规则单独编译、各自扫一遍整块；同一行可以同时命中多条规则，每条规则每行最多计一次。
+每个 (组, 主机, 规则) 维护一个滑动窗口计数，窗口内次数达到阈值即触发告警，
+窗口内不再有新命中后告警自动消失。触发中的告警由 process_alerts 合并进 /alerts 的返回。
+
+组配置（net-conf/*.json）里可以用 "log_alert_rules" 追加或覆盖（同名）默认规则：
+[{"name": "...", "pattern": "...", "severity": "high", "threshold": 1, "window": 300, "description": "..."}]
+"""
+import re
+import time
+import logging
+from collections import deque
+from datetime import datetime, timezone, timedelta
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.services.file_service import find_config_by_group_id
+
+logger = logging.getLogger(__name__)
+
+# 与 alert_service 的告警时间格式保持一致（北京时间）
+BEIJING_TZ = timezone(timedelta(hours=8))
+
+DEFAULT_RULES: List[Dict[str, Any]] = [
+    {
+        "name": "crash",
+        "pattern": r"Segmentation fault|core dumped|Assertion .* failed|terminate called|\bAborted\b|\bSIGSEGV\b|\bSIGABRT\b",
+        "severity": "high",
+        "threshold": 1,
+        "window": 300,
+        "description": "进程崩溃"
+    },
+    {
+        "name": "restart_loop",
+        # osmo 启动横幅 / open5gs 启动信息
+        "pattern": r"Open5GS daemon v|\bosmo-[\w-]+ version \d|\bInitializ(?:ed|ing) .*\bversion\b",
+        "severity": "high",
+        "threshold": 3,
+        "window": 300,
+        "description": "进程反复重启"
+    },
+    {
+        "name": "error_storm",
+        "pattern": r"\b(?:ERROR|FATAL|CRITICAL)\b|\[(?:error|fatal)\]|<000[0-9a-f]> [^\n]*\bERROR\b",
+        "severity": "medium",
+        "threshold": 50,
+        "window": 60,
+        "description": "错误日志激增"
+    },
+]
+
+# 编译后的规则：组 ID -> [(规则, 正则)]
+_compiled: Dict[str, List[Tuple[Dict[str, Any], re.Pattern]]] = {}
+
+
+class _Window:
+    """滑动窗口：每次扫描记一条 (时间, 命中行数)，total 为窗口内命中行数之和"""
+    __slots__ = ("entries", "total")
+
+    def __init__(self):
+        self.entries: Deque[Tuple[float, int]] = deque()
+        self.total = 0
+
+    def add(self, now: float, count: int, span: float) -> int:
+        self.entries.append((now, count))
+        self.total += count
+        while self.entries and self.entries[0][0] < now - span:
+            self.total -= self.entries.popleft()[1]
+        return self.total
+
+
+# 滑动窗口：(组, 主机, 规则名) -> 窗口
+_windows: Dict[Tuple[str, str, str], _Window] = {}
+# 触发中的告警：(组, 主机, 规则名) -> 告警
+_active: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+
+
+def _rules_for_group(group_id: str) -> List[Dict[str, Any]]:
+    rules = {r["name"]: dict(r) for r in DEFAULT_RULES}
+    config = find_config_by_group_id(group_id) or {}
+    for rule in config.get("log_alert_rules", []):
+        if rule.get("name") and rule.get("pattern"):
+            rules[rule["name"]] = {**rules.get(rule["name"], {}), **rule}
+    return [r for r in rules.values() if r.get("enabled", True)]
+
+
+def compile_rules(rules: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], re.Pattern]]:
+    """逐条编译规则，用户写的分组、反向引用都保持原意；单条规则写错只跳过这一条"""
+    compiled = []
+    for rule in rules:
+        try:
+            compiled.append((rule, re.compile(rule["pattern"])))
+        except re.error as e:
+            logger.error(f"[LOG_ALERT] Invalid pattern for rule {rule['name']}: {e}")
+    return compiled
+
+
+def _get_compiled(group_id: str) -> List[Tuple[Dict[str, Any], re.Pattern]]:
+    if group_id not in _compiled:
+        _compiled[group_id] = compile_rules(_rules_for_group(group_id))
+    return _compiled[group_id]
+
+
+def reload_rules(group_id: Optional[str] = None) -> None:
+    """组配置里的规则改动后调用，下一次扫描时重新编译"""
+    if group_id is None:
+        _compiled.clear()
+    else:
+        _compiled.pop(str(group_id), None)
+
+
+def scan_chunk(group_id: str, host_ip: str, log_file: str, text: str, now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """扫描新追加的内容，更新滑动窗口，返回本次新触发的告警"""
+    group_id = str(group_id)
+    compiled = _get_compiled(group_id)
+    now = now or time.time()
+
+    hits: List[Tuple[Dict[str, Any], int, str]] = []  # (规则, 本块命中行数, 最后一条命中的行)
+    for rule, regex in compiled:
+        count = 0
+        line = ""
+        last_line_start = -1
+        for m in regex.finditer(text):
+            line_start = text.rfind("\n", 0, m.start()) + 1
+            if line_start == last_line_start:
+                continue  # 同一规则同一行只计一次
+            last_line_start = line_start
+            line_end = text.find("\n", m.end())
+            line = text[line_start:line_end if line_end >= 0 else len(text)]
+            count += 1
+        if count:
+            hits.append((rule, count, line))
+
+    fired = []
+    for rule, count, line in hits:
+        key = (group_id, host_ip, rule["name"])
+        window = _windows.get(key)
+        if window is None:
+            window = _windows[key] = _Window()
+        total = window.add(now, count, rule["window"])
+
+        if total < rule["threshold"]:
+            continue
+        alert = _active.get(key)
+        if alert is None:
+            alert = {
+                "host": host_ip,
+                "description": f"{rule['description']}（{log_file}）",
+                "severity": rule["severity"],
+                "timestamp": datetime.fromtimestamp(now, tz=BEIJING_TZ).strftime('%Y-%m-%d %H:%M:%S'),
+                "source": "log",
+                "rule": rule["name"],
+            }
+            _active[key] = alert
+            fired.append(alert)
+            logger.warning(f"[LOG_ALERT] {rule['name']} fired on {host_ip} ({total} hits in {rule['window']}s): {line[:200]}")
+        alert["count"] = total
+        alert["sample"] = line[:500]
+        alert["last_seen"] = now
+    return fired
+
+
+def active_alerts(group_id: str, host_names: Optional[Dict[str, str]] = None, now: Optional[float] = None) -> List[Dict[str, Any]]:
+    """返回组内仍在触发中的日志告警；窗口内已经没有命中的告警在这里清除"""
+    group_id = str(group_id)
+    now = now or time.time()
+    windows = {rule["name"]: rule["window"] for rule, _ in _get_compiled(group_id)}
+
+    result = []
+    for key, alert in list(_active.items()):
+        if key[0] != group_id:
+            continue
+        if now - alert["last_seen"] > windows.get(key[2], 0):
+            _active.pop(key, None)
+            _windows.pop(key, None)
+            continue
+        item = dict(alert)
+        if host_names and key[1] in host_names:
+            item["host"] = host_names[key[1]]
+        result.append(item)
+    return result
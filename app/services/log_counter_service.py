@@ -0,0 +1,252 @@
+#app/services/log_counter_service.py
+"""
+从 .count 文件（osmo 速率计数器快照）提取计数器时间序列。
+
+入库时逐行解析追加到镜像的内容，支持三种写法：
+- osmo stats 日志：  stats ... g=bsc i=0 n=chreq:total v=123 d=3
+- show rate-counters： "BSC rate counters (index 0):" 分组行，下面是 "  chreq:total:   123 (0/s ...) 说明"
+- 简单键值：         name = 123 / name: 123 / name=123
+带行首时间戳的行开始一个新快照；整个文件都没有时间戳时使用入库时间。
+
+每个计数器两个列文件（array('d')，时间和值分开存），放在镜像的段目录里：
+ctr_<id>.t / ctr_<id>.v，counters.json 记录名字到 id 的映射和解析状态。
+delta / rate 在查询时计算，计数器回绕（值变小）时把当前值当作增量。
+"""
+import os
+import re
+import json
+import math
+import time
+import bisect
+import logging
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.services import log_mirror_store
+from app.utils.log_timestamps import parse_leading_timestamp
+
+logger = logging.getLogger(__name__)
+
+META_NAME = "counters.json"
+MAX_POINTS = 1000  # 未指定 step 时自动降采样到不超过这么多点
+
+_STATS_NAME_RE = re.compile(r'\bn=(\S+)')
+_STATS_VALUE_RE = re.compile(r'\bv=(-?\d+(?:\.\d+)?)\b')
+_STATS_GROUP_RE = re.compile(r'\bg=(\S+)')
+_STATS_INDEX_RE = re.compile(r'\bi=(\S+)')
+_RATE_CTR_RE = re.compile(r'^\s*(?P<name>[\w.:/\-]+?):\s+(?P<value>-?\d+(?:\.\d+)?)(?:\s|$)')
+_KEY_VALUE_RE = re.compile(r'^\s*(?P<name>[\w.:/\-]+?)\s*[=:]\s*(?P<value>-?\d+(?:\.\d+)?)\s*$')
+_SECTION_RE = re.compile(r'^\s*(?P<section>\S.*?):\s*$')
+# 行首时间戳之后的部分（时间戳格式见 log_timestamps）
+_TS_PREFIX_RE = re.compile(r'^\[?[\d\-/: T.,]+\]?:?\s*')
+
+
+def _counter_dir(mirror_path: str) -> str:
+    return log_mirror_store.segment_dir(mirror_path)
+
+
+def _load_meta(mirror_path: str) -> Dict[str, Any]:
+    path = os.path.join(_counter_dir(mirror_path), META_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"section": None, "ts": None, "counters": {}}
+
+
+def _save_meta(mirror_path: str, meta: Dict[str, Any]) -> None:
+    path = os.path.join(_counter_dir(mirror_path), META_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(path + ".tmp", path)
+
+
+def _column_paths(mirror_path: str, counter_id: int) -> Tuple[str, str]:
+    base = os.path.join(_counter_dir(mirror_path), f"ctr_{counter_id:05d}")
+    return base + ".t", base + ".v"
+
+
+def parse_counter_line(line: str, section: Optional[str]) -> Tuple[Optional[str], Optional[float], Optional[str]]:
+    """解析一行，返回 (计数器名, 值, 新的分组名)；不是计数器的行返回 (None, None, 分组)"""
+    if "n=" in line and "v=" in line:
+        name_m = _STATS_NAME_RE.search(line)
+        value_m = _STATS_VALUE_RE.search(line)
+        if name_m and value_m:
+            prefix = []
+            group_m = _STATS_GROUP_RE.search(line)
+            index_m = _STATS_INDEX_RE.search(line)
+            if group_m:
+                prefix.append(group_m.group(1))
+            if index_m:
+                prefix.append(index_m.group(1))
+            name = ".".join(prefix + [name_m.group(1)])
+            return name, float(value_m.group(1)), section
+
+    m = _RATE_CTR_RE.match(line) or _KEY_VALUE_RE.match(line)
+    if m:
+        name = m.group("name")
+        # 缩进的计数器行归属于上面的分组行
+        if section and line[:1].isspace():
+            name = f"{section}.{name}"
+        return name, float(m.group("value")), section
+
+    m = _SECTION_RE.match(line)
+    if m and not line[:1].isspace():
+        return None, None, m.group("section")
+    return None, None, section
+
+
+def ingest_chunk(mirror_path: str, text: str) -> int:
+    """解析追加到 .count 镜像的内容并写入各计数器的列文件，返回写入的样本数"""
+    meta = _load_meta(mirror_path)
+    section = meta.get("section")
+    snapshot_ts = meta.get("ts")
+    fallback_ts = time.time()
+    samples: Dict[str, List[Tuple[float, float]]] = {}
+
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        ts = parse_leading_timestamp(line)
+        if ts is not None:
+            snapshot_ts = ts
+            line = _TS_PREFIX_RE.sub("", line, count=1)
+            section = None
+        name, value, section = parse_counter_line(line, section)
+        if name is None:
+            continue
+        samples.setdefault(name, []).append((snapshot_ts if snapshot_ts is not None else fallback_ts, value))
+
+    os.makedirs(_counter_dir(mirror_path), exist_ok=True)
+    written = 0
+    counters = meta["counters"]
+    for name, points in samples.items():
+        info = counters.get(name)
+        if info is None:
+            info = counters[name] = {"id": len(counters), "last_t": None}
+        t_path, v_path = _column_paths(mirror_path, info["id"])
+        t_col, v_col = array("d"), array("d")
+        last_t = info["last_t"]
+        for t, v in points:
+            if last_t is not None and t < last_t:
+                continue  # 时间回拨的样本丢弃，保证时间列有序
+            if last_t is not None and t == last_t:
+                # 同一快照里重复出现，以最后一次为准
+                if v_col:
+                    v_col[-1] = v
+                else:
+                    with open(v_path, "r+b") as f:
+                        f.seek(-v_col.itemsize, os.SEEK_END)
+                        array("d", [v]).tofile(f)
+                continue
+            t_col.append(t)
+            v_col.append(v)
+            last_t = t
+        with open(t_path, "ab") as f:
+            t_col.tofile(f)
+        with open(v_path, "ab") as f:
+            v_col.tofile(f)
+        info["last_t"] = last_t
+        written += len(t_col)
+
+    meta["section"] = section
+    meta["ts"] = snapshot_ts
+    _save_meta(mirror_path, meta)
+    return written
+
+
+def ingest_mirror_range(mirror_path: str, start: int, end: int) -> None:
+    """补建：按行边界读取镜像 [start, end) 解析（用于升级前已有的 .count 镜像）"""
+    pending = b""
+    for data in log_mirror_store.iter_range(mirror_path, start, end):
+        pending += data
+        cut = pending.rfind(b"\n") + 1
+        if cut == 0:
+            continue
+        ingest_chunk(mirror_path, pending[:cut].decode('utf-8', errors='replace'))
+        pending = pending[cut:]
+    if pending:
+        ingest_chunk(mirror_path, pending.decode('utf-8', errors='replace'))
+    logger.info(f"[COUNTER] Backfilled {mirror_path} [{start}, {end})")
+
+
+def list_counters(mirror_path: str) -> List[Dict[str, Any]]:
+    result = []
+    for name, info in sorted(_load_meta(mirror_path)["counters"].items()):
+        t_path, _ = _column_paths(mirror_path, info["id"])
+        samples = os.path.getsize(t_path) // 8 if os.path.exists(t_path) else 0
+        result.append({"name": name, "samples": samples, "last_time": info["last_t"]})
+    return result
+
+
+def _load_columns(mirror_path: str, counter_id: int) -> Tuple[array, array]:
+    t_col, v_col = array("d"), array("d")
+    t_path, v_path = _column_paths(mirror_path, counter_id)
+    for path, col in ((t_path, t_col), (v_path, v_col)):
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                col.frombytes(f.read())
+    n = min(len(t_col), len(v_col))  # 写入中途出错时两列长度可能不一致
+    return t_col[:n], v_col[:n]
+
+
+def _deltas(values: array, prev: Optional[float]) -> List[float]:
+    out = []
+    for v in values:
+        if prev is None:
+            out.append(0.0)
+        else:
+            out.append(v - prev if v >= prev else v)  # 变小视为计数器重置
+        prev = v
+    return out
+
+
+def query_series(mirror_path: str, name: str, start: Optional[float] = None, end: Optional[float] = None,
+                 step: Optional[float] = None, max_points: int = MAX_POINTS) -> Dict[str, Any]:
+    """
+    返回计数器在 [start, end] 内的序列。
+    不降采样时每个点为 {t, value, delta, rate}；指定 step（或点数超过 max_points 自动计算 step）时
+    按 step 秒分桶，每桶为 {t, value(桶内最后值), min, max, delta(桶内增量之和), rate(delta / step)}。
+    """
+    info = _load_meta(mirror_path)["counters"].get(name)
+    if info is None:
+        raise KeyError(f"Counter {name} not found")
+    t_col, v_col = _load_columns(mirror_path, info["id"])
+
+    lo = bisect.bisect_left(t_col, start) if start is not None else 0
+    hi = bisect.bisect_right(t_col, end) if end is not None else len(t_col)
+    times = t_col[lo:hi]
+    values = v_col[lo:hi]
+    deltas = _deltas(values, v_col[lo - 1] if lo > 0 else None)
+
+    if not times:
+        return {"name": name, "step": step, "points": []}
+
+    span = times[-1] - times[0]
+    if not step and len(times) > max_points:
+        step = math.ceil(span / max_points) or 1
+
+    points = []
+    if not step:
+        prev_t = t_col[lo - 1] if lo > 0 else None
+        for t, v, d in zip(times, values, deltas):
+            dt = t - prev_t if prev_t is not None else 0
+            points.append({"t": t, "value": v, "delta": d, "rate": d / dt if dt > 0 else None})
+            prev_t = t
+        return {"name": name, "step": None, "points": points}
+
+    bucket = None
+    for t, v, d in zip(times, values, deltas):
+        b = math.floor(t / step) * step
+        if bucket is None or bucket["t"] != b:
+            if bucket is not None:
+                bucket["rate"] = bucket["delta"] / step
+                points.append(bucket)
+            bucket = {"t": b, "value": v, "min": v, "max": v, "delta": 0.0}
+        bucket["value"] = v
+        bucket["min"] = min(bucket["min"], v)
+        bucket["max"] = max(bucket["max"], v)
+        bucket["delta"] += d
+    bucket["rate"] = bucket["delta"] / step
+    points.append(bucket)
+    return {"name": name, "step": step, "points": points}
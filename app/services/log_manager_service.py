@@ -2,32 +2,224 @@
 import os
 import json
 import re
+import bisect
+import hashlib
+import shlex
 import logging
 import traceback
-from typing import Dict, List, Tuple, Optional, Any
+import zlib
+from typing import AsyncIterator, Dict, List, Tuple, Optional, Any
 import asyncio
 
 
 
+from app.core.config import settings
 from app.dependencies.zabbix import get_zapi
 from app.services.async_ssh_pool import ssh_pool
+from app.utils import async_config_manager as cfg_mgr
+from app.services import log_mirror_store, log_search_service, log_time_index, log_counter_service, log_alert_service
 
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 CONFIG_DIR = os.path.join(BASE_DIR, 'net-conf')
 LOG_OFFSET_DIR = os.path.join(BASE_DIR, 'log-offsets')
 LOG_MIRROR_DIR = os.path.join(BASE_DIR, 'log-mirrors')
+LOG_RAW_MIRROR_DIR = os.path.join(BASE_DIR, 'log-mirrors-raw')  # 可选：保留未清洗的原始字节
 
 os.makedirs(LOG_OFFSET_DIR, exist_ok=True)
 os.makedirs(LOG_MIRROR_DIR, exist_ok=True)
 
 CHUNK_SIZE = 3000  # 1MB
+RAW_CHUNK_SIZE = 64 * 1024  # 原始区间读取时每次发送的块大小
+MAX_DELTA_BYTES = 256 * 1024  # 客户端游标落后超过该值时退回到最后一页
+MAX_BACKWARD_LINES = 20000  # 单次往前读取的行数上限
+MAX_BACKWARD_BYTES = 8 * 1024 * 1024  # 单次往前读取的字节上限
+HEAD_FINGERPRINT_BYTES = 1024  # 文件开头参与轮转指纹的字节数
+ROTATION_SEAL_MIN_BYTES = 64 * 1024  # 轮转时活动段不小于该值才单独封存，原地重写的小文件（如 .count）接着写在活动段里
 ANSI_ESCAPE_RE = re.compile(r'\x1B[@-_][0-?]*[ -/]*[@-~]')
 logger = logging.getLogger(__name__)
 
+try:
+    import zstandard
+except ImportError:  # 没装 zstandard 时 zstd 方式退回 gzip
+    zstandard = None
+
 
 def strip_ansi_codes(text: str) -> str:
     return ANSI_ESCAPE_RE.sub('', text)
 
+def cursor_key(ip: str, log_dir: str, log_file: str) -> str:
+    """客户端游标的键：{ip}:{log_dir}/{log_file}"""
+    return f"{ip}:{os.path.join(log_dir, log_file)}"
+
+def parse_offset_info(info: Any) -> Tuple[int, List[int]]:
+    """返回镜像文件的已提交长度和分页表；offset 是远端文件的读取位置，mirror_offset 才是镜像坐标"""
+    if isinstance(info, int):
+        return info, []
+    return info.get("mirror_offset", info.get("offset", 0)), info.get("pages", [])
+
+def raw_mirror_path(mirror_path: str) -> str:
+    return os.path.join(LOG_RAW_MIRROR_DIR, os.path.relpath(mirror_path, LOG_MIRROR_DIR))
+
+def append_raw_mirror(mirror_path: str, data: bytes, truncate: bool = False) -> None:
+    path = raw_mirror_path(mirror_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb' if truncate else 'ab') as f:
+        f.write(data)
+
+def clean_legacy_mirror(mirror_path: str, lines_per_page: int) -> Dict[str, Any]:
+    """
+    把旧格式（保存了 ANSI 控制码）的镜像逐行清洗成新格式，并按清洗后的字节重新计算分页。
+    只在升级后第一次拉取时执行一次。
+    """
+    pages = [0]
+    mirror_offset = 0
+    residual_lines = 0
+    if os.path.exists(mirror_path):
+        tmp_path = mirror_path + ".clean"
+        with open(mirror_path, "rb") as src, open(tmp_path, "wb") as dst:
+            for raw_line in src:
+                line = strip_ansi_codes(raw_line.decode("utf-8", errors="replace")).encode("utf-8")
+                dst.write(line)
+                mirror_offset += len(line)
+                residual_lines += 1
+                if residual_lines == lines_per_page:
+                    pages.append(mirror_offset)
+                    residual_lines = 0
+        os.replace(tmp_path, mirror_path)
+        logger.info(f"[FETCH] Cleaned legacy mirror {mirror_path}: mirror_offset={mirror_offset}, pages={len(pages)}")
+
+    prev_page_start = 0
+    last = 0
+    for p in pages:
+        if p >= mirror_offset:
+            break
+        prev_page_start = last
+        last = p
+    return {
+        "mirror_offset": mirror_offset,
+        "pages": pages,
+        "prev_page_start": prev_page_start,
+        "residual_lines": residual_lines
+    }
+
+def last_page_start(offset: int, pages: List[int]) -> int:
+    start = 0
+    for p in sorted(pages):
+        if p >= offset:
+            break
+        start = p
+    return start
+
+def read_mirror_slice(path: str, start: int, end: int) -> str:
+    return log_mirror_store.read_range(path, start, end).decode("utf-8", errors="replace")
+
+def read_mirror_delta(path: str, offset: int, pages: List[int], cursor: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    按客户端游标读取镜像文件：
+    - cursor == offset：没有新内容，返回 None
+    - 0 <= cursor < offset 且差值不超过 MAX_DELTA_BYTES：只返回游标之后的字节（delta=True）
+    - 其它情况（无游标、游标越界、落后太多）：返回最后一页（delta=False），客户端应整体替换
+    """
+    if cursor is not None and cursor == offset:
+        return None
+
+    if cursor is not None and 0 <= cursor < offset and offset - cursor <= MAX_DELTA_BYTES:
+        start = cursor
+        delta = True
+    else:
+        start = last_page_start(offset, pages)
+        delta = False
+
+    return {
+        "content": read_mirror_slice(path, start, offset),
+        "start_offset": start,
+        "end_offset": offset,
+        "delta": delta
+    }
+
+def locate_mirror(group_id: str, host_ip: str, log_dir: str, log_file: str) -> Tuple[str, int]:
+    """返回镜像文件路径和已提交的偏移（只对外提供完整行），找不到时抛 FileNotFoundError"""
+    if not log_file or os.path.basename(log_file) != log_file:
+        raise FileNotFoundError(f"Invalid log file name: {log_file}")
+
+    dir_part = log_dir.lstrip("/")
+    offset_path = os.path.join(LOG_OFFSET_DIR, f"group_{group_id}_{host_ip}_{dir_part.replace('/', '_')}.json")
+    mirror_path = os.path.realpath(os.path.join(LOG_MIRROR_DIR, f"group_{group_id}_{host_ip}", dir_part, log_file))
+    if not mirror_path.startswith(os.path.realpath(LOG_MIRROR_DIR) + os.sep):
+        raise FileNotFoundError(f"Invalid log path: {log_dir}/{log_file}")
+    if not os.path.exists(mirror_path):
+        raise FileNotFoundError(f"Log file {log_file} not found")
+
+    info = load_or_init_offsets(offset_path).get(log_file)
+    if info is None:
+        raise FileNotFoundError(f"Offset metadata not found for {log_file}")
+    offset, _ = parse_offset_info(info)
+    return mirror_path, offset
+
+def mirror_etag(path: str, end: int) -> str:
+    # 镜像只追加，已提交长度 + mtime 即可唯一标识内容；截断重建后 mtime 会变化
+    st = os.stat(path)
+    base = f"{st.st_ino}-{st.st_mtime_ns}-{end}"
+    return '"' + hashlib.md5(base.encode()).hexdigest() + '"'
+
+def iter_mirror_range(path: str, start: int, end: int, chunk_size: int = RAW_CHUNK_SIZE):
+    """按块从磁盘读取 [start, end)，内存中最多只有一个块"""
+    return log_mirror_store.iter_range(path, start, end, chunk_size)
+
+async def remote_file_inodes(ssh, log_dir: str) -> Dict[str, int]:
+    """一次 exec 取目录下日志文件的 inode（SFTP 的 stat 不带 inode），失败时返回空，只靠开头指纹判断轮转"""
+    cmd = f"cd {shlex.quote(log_dir)} && stat -c '%i %n' -- *.log *.count 2>/dev/null"
+    try:
+        result = await ssh.run(cmd, check=False, timeout=10)
+    except Exception as e:
+        logger.warning(f"[FETCH] Failed to stat {log_dir} for inodes: {e}")
+        return {}
+    inodes = {}
+    for line in (result.stdout or "").splitlines():
+        inode, _, name = line.partition(" ")
+        if inode.isdigit() and name:
+            inodes[name] = int(inode)
+    return inodes
+
+def resolve_transfer_mode(host_cfg: Optional[Dict[str, Any]]) -> str:
+    mode = (host_cfg or {}).get("log_transfer") or settings.LOG_TRANSFER_MODE
+    if mode == "zstd" and zstandard is None:
+        return "gzip"
+    return mode if mode in ("gzip", "zstd") else "sftp"
+
+async def fetch_range_compressed(ssh, remote_path: str, offset: int, length: int, mode: str) -> Tuple[bytes, int]:
+    """
+    通过 exec 通道拉取远端 [offset, offset + length)：远端 tail | head 截出区间后压缩，
+    本地边收边解压。返回 (明文, 实际传输的压缩字节数)。
+    """
+    compressor = "zstd -1 -c -q" if mode == "zstd" else "gzip -1 -c"
+    cmd = f"tail -c +{offset + 1} -- {shlex.quote(remote_path)} | head -c {int(length)} | {compressor}"
+    if mode == "zstd":
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    else:
+        decompressor = zlib.decompressobj(wbits=31)
+
+    out = bytearray()
+    wire_bytes = 0
+    async with ssh.create_process(cmd, encoding=None) as proc:
+        while True:
+            block = await proc.stdout.read(RAW_CHUNK_SIZE)
+            if not block:
+                break
+            wire_bytes += len(block)
+            out += decompressor.decompress(block)
+        await proc.wait()
+        if proc.exit_status not in (0, None):
+            stderr = await proc.stderr.read()
+            raise RuntimeError(f"remote {mode} transfer failed ({proc.exit_status}): {stderr!r}")
+    if mode != "zstd":
+        out += decompressor.flush()
+    return bytes(out), wire_bytes
+
+async def read_remote_head(sftp, remote_path: str, length: int) -> bytes:
+    async with await sftp.open(remote_path, 'rb') as f:
+        return await f.read(length)
+
 def find_config_by_group_id(group_id: str) -> Optional[Dict[str, Any]]:
     for fname in os.listdir(CONFIG_DIR):
         if not fname.endswith('.json'):
@@ -127,7 +319,10 @@ class LogManagerService:
                     errors.append({"host": ip, "error": "Managed SSH connection not found"})
                     continue
 
+                transfer_mode = resolve_transfer_mode(await cfg_mgr.get_host_config(ip))
+
                 async with managed_conn.channel_lock:
+                    inodes = await remote_file_inodes(ssh, log_dir)
                     async with await ssh.start_sftp_client() as sftp:
                         remote_files = [f for f in await sftp.listdir(log_dir) if f.endswith(('.log', '.count'))]
 
@@ -137,40 +332,126 @@ class LogManagerService:
 
                             offset_info = offsets.get(log_file, {})
                             if isinstance(offset_info, int):
-                                offset = offset_info
-                                pages = []
-                            else:
-                                offset = offset_info.get("offset", 0)
-                                pages = offset_info.get("pages", [])
-
+                                offset_info = {"offset": offset_info}
+                            if offset_info.get("offset", 0) and "mirror_offset" not in offset_info:
+                                # 旧格式镜像（带 ANSI、偏移与远端一致），先一次性清洗
+                                offset_info.update(clean_legacy_mirror(mirror_path, lines_per_page))
+                            offset = offset_info.get("offset", 0)
+                            mirror_offset = offset_info.get("mirror_offset", offset)
+                            pages = offset_info.get("pages", [])
+                            residual_lines = offset_info.get("residual_lines", 0)
 
                             stat = await sftp.stat(remote_path)
+                            open(mirror_path, 'ab').close()
+                            inode = inodes.get(log_file)
+                            mtime = int(stat.mtime or 0)
+                            head_len = offset_info.get("head_len", 0)
+                            head_hash = offset_info.get("head_hash")
+                            # 上次核对过指纹时文件的 (inode, 大小, mtime)，没变就不再读远端开头（追赶积压时每轮都会走到这里）
+                            head_checked = [inode, stat.size, mtime]
+
+                            # ---------- 轮转检测：截断、inode 变化或文件开头内容变化 ----------
+                            rotated = None
                             if stat.size < offset:
-                                logger.warning(f"[FETCH] Offset reset due to file truncation: {remote_path}")
+                                rotated = "file truncated"
+                            elif inode and offset_info.get("inode") and inode != offset_info["inode"]:
+                                rotated = f"inode changed {offset_info['inode']} -> {inode}"
+                            elif offset and (stat.size != offset or mtime != offset_info.get("mtime")) \
+                                    and offset_info.get("head_checked") != head_checked:
+                                if head_len:
+                                    head = await read_remote_head(sftp, remote_path, head_len)
+                                    if hashlib.sha1(head).hexdigest() != head_hash:
+                                        rotated = "head fingerprint changed"
+                                else:
+                                    # 旧版本没有记录指纹，以当前文件开头为准补上
+                                    head = await read_remote_head(sftp, remote_path, min(HEAD_FINGERPRINT_BYTES, offset))
+                                    head_len, head_hash = len(head), hashlib.sha1(head).hexdigest()
+
+                            if rotated:
+                                # 镜像逻辑偏移和分页继续往后接，新文件从 0 开始跟；
+                                # 旧文件末尾没有换行、推迟到下次拉取的那一行已经拉不到了，按一行补进镜像
+                                async with log_mirror_store.mirror_lock(mirror_path):
+                                    tail = offset_info.get("partial_tail")
+                                    if tail:
+                                        tail_content = strip_ansi_codes(tail) + "\n"
+                                        tail_data = tail_content.encode('utf-8')
+                                        with open(mirror_path, 'ab') as mf:
+                                            mf.write(tail_data)
+                                        if settings.LOG_MIRROR_KEEP_RAW:
+                                            append_raw_mirror(mirror_path, tail.encode('utf-8') + b"\n")
+                                        mirror_offset += len(tail_data)
+                                        residual_lines += 1
+                                        if residual_lines == lines_per_page:
+                                            pages.append(mirror_offset)
+                                            residual_lines = 0
+                                        try:
+                                            log_alert_service.scan_chunk(group_id, ip, log_file, tail_content)
+                                        except Exception as e:
+                                            logger.error(f"[FETCH] Log alert rules failed on {mirror_path}: {e}")
+                                    # 旧文件的内容够大时封存为独立的段；原地重写的小文件不值得每次切出一个段
+                                    seal = os.path.getsize(mirror_path) >= ROTATION_SEAL_MIN_BYTES
+                                    if seal:
+                                        await asyncio.to_thread(log_mirror_store.seal_active_segment, mirror_path, mirror_offset)
+                                logger.warning(
+                                    f"[FETCH] Rotation detected for {remote_path} ({rotated}), "
+                                    f"{'sealed' if seal else 'continuing'} mirror at {mirror_offset}, following new file from 0"
+                                )
                                 offset = 0
-                                pages = [0]
-                                residual_lines = 0 
-                                open(mirror_path, 'w', encoding='utf-8').close()
-                            else:
-                                open(mirror_path, 'a', encoding='utf-8').close()
+                                head_len, head_hash = 0, None
+                                offset_info.update({"offset": 0, "mirror_offset": mirror_offset, "pages": pages,
+                                                    "residual_lines": residual_lines, "partial_tail": None, "inode": inode,
+                                                    "mtime": mtime, "head_len": 0, "head_hash": None})
+                                offsets[log_file] = offset_info
+
+                            indexed_offset = offset_info.get("indexed_offset", 0) if mirror_offset else 0
+                            if indexed_offset < mirror_offset:
+                                # 镜像中还有没进索引的内容（升级前的镜像或上次写索引失败），先补建
+                                try:
+                                    await asyncio.to_thread(
+                                        log_search_service.index_mirror_range, group_id, ip, log_dir, log_file, mirror_path,
+                                        max(indexed_offset, log_mirror_store.available_start(mirror_path)), mirror_offset
+                                    )
+                                    indexed_offset = mirror_offset
+                                    offset_info["indexed_offset"] = indexed_offset
+                                except Exception as e:
+                                    logger.error(f"[FETCH] Failed to backfill index of {mirror_path}: {e}")
+
+                            time_indexed_offset = offset_info.get("time_indexed_offset", 0) if mirror_offset else 0
+                            if time_indexed_offset < mirror_offset:
+                                try:
+                                    await asyncio.to_thread(
+                                        log_time_index.index_mirror_range, mirror_path,
+                                        max(time_indexed_offset, log_mirror_store.available_start(mirror_path)), mirror_offset
+                                    )
+                                    time_indexed_offset = mirror_offset
+                                    offset_info["time_indexed_offset"] = time_indexed_offset
+                                except Exception as e:
+                                    logger.error(f"[FETCH] Failed to backfill time index of {mirror_path}: {e}")
+
+                            counters_offset = offset_info.get("counters_offset", 0) if mirror_offset else 0
+                            if log_file.endswith('.count') and counters_offset < mirror_offset:
+                                try:
+                                    await asyncio.to_thread(
+                                        log_counter_service.ingest_mirror_range, mirror_path,
+                                        max(counters_offset, log_mirror_store.available_start(mirror_path)), mirror_offset
+                                    )
+                                    counters_offset = mirror_offset
+                                    offset_info["counters_offset"] = counters_offset
+                                except Exception as e:
+                                    logger.error(f"[FETCH] Failed to backfill counters of {mirror_path}: {e}")
+
+                            if log_file in offsets:
+                                offset_info.update({"inode": inode, "mtime": mtime, "head_len": head_len, "head_hash": head_hash,
+                                                    "head_checked": head_checked})
+                                offsets[log_file] = offset_info
 
                             if stat.size == offset:
                                 logger.info(f"[FETCH] File {log_file} has no new content. Returning last page from prev_page_start.")
-
-                                prev_page_start = 0
-                                if isinstance(offset_info, dict):
-                                    prev_page_start = offset_info.get("prev_page_start", 0)
-                                    residual_lines = offset_info.get("residual_lines", 0)
-                                else:
-                                    residual_lines = 0
+                                prev_page_start = offset_info.get("prev_page_start", 0)
 
                                 try:
-                                    with open(mirror_path, 'r', encoding='utf-8') as mf:
-                                        mf.seek(prev_page_start)
-                                        page_data = mf.read(offset - prev_page_start)
-
                                     logs[log_file] = {
-                                        "content": strip_ansi_codes(page_data),
+                                        "content": read_mirror_slice(mirror_path, prev_page_start, mirror_offset),
                                         "start_offset": prev_page_start,
                                         "residual_lines": residual_lines,
                                         "is_end": True
@@ -181,39 +462,83 @@ class LogManagerService:
                                 
                                 continue
 
-                            async with await sftp.open(remote_path, 'rb') as f:
-                                await f.seek(offset)
-                                data = await f.read(CHUNK_SIZE)
-
-                            content = data.decode('utf-8', errors='replace') if isinstance(data, bytes) else data
-
+                            data = b''
+                            if transfer_mode != "sftp":
+                                try:
+                                    data, wire_bytes = await fetch_range_compressed(
+                                        ssh, remote_path, offset, min(stat.size - offset, settings.LOG_COMPRESSED_CHUNK_SIZE), transfer_mode
+                                    )
+                                    logger.info(f"[FETCH] {transfer_mode} transfer of {log_file}: {wire_bytes} bytes on wire -> {len(data)} bytes")
+                                except Exception as e:
+                                    logger.warning(f"[FETCH] Compressed transfer failed for {remote_path}, falling back to SFTP: {e}")
+                                    data = b''
+                            if not data:
+                                async with await sftp.open(remote_path, 'rb') as f:
+                                    await f.seek(offset)
+                                    data = await f.read(CHUNK_SIZE)
+
+                            if offset == 0:
+                                head = data[:HEAD_FINGERPRINT_BYTES]
+                                head_len, head_hash = len(head), hashlib.sha1(head).hexdigest()
+
+                            # 只处理完整的行：最后一行如果不完整（没有 \n），按字节截掉，留到下次拉取
+                            cut = max(data.rfind(b'\n'), data.rfind(b'\r')) + 1
+                            partial_tail = None
+                            if cut < len(data):
+                                logger.info(f"[PAGING] Last line is partial, will defer to next fetch: {data[cut:]!r}")
+                                if offset + len(data) >= stat.size:
+                                    # 读到了文件末尾：记下这段残行，文件在下次拉取前轮转时用它补上最后一行
+                                    partial_tail = data[cut:].decode('utf-8', errors='replace')
+                                data = data[:cut]
+
+                            # ANSI 只在入库时清洗一次，镜像文件保存清洗后的内容，分页偏移以清洗后的镜像为准
+                            content = strip_ansi_codes(data.decode('utf-8', errors='replace'))
+                            clean_data = content.encode('utf-8')
 
                             # ---------- 分页处理 ----------
-                            curr_offset = offset
+                            curr_offset = mirror_offset
                             new_pages = []
-                            residual_lines = offset_info.get("residual_lines", 0)
 
                             logger.info(
                                 f"[PAGING] Start processing file: {log_file} | "
-                                f"initial_offset={offset}, existing_residual_lines={residual_lines}"
+                                f"initial_offset={offset}, mirror_offset={mirror_offset}, existing_residual_lines={residual_lines}"
                             )
 
-                            lines = content.splitlines(True)
-
-                            # 检查最后一行是否不完整（没有 \n），就临时去掉，不计入分页
-                            if lines and not lines[-1].endswith(('\n', '\r')):
-                                partial_line = lines.pop()
-                                partial_line_bytes = partial_line.encode('utf-8', errors='replace')
-                                content = content[:-len(partial_line)]  # 从原始字符串也删掉它
-                                data = data[:-len(partial_line_bytes)]  # 同时修剪 byte 数据，确保 offset 精确
-                                logger.info(f"[PAGING] Last line is partial, will defer to next fetch: {repr(partial_line)}")
-
-                            with open(mirror_path, 'a', encoding='utf-8') as mf:
-                                mf.write(content)
+                            async with log_mirror_store.mirror_lock(mirror_path):
+                                with open(mirror_path, 'ab') as mf:
+                                    mf.write(clean_data)
+                                await asyncio.to_thread(log_mirror_store.maybe_seal, mirror_path, mirror_offset + len(clean_data))
+                            if settings.LOG_MIRROR_KEEP_RAW:
+                                append_raw_mirror(mirror_path, data)
+                            try:
+                                if indexed_offset == mirror_offset:
+                                    await asyncio.to_thread(
+                                        log_search_service.index_chunk,
+                                        group_id, ip, log_dir, log_file, mirror_path, mirror_offset, content
+                                    )
+                                    indexed_offset = mirror_offset + len(clean_data)
+                            except Exception as e:
+                                logger.error(f"[FETCH] Failed to index new content of {mirror_path}: {e}")
+                            try:
+                                if time_indexed_offset == mirror_offset:
+                                    await asyncio.to_thread(log_time_index.index_chunk, mirror_path, mirror_offset, content)
+                                    time_indexed_offset = mirror_offset + len(clean_data)
+                            except Exception as e:
+                                logger.error(f"[FETCH] Failed to update time index of {mirror_path}: {e}")
+                            try:
+                                log_alert_service.scan_chunk(group_id, ip, log_file, content)
+                            except Exception as e:
+                                logger.error(f"[FETCH] Log alert rules failed on {mirror_path}: {e}")
+                            if log_file.endswith('.count'):
+                                try:
+                                    if counters_offset == mirror_offset:
+                                        await asyncio.to_thread(log_counter_service.ingest_chunk, mirror_path, content)
+                                        counters_offset = mirror_offset + len(clean_data)
+                                except Exception as e:
+                                    logger.error(f"[FETCH] Failed to parse counters of {mirror_path}: {e}")
 
-                            for line in lines:
-                                line_bytes = line.encode('utf-8', errors='replace')
-                                curr_offset += len(line_bytes)
+                            for line in content.splitlines(True):
+                                curr_offset += len(line.encode('utf-8'))
                                 residual_lines += 1
 
                                 if residual_lines == lines_per_page:
@@ -227,42 +552,52 @@ class LogManagerService:
                             if 0 not in pages:
                                 pages.insert(0, 0)
                             new_offset = offset + len(data)
+                            new_mirror_offset = mirror_offset + len(clean_data)
                             logger.info(
                                 f"[PAGING] Finished file: {log_file} | "
-                                f"bytes_read={len(data)}, new_offset={new_offset}, "
+                                f"bytes_read={len(data)}, new_offset={new_offset}, new_mirror_offset={new_mirror_offset}, "
                                 f"new_pages_added={len(new_pages)}, residual_lines_left={residual_lines}"
                             )
 
                             prev_page_start = 0
                             last = 0
                             for p in pages:
-                                if p >= new_offset:
+                                if p >= new_mirror_offset:
                                     break
                                 prev_page_start = last
                                 last = p
 
                             offsets[log_file] = {
                                 "offset": new_offset,
+                                "mirror_offset": new_mirror_offset,
                                 "pages": pages,
                                 "prev_page_start": prev_page_start,
-                                "residual_lines": residual_lines
+                                "residual_lines": residual_lines,
+                                "indexed_offset": indexed_offset,
+                                "time_indexed_offset": time_indexed_offset,
+                                "counters_offset": counters_offset,
+                                "inode": inode,
+                                "mtime": mtime,
+                                "head_len": head_len,
+                                "head_hash": head_hash,
+                                "head_checked": head_checked,
+                                "partial_tail": partial_tail
                             }
 
                             logger.info(f"[FETCH] Updated offset for {log_file}: offset={new_offset}, prev_start={prev_page_start}")
                             logs[log_file] = {
-                                "content": strip_ansi_codes(content),
+                                "content": content,
                                 "start_offset": prev_page_start,
                                 "residual_lines": residual_lines,
                                 "is_end": False
                             }
+                            if rotated:
+                                logs[log_file]["rotated"] = True
 
                             if fetch_prev_page == 1:
                                 try:
-                                    with open(mirror_path, 'r', encoding='utf-8') as mf:
-                                        mf.seek(prev_page_start)
-                                        full_data = mf.read(new_offset - prev_page_start)
-                                    logs[log_file]["content"] = strip_ansi_codes(full_data)
-                                    logger.info(f"[FETCH] fetch_prev_page==1 生效，返回内容从 prev_page_start={prev_page_start} 到 new_offset={new_offset}")
+                                    logs[log_file]["content"] = read_mirror_slice(mirror_path, prev_page_start, new_mirror_offset)
+                                    logger.info(f"[FETCH] fetch_prev_page==1 生效，返回内容从 prev_page_start={prev_page_start} 到 new_mirror_offset={new_mirror_offset}")
                                 except Exception as e:
                                     logger.info(f"[FETCH] fetch_prev_page==1 读取扩展内容失败: {e}")
 
@@ -270,7 +605,11 @@ class LogManagerService:
                         local_files = [f for f in os.listdir(mirror_dir) if f.endswith(('.log', '.count'))]
                         for local_file in local_files:
                             if local_file not in remote_files:
-                                os.remove(os.path.join(mirror_dir, local_file))
+                                log_search_service.drop_file_blocks(group_id, os.path.join(mirror_dir, local_file))
+                                log_mirror_store.remove_mirror(os.path.join(mirror_dir, local_file))
+                                raw_path = raw_mirror_path(os.path.join(mirror_dir, local_file))
+                                if os.path.exists(raw_path):
+                                    os.remove(raw_path)
                                 offsets.pop(local_file, None)
                                 logger.info(f"[FETCH] Removed stale local file: {local_file}")
 
@@ -290,18 +629,22 @@ class LogManagerService:
 
 
     @classmethod
-    async def read_full_group_logs(cls, group_id: str) -> Dict[str, Any]:
+    async def iter_full_group_logs(cls, group_id: str, cursors: Optional[Dict[str, int]] = None,
+                                   new_cursors: Optional[Dict[str, int]] = None) -> AsyncIterator[Tuple[str, Optional[str], Dict[str, Any]]]:
+        """
+        逐个文件读取整组日志，读到一个产出一个：(f"{ip}:{log_dir}", log_file, entry)；
+        主机出错时产出 (f"{ip}:{log_dir}", None, {"host", "error"})。
+        new_cursors 不为空时把每个文件的最新偏移写进去。内存中同时只有一页内容。
+        """
         logger.info(f"[READ] Start reading full group logs for group_id={group_id}")
         hosts = await cls.get_hosts_for_group(group_id)
-        result = {}
-        errors = []
 
         for ip, log_dir in hosts:
             logger.info(f"[READ] Processing host={ip}, log_dir={log_dir}")
             dir_part = log_dir.lstrip("/")
             offset_path = os.path.join(LOG_OFFSET_DIR, f"group_{group_id}_{ip}_{dir_part.replace('/', '_')}.json")
             mirror_dir = os.path.join(LOG_MIRROR_DIR, f"group_{group_id}_{ip}", dir_part)
-            logs = {}
+            host_key = f"{ip}:{log_dir}"
 
             if not os.path.exists(offset_path):
                 logger.warning(f"[READ] Offset file missing: {offset_path}, skipping host={ip}")
@@ -311,12 +654,7 @@ class LogManagerService:
                 offsets = load_or_init_offsets(offset_path)
 
                 for log_file, info in offsets.items():
-                    if isinstance(info, int):
-                        offset = info
-                        pages = []
-                    else:
-                        offset = info.get("offset", 0)
-                        pages = info.get("pages", [])
+                    offset, pages = parse_offset_info(info)
 
                     if offset == 0:
                         logger.debug(f"[READ] Offset for {log_file} is 0, skipping")
@@ -327,43 +665,51 @@ class LogManagerService:
                         logger.warning(f"[READ] Local mirror missing: {local_path}, skipping file")
                         continue
 
-                    start = 0
-                    if pages:
-                        pages = sorted(pages)
-                        for i in range(len(pages)):
-                            if pages[i] >= offset:
-                                break
-                            start = pages[i]
+                    key = cursor_key(ip, log_dir, log_file)
+                    if new_cursors is not None:
+                        new_cursors[key] = offset
+                    cursor = cursors.get(key) if cursors else None
 
-                    logger.debug(f"[READ] Reading file={log_file}, start={start}, offset={offset}, path={local_path}")
-
-                    with open(local_path, "rb") as f:
-                        f.seek(start)
-                        data = f.read(offset - start)
-                        content = data.decode("utf-8", errors="replace")
-
-                    logs[log_file] = {
-                        "content": strip_ansi_codes(content),
-                        "start_offset": start,
-                        "end_offset": offset
-                    }
-
-                    logger.info(f"[READ] Finished reading {log_file}, read_size={offset - start} bytes")
+                    entry = await asyncio.to_thread(read_mirror_delta, local_path, offset, pages, cursor)
+                    if entry is None:
+                        logger.debug(f"[READ] {log_file} not modified since cursor={cursor}")
+                        continue
 
-                if logs:
-                    result[f"{ip}:{log_dir}"] = logs
+                    logger.info(f"[READ] Finished reading {log_file}, read_size={offset - entry['start_offset']} bytes, delta={entry['delta']}")
+                    yield host_key, log_file, entry
 
             except Exception as e:
                 logger.error(f"[READ] Error reading logs for group {group_id}, host {ip}: {e}")
                 logger.error(traceback.format_exc())
-                errors.append({"host": ip, "error": str(e)})
+                yield host_key, None, {"host": ip, "error": str(e)}
 
         logger.info(f"[READ] Completed log reading for group_id={group_id}")
-        return {"logs": result, "errors": errors}
 
 
     @classmethod
-    async def read_single_log(cls, group_id: str, host_ip: str, log_dir: str, log_file: str) -> Dict[str, Any]:
+    async def read_full_group_logs(cls, group_id: str, cursors: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """
+        读取整组日志。传入 cursors（cursor_key -> 客户端已读到的偏移）时只返回游标之后的增量，
+        并在结果中带回新的 cursors；文件集合与 cursors 相同且全部文件都没有变化时直接返回 {"not_modified": True}
+        （有文件被删除时要返回新的 cursors，客户端才知道去掉它）。
+        """
+        result = {}
+        errors = []
+        new_cursors = {}
+
+        async for host_key, log_file, item in cls.iter_full_group_logs(group_id, cursors, new_cursors):
+            if log_file is None:
+                errors.append(item)
+            else:
+                result.setdefault(host_key, {})[log_file] = item
+
+        if cursors is not None and not result and not errors and set(cursors) == set(new_cursors):
+            return {"not_modified": True}
+        return {"logs": result, "errors": errors, "cursors": new_cursors}
+
+
+    @classmethod
+    async def read_single_log(cls, group_id: str, host_ip: str, log_dir: str, log_file: str, cursor: Optional[int] = None) -> Dict[str, Any]:
         logger.info(f"[READ_SINGLE] Start reading single log: {host_ip} {log_dir} {log_file}")
 
         dir_part = log_dir.lstrip("/")
@@ -389,12 +735,7 @@ class LogManagerService:
                 logger.warning(f"[READ_SINGLE] {error_msg}")
                 return {"logs": {}, "errors": [{"host": host_ip, "error": error_msg}]}
 
-            if isinstance(info, int):
-                offset = info
-                pages = []
-            else:
-                offset = info.get("offset", 0)
-                pages = info.get("pages", [])
+            offset, pages = parse_offset_info(info)
 
             if offset == 0:
                 logger.debug(f"[READ_SINGLE] Offset for {log_file} is 0, no new content.")
@@ -403,39 +744,19 @@ class LogManagerService:
                     "errors": []
                 }
 
-            start = 0
-            if pages:
-                pages = sorted(pages)
-                # 找到满足读取内容长度 > 一页 且 < 两页的 start 和 offset
-                # 先找到offset前面的那个页作为start，然后向前看一个页作为start的下界，保证长度
-                for i in range(len(pages)):
-                    if pages[i] >= offset:
-                        break
-                    start = pages[i]
-
+            logger.debug(f"[READ_SINGLE] Reading file={log_file}, cursor={cursor}, offset={offset}, path={local_path}")
 
-            logger.debug(f"[READ_SINGLE] Reading file={log_file}, start={start}, offset={offset}, path={local_path}")
-
-            with open(local_path, "rb") as f:
-                f.seek(start)
-                data = f.read(offset - start)
-                content = data.decode("utf-8", errors="replace")
+            entry = read_mirror_delta(local_path, offset, pages, cursor)
+            if entry is None:
+                return {"not_modified": True, "cursor": offset}
 
             log_key = f"{host_ip}:{log_dir}"
-
-            logs = {
-                log_key: {
-                    log_file: {
-                        "content": strip_ansi_codes(content),
-                        "start_offset": start,
-                        "end_offset": offset
-                    }
-                }
-            }
+            logs = {log_key: {log_file: entry}}
+            start = entry["start_offset"]
 
             logger.info(f"[READ_SINGLE] Finished reading {log_file}, read_size={offset - start} bytes")
 
-            return {"logs": logs, "errors": []}
+            return {"logs": logs, "errors": [], "cursor": offset}
 
         except Exception as e:
             logger.error(f"[READ_SINGLE] Error reading single log {log_file}: {e}")
@@ -483,12 +804,12 @@ class LogManagerService:
                 return {"logs": {}, "errors": [], "start_offset": offset}
 
             prev_page_start = pages[idx - 1]
+            if prev_page_start < log_mirror_store.available_start(mirror_path):
+                # 更早的数据已被保留策略淘汰
+                logger.info(f"[OLDER] Page {prev_page_start}-{offset} of {filename} has been evicted by retention")
+                return {"logs": {}, "errors": [], "start_offset": offset, "evicted": True}
 
-            with open(mirror_path, "rb") as f:
-                f.seek(prev_page_start)
-                chunk = f.read(offset - prev_page_start)
-
-            content = strip_ansi_codes(chunk.decode('utf-8', errors='replace'))
+            content = read_mirror_slice(mirror_path, prev_page_start, offset)
 
             log_key = f"{host_ip}:{log_dir}"
             result = {
@@ -512,3 +833,146 @@ class LogManagerService:
             logger.error(traceback.format_exc())
             errors.append({"host": host_ip, "error": str(e)})
             return {"logs": {}, "errors": errors, "start_offset": 0}
+
+
+    @classmethod
+    async def read_lines_before(cls, group_id: str, filename: str, host_ip: str, log_dir: str, offset: int,
+                                lines: Optional[int] = None, pages: Optional[int] = None,
+                                lines_per_page: int = 40) -> Dict[str, Any]:
+        """
+        返回 offset 之前的 lines 行（或 pages * lines_per_page 行），一次调用可以往前翻多页。
+        offset 可以是任意偏移，会先对齐到所在行的行首；不依赖分页表，倒序按块读镜像。
+        """
+        n_lines = min(lines if lines else (pages or 1) * lines_per_page, MAX_BACKWARD_LINES)
+        logger.info(f"[OLDER] Reading {n_lines} lines before {offset} of {host_ip}:{log_dir}/{filename}")
+        try:
+            mirror_path, committed = locate_mirror(group_id, host_ip, log_dir, filename)
+            floor = log_mirror_store.available_start(mirror_path)
+            end = min(max(offset, 0), committed)
+
+            def read():
+                aligned = log_mirror_store.line_start_at(mirror_path, end, floor)
+                start = log_mirror_store.seek_lines_back(mirror_path, aligned, n_lines, floor, MAX_BACKWARD_BYTES)
+                return aligned, start, read_mirror_slice(mirror_path, start, aligned)
+
+            end, start, content = await asyncio.to_thread(read)
+            entry = {
+                "content": content,
+                "start_offset": start,
+                "end_offset": end,
+                "lines": content.count("\n"),
+                "is_start": start <= floor
+            }
+            if start <= floor and floor > 0:
+                entry["evicted"] = True  # 更早的数据已被保留策略淘汰
+            logger.info(f"[OLDER] Loaded {entry['lines']} lines: {start}-{end}")
+            return {"logs": {f"{host_ip}:{log_dir}": {filename: entry}}, "errors": []}
+
+        except FileNotFoundError as e:
+            logger.warning(f"[OLDER] {e}")
+            return {"logs": {}, "errors": [{"host": host_ip, "error": str(e)}]}
+        except Exception as e:
+            logger.error(f"[OLDER] Error reading lines before {offset} for {host_ip}: {e}")
+            logger.error(traceback.format_exc())
+            return {"logs": {}, "errors": [{"host": host_ip, "error": str(e)}], "start_offset": 0}
+
+
+    @classmethod
+    async def search_logs(cls, group_id: str, query: str, host_ip: Optional[str] = None, log_dir: Optional[str] = None,
+                          log_file: Optional[str] = None, start_time: Optional[float] = None,
+                          end_time: Optional[float] = None, limit: int = 100) -> Dict[str, Any]:
+        """
+        在组内已镜像的日志中全文检索。每条命中带上所在页 [page_start, page_end)：
+        page_end 在分页表中时可以直接作为 load_older_logs 的 offset 取回这一页。
+        """
+        logger.info(f"[SEARCH] group_id={group_id}, query={query!r}, host={host_ip}, dir={log_dir}, file={log_file}")
+        result = await asyncio.to_thread(
+            log_search_service.search, group_id, query, host_ip, log_dir, log_file, start_time, end_time, limit
+        )
+
+        pages_cache: Dict[Tuple[str, str, str], Tuple[List[int], int]] = {}
+        for hit in result["hits"]:
+            key = (hit["host_ip"], hit["log_dir"], hit["log_file"])
+            if key not in pages_cache:
+                dir_part = hit["log_dir"].lstrip("/")
+                offset_path = os.path.join(LOG_OFFSET_DIR, f"group_{group_id}_{hit['host_ip']}_{dir_part.replace('/', '_')}.json")
+                end, pages = parse_offset_info(load_or_init_offsets(offset_path).get(hit["log_file"], {}))
+                pages_cache[key] = (sorted(pages), end)
+            pages, end = pages_cache[key]
+            idx = bisect.bisect_right(pages, hit["offset"])
+            hit["page_start"] = pages[idx - 1] if idx > 0 else 0
+            hit["page_end"] = pages[idx] if idx < len(pages) else end
+
+        logger.info(f"[SEARCH] {len(result['hits'])} hits, scanned_blocks={result['scanned_blocks']}")
+        return result
+
+
+    @classmethod
+    async def seek_logs_by_time(cls, group_id: str, host_ip: str, log_dir: str, log_file: str, timestamp: float) -> Dict[str, Any]:
+        """
+        按时间定位：返回第一条时间 >= timestamp 的行所在的那一页，match_offset 是该行的偏移。
+        返回格式与 load_older_logs 相同，客户端可以用 start_offset 继续往前翻页。
+        所有行都早于 timestamp 时返回最后一页（is_end=True）。
+        """
+        logger.info(f"[SEEK] {host_ip}:{log_dir}/{log_file} at {timestamp}")
+        try:
+            mirror_path, end = locate_mirror(group_id, host_ip, log_dir, log_file)
+            dir_part = log_dir.lstrip("/")
+            offset_path = os.path.join(LOG_OFFSET_DIR, f"group_{group_id}_{host_ip}_{dir_part.replace('/', '_')}.json")
+            _, pages = parse_offset_info(load_or_init_offsets(offset_path).get(log_file, {}))
+            pages = sorted(set(pages))
+
+            found = await asyncio.to_thread(log_time_index.seek, mirror_path, timestamp, end)
+            if found is None:
+                match_offset, match_ts = end, None
+                page_start = last_page_start(end, pages)
+                page_end = end
+            else:
+                match_offset, match_ts = found
+                idx = bisect.bisect_right(pages, match_offset)
+                page_start = pages[idx - 1] if idx > 0 else 0
+                page_end = pages[idx] if idx < len(pages) else end
+            page_start = max(page_start, log_mirror_store.available_start(mirror_path))
+
+            entry = {
+                "content": await asyncio.to_thread(read_mirror_slice, mirror_path, page_start, page_end),
+                "start_offset": page_start,
+                "end_offset": page_end,
+                "match_offset": match_offset,
+                "timestamp": match_ts,
+                "is_end": page_end >= end
+            }
+            logger.info(f"[SEEK] Matched offset {match_offset} in page {page_start}-{page_end}")
+            return {"logs": {f"{host_ip}:{log_dir}": {log_file: entry}}, "errors": []}
+
+        except FileNotFoundError as e:
+            logger.warning(f"[SEEK] {e}")
+            return {"logs": {}, "errors": [{"host": host_ip, "error": str(e)}]}
+        except Exception as e:
+            logger.error(f"[SEEK] Error seeking {log_file} on {host_ip}: {e}")
+            logger.error(traceback.format_exc())
+            return {"logs": {}, "errors": [{"host": host_ip, "error": str(e)}]}
+
+
+    @classmethod
+    async def list_counters(cls, group_id: str, host_ip: str, log_dir: str, log_file: str) -> List[Dict[str, Any]]:
+        mirror_path, _ = locate_mirror(group_id, host_ip, log_dir, log_file)
+        return await asyncio.to_thread(log_counter_service.list_counters, mirror_path)
+
+
+    @classmethod
+    async def query_counter_series(cls, group_id: str, host_ip: str, log_dir: str, log_file: str, names: List[str],
+                                   start_time: Optional[float] = None, end_time: Optional[float] = None,
+                                   step: Optional[float] = None, max_points: int = log_counter_service.MAX_POINTS) -> Dict[str, Any]:
+        """按计数器名查询时间序列；不存在的计数器放进 errors，不影响其它计数器"""
+        mirror_path, _ = locate_mirror(group_id, host_ip, log_dir, log_file)
+        series = []
+        errors = []
+        for name in names:
+            try:
+                series.append(await asyncio.to_thread(
+                    log_counter_service.query_series, mirror_path, name, start_time, end_time, step, max_points
+                ))
+            except KeyError:
+                errors.append({"counter": name, "error": f"Counter {name} not found"})
+        return {"series": series, "errors": errors}
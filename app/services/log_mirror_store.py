@@ -0,0 +1,381 @@
+#app/services/log_mirror_store.py
+"""
+日志镜像的分段存储。
+
+每个镜像文件在逻辑上是一段只追加的字节流（偏移即 offsets 里的 mirror_offset / pages）。
+物理上拆成：
+- 活动段：原来的镜像路径 mirror_dir/<log_file>，保存 [base, mirror_offset) 的明文；
+- 封存段：mirror_dir/.segments/<log_file>/<start>.gz，由若干独立的 gzip 帧拼接而成
+  （zcat 可直接解压），同名 .idx 记录每帧的逻辑起点和压缩后位置。
+
+活动段超过 settings.LOG_SEGMENT_SIZE 后封存。读取任意区间只需对帧索引二分，再 seek 到对应帧解压，
+不需要从头解压整个段。
+
+活动段的逻辑起点记录在段目录的 active.json：{"base", "inode", "prev_base", "prev_inode"}。
+封存时不截断原文件，而是新建空文件替换过去（inode 改变），起点按活动段文件的 inode 查表，
+所以封存中途崩溃、或者读取方拿着封存前打开的文件句柄，读到的起点和内容始终一致。
+没有 active.json 的旧镜像（从未在此格式下封存过）仍以最后一个封存段的 end 为起点。
+"""
+import os
+import json
+import gzip
+import time
+import bisect
+import asyncio
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_DIR_NAME = ".segments"
+ACTIVE_META_NAME = "active.json"
+FRAME_SIZE = 64 * 1024  # 每个压缩帧的明文大小上限
+COMPRESS_LEVEL = 6
+
+# 段索引缓存：段目录 -> (目录 mtime_ns, 段列表)
+_segment_cache: Dict[str, Tuple[int, List[Dict]]] = {}
+# 封存段最近一次被读取的时间，供保留策略做 LRU 淘汰
+_last_access: Dict[str, float] = {}
+# 每个镜像一把锁：追加/封存活动段时持有，避免后台压缩和拉取同时改写活动段
+_mirror_locks: Dict[str, asyncio.Lock] = {}
+
+
+def mirror_lock(mirror_path: str) -> asyncio.Lock:
+    lock = _mirror_locks.get(mirror_path)
+    if lock is None:
+        lock = _mirror_locks[mirror_path] = asyncio.Lock()
+    return lock
+
+
+def segment_dir(mirror_path: str) -> str:
+    return os.path.join(os.path.dirname(mirror_path), SEGMENT_DIR_NAME, os.path.basename(mirror_path))
+
+
+def list_segments(mirror_path: str) -> List[Dict]:
+    """
+    返回按 start 排序的封存段：{"start", "end", "path", "frames": [[逻辑起点, 压缩偏移, 压缩长度], ...]}。
+    被保留策略淘汰的段只剩 .idx（"evicted": true，frames 为空），用来保持逻辑偏移连续。
+    """
+    seg_dir = segment_dir(mirror_path)
+    try:
+        mtime = os.stat(seg_dir).st_mtime_ns
+    except FileNotFoundError:
+        _segment_cache.pop(seg_dir, None)
+        return []
+
+    cached = _segment_cache.get(seg_dir)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    segments = []
+    for name in os.listdir(seg_dir):
+        if not name.endswith(".idx"):
+            continue
+        try:
+            with open(os.path.join(seg_dir, name), "r", encoding="utf-8") as f:
+                idx = json.load(f)
+        except Exception as e:
+            logger.error(f"[STORE] Failed to load segment index {name} in {seg_dir}: {e}")
+            continue
+        idx["path"] = os.path.join(seg_dir, name[:-len(".idx")] + ".gz")
+        idx["idx_path"] = os.path.join(seg_dir, name)
+        segments.append(idx)
+    segments.sort(key=lambda s: s["start"])
+    _segment_cache[seg_dir] = (mtime, segments)
+    return segments
+
+
+def _load_active_meta(mirror_path: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(segment_dir(mirror_path), ACTIVE_META_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _save_active_meta(mirror_path: str, meta: Dict) -> None:
+    path = os.path.join(segment_dir(mirror_path), ACTIVE_META_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def active_base(mirror_path: str, inode: Optional[int] = None) -> int:
+    """
+    活动段在逻辑流中的起点。inode 为已打开的活动段文件的 inode（读取方应先打开文件再查起点），
+    不传时按当前路径上的文件查。
+    """
+    meta = _load_active_meta(mirror_path)
+    if meta is None:
+        segments = list_segments(mirror_path)
+        return segments[-1]["end"] if segments else 0
+    if inode is None:
+        try:
+            inode = os.stat(mirror_path).st_ino
+        except FileNotFoundError:
+            return meta["base"]
+    if inode == meta.get("prev_inode") and inode != meta["inode"]:
+        # 新活动段已登记但还没替换到位（封存中途中断），当前文件仍是封存前的那一个
+        return meta["prev_base"]
+    return meta["base"]
+
+
+def available_start(mirror_path: str) -> int:
+    """仍可读取的最小逻辑偏移（更早的段已被淘汰）"""
+    for segment in list_segments(mirror_path):
+        if not segment.get("evicted"):
+            return segment["start"]
+    return active_base(mirror_path)
+
+
+def _read_sealed(segment: Dict, start: int, end: int) -> bytes:
+    frames = segment["frames"]
+    starts = [fr[0] for fr in frames]
+    i = max(bisect.bisect_right(starts, start) - 1, 0)
+    j = bisect.bisect_left(starts, end)
+    first, last = frames[i], frames[j - 1]
+
+    _last_access[segment["path"]] = time.time()
+    with open(segment["path"], "rb") as f:
+        f.seek(first[1])
+        compressed = f.read(last[1] + last[2] - first[1])
+
+    out = bytearray()
+    pos = 0
+    for fr in frames[i:j]:
+        out += gzip.decompress(compressed[pos:pos + fr[2]])
+        pos += fr[2]
+    base = first[0]
+    return bytes(out[start - base:end - base])
+
+
+def iter_range(mirror_path: str, start: int, end: int, chunk_size: int = FRAME_SIZE) -> Iterator[bytes]:
+    """
+    按块产出逻辑区间 [start, end) 的字节，跨越封存段和活动段。
+    先打开活动段并按其 inode 确定起点，之后即使并发封存换掉了活动段，已打开的文件与起点仍然对应。
+    """
+    with open(mirror_path, "rb") as f:
+        base = active_base(mirror_path, os.fstat(f.fileno()).st_ino)
+        pos = start
+        sealed_end = min(base, end)
+        for segment in list_segments(mirror_path):
+            if pos >= sealed_end:
+                break
+            if segment["end"] <= pos:
+                continue
+            if segment.get("evicted"):
+                pos = min(segment["end"], sealed_end)  # 已淘汰的数据直接跳过
+                continue
+            while pos < min(segment["end"], sealed_end):
+                stop = min(pos + chunk_size, segment["end"], sealed_end)
+                yield _read_sealed(segment, pos, stop)
+                pos = stop
+
+        if pos >= end or pos < base:
+            return
+        f.seek(pos - base)
+        remaining = end - pos
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def read_range(mirror_path: str, start: int, end: int) -> bytes:
+    return b"".join(iter_range(mirror_path, start, end))
+
+
+def _iter_reverse(mirror_path: str, end: int, floor: int, block_size: int = FRAME_SIZE) -> Iterator[Tuple[int, bytes]]:
+    """从 end 往前按块产出 (块起点, 数据)，不早于 floor"""
+    pos = end
+    while pos > floor:
+        start = max(pos - block_size, floor)
+        yield start, read_range(mirror_path, start, pos)
+        pos = start
+
+
+def line_start_at(mirror_path: str, offset: int, floor: int = 0) -> int:
+    """offset 所在行的行首（offset 本身是行首时原样返回），用于把任意偏移对齐到行边界"""
+    for start, data in _iter_reverse(mirror_path, offset, floor):
+        nl = data.rfind(b"\n")
+        if nl >= 0:
+            return start + nl + 1
+    return floor
+
+
+def seek_lines_back(mirror_path: str, end: int, n_lines: int, floor: int = 0, max_bytes: Optional[int] = None) -> int:
+    """
+    返回 start，使 [start, end) 恰好包含 end 之前的 n_lines 行（end 须是行边界）。
+    倒序逐块读取，不依赖分页表；到达 floor 或超过 max_bytes 时提前停止（按行对齐）。
+    """
+    if n_lines <= 0 or end <= floor:
+        return end
+    limited = max_bytes is not None and end - max_bytes > floor
+    if limited:
+        floor = end - max_bytes
+    # end 前面的第一个换行是最后一行的行尾，所以要找第 n_lines + 1 个换行
+    remaining = n_lines + 1
+    earliest = end
+    for start, data in _iter_reverse(mirror_path, end, floor):
+        pos = len(data)
+        while remaining:
+            nl = data.rfind(b"\n", 0, pos)
+            if nl < 0:
+                break
+            remaining -= 1
+            pos = nl
+            earliest = start + nl + 1
+        if not remaining:
+            return earliest
+    # 超过 max_bytes 时 floor 落在行中间，退到已经找到的最早行首；否则 floor（段起点 / 文件开头）本身就是行首
+    return earliest if limited else floor
+
+
+def _split_frames(data: bytes) -> Iterator[bytes]:
+    # 尽量在行尾切帧，方便 zcat/grep 直接查看
+    pos = 0
+    while pos < len(data):
+        stop = min(pos + FRAME_SIZE, len(data))
+        if stop < len(data):
+            nl = data.rfind(b"\n", pos, stop)
+            if nl >= pos:
+                stop = nl + 1
+        yield data[pos:stop]
+        pos = stop
+
+
+def seal_active_segment(mirror_path: str, end: int) -> Optional[Dict]:
+    """
+    把活动段 [base, end) 压缩成封存段，并换上一个空的活动段。
+    顺序：登记当前活动段（旧镜像第一次封存时）→ 写 .gz / .idx → 登记新活动段 → 新空文件 rename 替换活动段。
+    活动段的起点按 inode 记在 active.json，任何一步中断后起点都与磁盘上的活动段文件对应；
+    中断在替换之前时，封存段和活动段有一段重叠，读取按偏移取数据不受影响，下次封存会覆盖同名的段。
+    调用方需持有 mirror_lock。
+    """
+    with open(mirror_path, "rb") as f:
+        inode = os.fstat(f.fileno()).st_ino
+        base = active_base(mirror_path, inode)
+        if end <= base:
+            return None
+        data = f.read(end - base)
+    if len(data) != end - base:
+        logger.warning(f"[STORE] Active segment of {mirror_path} shorter than expected, skip sealing")
+        return None
+
+    seg_dir = segment_dir(mirror_path)
+    os.makedirs(seg_dir, exist_ok=True)
+    meta = _load_active_meta(mirror_path)
+    if meta is None or meta["inode"] != inode or meta["base"] != base:
+        _save_active_meta(mirror_path, {"base": base, "inode": inode})
+
+    name = f"{base:016d}"
+    gz_path = os.path.join(seg_dir, name + ".gz")
+    idx_path = os.path.join(seg_dir, name + ".idx")
+
+    frames = []
+    offset = 0
+    with open(gz_path + ".tmp", "wb") as out:
+        logical = base
+        for frame in _split_frames(data):
+            compressed = gzip.compress(frame, compresslevel=COMPRESS_LEVEL, mtime=0)
+            out.write(compressed)
+            frames.append([logical, offset, len(compressed)])
+            logical += len(frame)
+            offset += len(compressed)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(gz_path + ".tmp", gz_path)
+
+    index = {"start": base, "end": end, "frames": frames}
+    with open(idx_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(idx_path + ".tmp", idx_path)
+
+    new_active = os.path.join(seg_dir, "active.new")
+    with open(new_active, "wb") as f:
+        new_inode = os.fstat(f.fileno()).st_ino
+    _save_active_meta(mirror_path, {"base": end, "inode": new_inode, "prev_base": base, "prev_inode": inode})
+    os.replace(new_active, mirror_path)
+    logger.info(f"[STORE] Sealed {mirror_path} [{base}, {end}) into {len(frames)} frames, {len(data)} -> {offset} bytes")
+    return index
+
+
+def maybe_seal(mirror_path: str, end: int) -> Optional[Dict]:
+    if end - active_base(mirror_path) >= settings.LOG_SEGMENT_SIZE:
+        return seal_active_segment(mirror_path, end)
+    return None
+
+
+def segment_last_access(segment: Dict) -> float:
+    try:
+        sealed_at = os.path.getmtime(segment["path"])
+    except FileNotFoundError:
+        sealed_at = 0
+    return max(_last_access.get(segment["path"], 0), sealed_at)
+
+
+def evict_segment(segment: Dict) -> int:
+    """
+    删除封存段的数据，只保留一个标记为 evicted 的 .idx 桩，返回释放的字节数。
+    先改写 .idx 再删 .gz，读取方不会看到有索引却没有数据的段。
+    """
+    if segment.get("evicted"):
+        return 0
+    freed = os.path.getsize(segment["path"]) if os.path.exists(segment["path"]) else 0
+    stub = {"start": segment["start"], "end": segment["end"], "frames": [], "evicted": True}
+    tmp_path = segment["idx_path"] + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(stub, f)
+    os.replace(tmp_path, segment["idx_path"])
+    if os.path.exists(segment["path"]):
+        os.remove(segment["path"])
+    _last_access.pop(segment["path"], None)
+    logger.info(f"[STORE] Evicted segment {segment['path']} [{segment['start']}, {segment['end']}), freed {freed} bytes")
+    return freed
+
+
+def remove_mirror(mirror_path: str) -> None:
+    """删除镜像及其全部封存段"""
+    if os.path.exists(mirror_path):
+        os.remove(mirror_path)
+    seg_dir = segment_dir(mirror_path)
+    if os.path.isdir(seg_dir):
+        for name in os.listdir(seg_dir):
+            os.remove(os.path.join(seg_dir, name))
+        os.rmdir(seg_dir)
+    _segment_cache.pop(seg_dir, None)
+    _mirror_locks.pop(mirror_path, None)
+
+
+def reset_mirror(mirror_path: str) -> None:
+    """清空镜像，从逻辑偏移 0 重新开始"""
+    remove_mirror(mirror_path)
+    open(mirror_path, "wb").close()
+
+
+
+def mirror_disk_usage(mirror_path: str) -> Tuple[int, int, int]:
+    """返回 (逻辑字节数, 实际占用字节数, 未淘汰的封存段数)"""
+    logical = 0
+    physical = 0
+    sealed = 0
+    for segment in list_segments(mirror_path):
+        if segment.get("evicted"):
+            continue
+        logical += segment["end"] - segment["start"]
+        sealed += 1
+        if os.path.exists(segment["path"]):
+            physical += os.path.getsize(segment["path"])
+    if os.path.exists(mirror_path):
+        size = os.path.getsize(mirror_path)
+        logical += size
+        physical += size
+    return logical, physical, sealed
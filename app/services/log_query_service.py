@@ -0,0 +1,145 @@
+#app/services/log_query_service.py
+import shlex
+import asyncio
+import posixpath
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.services.async_ssh_pool import ssh_pool
+from app.services.log_manager_service import LogManagerService
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INCLUDES = ["*.log", "*.log.*", "*.count"]
+MAX_LINE_CHARS = 2000  # 远端截断超长行，避免单行撑爆结果
+
+
+def build_grep_command(pattern: str, paths: List[str], includes: List[str], max_matches: int,
+                       timeout: int, fixed_strings: bool = False, ignore_case: bool = False) -> str:
+    """
+    拼出在远端执行的 grep 命令：整体受 timeout 限制，结果在远端用 head 截断，只把命中的行传回来。
+    多取一行（max_matches + 1），调用方据此判断结果是否被截断。
+    """
+    opts = ["-rHnI"]
+    if fixed_strings:
+        opts.append("-F")
+    if ignore_case:
+        opts.append("-i")
+    opts += [f"--include={shlex.quote(inc)}" for inc in includes]
+    quoted_paths = " ".join(shlex.quote(p) for p in paths)
+    return (
+        f"timeout {int(timeout)} grep {' '.join(opts)} -e {shlex.quote(pattern)} -- {quoted_paths} 2>/dev/null"
+        f" | cut -c1-{MAX_LINE_CHARS} | head -n {int(max_matches) + 1}"
+    )
+
+
+def _is_under(path: str, directory: str) -> bool:
+    directory = posixpath.normpath(directory)
+    return path == directory or path.startswith(directory.rstrip("/") + "/")
+
+
+def restrict_paths(paths: List[str], log_dirs: List[str]) -> List[str]:
+    """
+    客户端指定的搜索路径规范化后只保留落在该主机 log_dir 之下的；
+    必须是绝对路径，".." 在规范化时消解，不能借此跳出 log_dir。
+    """
+    allowed = []
+    for path in paths:
+        if not isinstance(path, str) or not path.startswith("/"):
+            raise ValueError(f"Search path must be absolute: {path!r}")
+        normalized = posixpath.normpath(path)
+        if any(_is_under(normalized, log_dir) for log_dir in log_dirs):
+            allowed.append(normalized)
+    return allowed
+
+
+def _parse_grep_line(host_ip: str, line: str) -> Dict[str, Any]:
+    path, sep, rest = line.partition(":")
+    line_no, sep2, text = rest.partition(":")
+    if not sep or not sep2 or not line_no.isdigit():
+        return {"host": host_ip, "file": None, "line_no": None, "line": line}
+    return {"host": host_ip, "file": path, "line_no": int(line_no), "line": text}
+
+
+async def _grep_host(host_ip: str, command: str, max_matches: int, timeout: int, queue: asyncio.Queue) -> None:
+    matches = 0
+    truncated = False
+    error = None
+    try:
+        ssh = await asyncio.wait_for(ssh_pool.get_connection(host_ip), timeout=5)
+        if not ssh:
+            raise ConnectionError("SSH connection failed")
+
+        async def _run():
+            nonlocal matches, truncated
+            # 日志里可能有非 UTF-8 字节，按字节读回再宽松解码，不能让一行坏字节中断整台主机的结果
+            async with ssh.create_process(command, encoding=None) as proc:
+                async for raw in proc.stdout:
+                    if matches >= max_matches:
+                        truncated = True
+                        break
+                    line = raw.decode("utf-8", errors="replace").rstrip("\n")
+                    await queue.put(_parse_grep_line(host_ip, line))
+                    matches += 1
+
+        # 远端 timeout 兜底之外，本地再加一层截止时间，防止链路卡住
+        await asyncio.wait_for(_run(), timeout=timeout + 5)
+    except asyncio.TimeoutError:
+        error = f"timed out after {timeout}s"
+    except Exception as e:
+        error = str(e)
+        logger.error(f"[QUERY] grep on {host_ip} failed: {e}")
+
+    summary = {"host": host_ip, "done": True, "matches": matches, "truncated": truncated}
+    if error:
+        summary["error"] = error
+    await queue.put(summary)
+
+
+async def stream_remote_grep(group_id: str, pattern: str, host_ip: Optional[str] = None,
+                             paths: Optional[List[str]] = None, includes: Optional[List[str]] = None,
+                             max_matches_per_host: int = 500, timeout: int = 10,
+                             fixed_strings: bool = False, ignore_case: bool = False) -> AsyncIterator[Dict[str, Any]]:
+    """
+    在组内各主机上并发执行有界 grep，按到达顺序逐条产出命中行；每台主机结束时产出一条 done 汇总。
+    未指定 paths 时搜索该主机配置的 log_dir；指定时每台主机只搜索落在自己 log_dir 之下的路径，
+    有路径不在任何目标主机的 log_dir 下时抛 ValueError，没有匹配路径的主机跳过。
+    """
+    if not pattern:
+        raise ValueError("pattern is required")
+
+    targets: Dict[str, List[str]] = {}
+    for ip, log_dir in await LogManagerService.get_hosts_for_group(group_id):
+        if host_ip and ip != host_ip:
+            continue
+        targets.setdefault(ip, []).append(log_dir)
+    if not targets:
+        raise ValueError(f"No hosts matched in group {group_id}")
+    if paths:
+        targets = {ip: restrict_paths(paths, log_dirs) for ip, log_dirs in targets.items()}
+        accepted = {path for allowed in targets.values() for path in allowed}
+        rejected = [path for path in paths if posixpath.normpath(path) not in accepted]
+        if rejected:
+            raise ValueError(f"Search paths not under a configured log_dir: {', '.join(rejected)}")
+        targets = {ip: allowed for ip, allowed in targets.items() if allowed}
+
+    queue: asyncio.Queue = asyncio.Queue()
+    tasks = []
+    for ip, search_paths in targets.items():
+        command = build_grep_command(
+            pattern, search_paths, includes or DEFAULT_INCLUDES,
+            max_matches_per_host, timeout, fixed_strings, ignore_case
+        )
+        logger.info(f"[QUERY] {ip}: {command}")
+        tasks.append(asyncio.create_task(_grep_host(ip, command, max_matches_per_host, timeout, queue)))
+
+    pending = len(tasks)
+    try:
+        while pending:
+            item = await queue.get()
+            if item.get("done"):
+                pending -= 1
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,279 @@
+#app/services/log_search_service.py
+"""
+日志镜像的全文索引。
+
+每个组一个 SQLite 库（log-index/group_<id>.db），fetch_logs 追加的内容合并成约 BLOCK_BYTES 大小的 block
+写入 FTS5 trigram 索引（contentless + detail=none，只存倒排表，不重复保存日志正文）。
+查询时先用 trigram 求交得到候选 block，再从镜像读回 block 逐行确认，得到精确的行偏移。
+
+每个库只打开一个连接并缓存下来（建表只在打开时执行一次），同一个库的读写用锁串行。
+"""
+import os
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.services import log_mirror_store
+from app.utils.log_timestamps import parse_leading_timestamp
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+LOG_INDEX_DIR = os.path.join(BASE_DIR, 'log-index')
+os.makedirs(LOG_INDEX_DIR, exist_ok=True)
+
+MIN_QUERY_LEN = 3  # trigram 索引至少需要 3 个字符
+BLOCK_BYTES = 64 * 1024  # 连续追加的内容合并到同一个 block，直到超过该大小且在行边界上
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    host_ip TEXT NOT NULL,
+    log_dir TEXT NOT NULL,
+    log_file TEXT NOT NULL,
+    mirror_path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS blocks (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    ts_min REAL,
+    ts_max REAL
+);
+CREATE INDEX IF NOT EXISTS blocks_file_start ON blocks(file_id, start);
+CREATE VIRTUAL TABLE IF NOT EXISTS blocks_fts USING fts5(
+    body, content='', tokenize='trigram', detail=none
+);
+"""
+
+
+def index_db_path(group_id: str) -> str:
+    return os.path.join(LOG_INDEX_DIR, f"group_{group_id}.db")
+
+
+_connections: Dict[str, Tuple[sqlite3.Connection, threading.Lock]] = {}
+_connections_lock = threading.Lock()
+# 每个镜像最后一个 block 的 (block id, 正文)，合并时用来删除旧的倒排项，不必从镜像读回
+_last_blocks: Dict[str, Tuple[int, str]] = {}
+
+
+@contextmanager
+def _connect(group_id: str) -> Iterator[sqlite3.Connection]:
+    """取出该组缓存的连接并持有它的锁；第一次使用时打开并建表"""
+    with _connections_lock:
+        cached = _connections.get(group_id)
+        if cached is None:
+            conn = sqlite3.connect(index_db_path(group_id), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            cached = _connections[group_id] = (conn, threading.Lock())
+    conn, lock = cached
+    with lock:
+        yield conn
+
+
+def _file_id(conn: sqlite3.Connection, host_ip: str, log_dir: str, log_file: str, mirror_path: str) -> int:
+    row = conn.execute("SELECT id FROM files WHERE mirror_path=?", (mirror_path,)).fetchone()
+    if row:
+        return row[0]
+    cur = conn.execute(
+        "INSERT INTO files (host_ip, log_dir, log_file, mirror_path) VALUES (?, ?, ?, ?)",
+        (host_ip, log_dir, log_file, mirror_path)
+    )
+    return cur.lastrowid
+
+
+def _match_expr(query: str) -> str:
+    # detail=none 不支持短语查询，改为所有 trigram 的 AND；多出来的候选在读回 block 时过滤掉
+    grams = sorted({query[i:i + 3] for i in range(len(query) - 2)})
+    return " AND ".join('"' + g.replace('"', '""') + '"' for g in grams)
+
+
+def _block_text(mirror_path: str, block_id: int, start: int, end: int) -> Optional[str]:
+    cached = _last_blocks.get(mirror_path)
+    if cached and cached[0] == block_id:
+        return cached[1]
+    try:
+        return log_mirror_store.read_range(mirror_path, start, end).decode('utf-8', errors='replace')
+    except Exception:
+        return None
+
+
+def _append_block(conn: sqlite3.Connection, file_id: int, mirror_path: str, start: int, end: int, text: str,
+                  ts_min: Optional[float], ts_max: Optional[float]) -> Tuple[int, str]:
+    """把 [start, end) 并入文件最后一个 block 或新建一个 block，返回 (block id, block 正文)"""
+    last = conn.execute(
+        "SELECT id, start, end, ts_min, ts_max FROM blocks WHERE file_id=? ORDER BY start DESC LIMIT 1", (file_id,)
+    ).fetchone()
+    old_text = None
+    if last and last[2] == start and last[1] >= log_mirror_store.active_base(mirror_path):
+        block_id, block_start, block_end, old_min, old_max = last
+        old_text = _block_text(mirror_path, block_id, block_start, block_end)
+        size = block_end - block_start
+        if old_text is not None and size >= BLOCK_BYTES and (old_text.endswith("\n") or size >= 4 * BLOCK_BYTES):
+            old_text = None
+
+    if old_text is None:
+        cur = conn.execute(
+            "INSERT INTO blocks (file_id, start, end, ts_min, ts_max) VALUES (?, ?, ?, ?, ?)",
+            (file_id, start, end, ts_min, ts_max)
+        )
+        block_id, body = cur.lastrowid, text
+    else:
+        # contentless 表不能改写，先用原文删掉旧的倒排项再整体插入
+        body = old_text + text
+        conn.execute("INSERT INTO blocks_fts (blocks_fts, rowid, body) VALUES ('delete', ?, ?)", (block_id, old_text))
+        ts_min = min((v for v in (old_min, ts_min) if v is not None), default=None)
+        ts_max = max((v for v in (old_max, ts_max) if v is not None), default=None)
+        conn.execute("UPDATE blocks SET end=?, ts_min=?, ts_max=? WHERE id=?", (end, ts_min, ts_max, block_id))
+    conn.execute("INSERT INTO blocks_fts (rowid, body) VALUES (?, ?)", (block_id, body))
+    return block_id, body
+
+
+def index_chunk(group_id: str, host_ip: str, log_dir: str, log_file: str,
+                mirror_path: str, start: int, text: str) -> None:
+    """
+    把一次追加到镜像的内容 [start, start + len(text 的字节)) 写入索引。
+    紧接在该文件最后一个 block 之后、且那个 block 还不满 BLOCK_BYTES（或停在半行上）时并入它，
+    不跨越活动段的起点，淘汰旧段时不会留下横跨两段的 block。
+    """
+    if not text:
+        return
+    ts_values = [ts for ts in (parse_leading_timestamp(line) for line in text.splitlines()) if ts is not None]
+    end = start + len(text.encode('utf-8'))
+    ts_min = min(ts_values) if ts_values else None
+    ts_max = max(ts_values) if ts_values else None
+
+    with _connect(group_id) as conn:
+        with conn:
+            file_id = _file_id(conn, host_ip, log_dir, log_file, mirror_path)
+            block_id, body = _append_block(conn, file_id, mirror_path, start, end, text, ts_min, ts_max)
+        _last_blocks[mirror_path] = (block_id, body)
+
+
+def index_mirror_range(group_id: str, host_ip: str, log_dir: str, log_file: str,
+                       mirror_path: str, start: int, end: int) -> None:
+    """补建索引：把镜像中 [start, end) 按行边界切成 block 写入（用于升级前已有的镜像或之前写索引失败的部分）"""
+    pending = b""
+    block_start = start
+    for data in log_mirror_store.iter_range(mirror_path, start, end):
+        pending += data
+        cut = pending.rfind(b"\n") + 1
+        if cut == 0:
+            continue
+        index_chunk(group_id, host_ip, log_dir, log_file, mirror_path, block_start,
+                    pending[:cut].decode('utf-8', errors='replace'))
+        block_start += cut
+        pending = pending[cut:]
+    if pending:
+        index_chunk(group_id, host_ip, log_dir, log_file, mirror_path, block_start,
+                    pending.decode('utf-8', errors='replace'))
+    logger.info(f"[INDEX] Backfilled {mirror_path} [{start}, {end})")
+
+
+def drop_file_blocks(group_id: str, mirror_path: str, before: Optional[int] = None) -> int:
+    """
+    删除某个镜像文件（before 不为空时只删除 end <= before 的部分）的索引。
+    contentless 表删除倒排项需要原文，所以要在镜像数据删除之前调用；读不到原文的 block 只删映射行。
+    """
+    if not os.path.exists(index_db_path(group_id)):
+        return 0
+    _last_blocks.pop(mirror_path, None)
+    with _connect(group_id) as conn:
+        with conn:
+            row = conn.execute("SELECT id FROM files WHERE mirror_path=?", (mirror_path,)).fetchone()
+            if not row:
+                return 0
+            file_id = row[0]
+            sql = "SELECT id, start, end FROM blocks WHERE file_id=?"
+            args = [file_id]
+            if before is not None:
+                sql += " AND end<=?"
+                args.append(before)
+            blocks = conn.execute(sql, args).fetchall()
+
+            for block_id, start, end in blocks:
+                try:
+                    text = log_mirror_store.read_range(mirror_path, start, end).decode('utf-8', errors='replace')
+                except Exception:
+                    text = ""
+                if text:
+                    conn.execute("INSERT INTO blocks_fts (blocks_fts, rowid, body) VALUES ('delete', ?, ?)", (block_id, text))
+                conn.execute("DELETE FROM blocks WHERE id=?", (block_id,))
+
+            if before is None:
+                conn.execute("DELETE FROM files WHERE id=?", (file_id,))
+        logger.info(f"[INDEX] Dropped {len(blocks)} blocks of {mirror_path} (before={before})")
+        return len(blocks)
+
+
+def search(group_id: str, query: str, host_ip: Optional[str] = None, log_dir: Optional[str] = None,
+           log_file: Optional[str] = None, start_time: Optional[float] = None, end_time: Optional[float] = None,
+           limit: int = 100) -> Dict[str, Any]:
+    """
+    返回 {"hits": [{host_ip, log_dir, log_file, offset, line, timestamp}], "truncated", "scanned_blocks"}。
+    offset 是该行在镜像中的起始偏移，与分页表同一坐标。匹配不区分大小写。
+    """
+    if len(query) < MIN_QUERY_LEN:
+        raise ValueError(f"Query must be at least {MIN_QUERY_LEN} characters")
+    if not os.path.exists(index_db_path(group_id)):
+        return {"hits": [], "truncated": False, "scanned_blocks": 0}
+
+    sql = ("SELECT b.start, b.end, f.host_ip, f.log_dir, f.log_file, f.mirror_path "
+           "FROM blocks_fts JOIN blocks b ON b.id = blocks_fts.rowid JOIN files f ON f.id = b.file_id "
+           "WHERE blocks_fts MATCH ?")
+    args: List[Any] = [_match_expr(query)]
+    for column, value in (("f.host_ip", host_ip), ("f.log_dir", log_dir), ("f.log_file", log_file)):
+        if value:
+            sql += f" AND {column}=?"
+            args.append(value)
+    # 没有时间戳的 block 无法按时间排除，保留下来逐行判断
+    if start_time is not None:
+        sql += " AND (b.ts_max IS NULL OR b.ts_max>=?)"
+        args.append(start_time)
+    if end_time is not None:
+        sql += " AND (b.ts_min IS NULL OR b.ts_min<=?)"
+        args.append(end_time)
+    sql += " ORDER BY f.id, b.start"
+
+    needle = query.lower()
+    hits = []
+    scanned = 0
+    with _connect(group_id) as conn:
+        for start, end, f_host, f_dir, f_file, mirror_path in conn.execute(sql, args):
+            if start < log_mirror_store.available_start(mirror_path):
+                continue
+            scanned += 1
+            data = log_mirror_store.read_range(mirror_path, start, end)
+            pos = start
+            ts = None
+            for raw_line in data.splitlines(True):
+                line = raw_line.decode('utf-8', errors='replace')
+                ts = parse_leading_timestamp(line) or ts  # 续行沿用上一行的时间
+                line_offset = pos
+                pos += len(raw_line)
+                if needle not in line.lower():
+                    continue
+                if start_time is not None and (ts is None or ts < start_time):
+                    continue
+                if end_time is not None and (ts is None or ts > end_time):
+                    continue
+                hits.append({
+                    "host_ip": f_host,
+                    "log_dir": f_dir,
+                    "log_file": f_file,
+                    "offset": line_offset,
+                    "line": line.rstrip("\r\n"),
+                    "timestamp": ts
+                })
+                if len(hits) > limit:
+                    break
+            if len(hits) > limit:
+                break
+
+    # 多取一条判断后面是否还有，恰好 limit 条时不算截断
+    return {"hits": hits[:limit], "truncated": len(hits) > limit, "scanned_blocks": scanned}
@@ -0,0 +1,143 @@
+#app/services/log_time_index.py
+"""
+日志镜像的稀疏时间索引。
+
+每个镜像一个定长记录文件（.segments/<log_file>/timeindex.bin），记录为 (时间戳秒, 镜像逻辑偏移)。
+入库时解析行首时间戳，距上一条记录超过 STRIDE 字节才写一条，500MB 的日志索引只有几百 KB。
+按时间定位时在文件上直接二分（不整体读入），再从命中记录的前一条开始逐行扫描，最多扫一个 STRIDE。
+
+远端时间可能回拨（或不带年份的格式跨年），记录的时间戳取单调最大值以保证二分成立。
+索引放在段目录里，镜像被删除 / 截断重建时随段目录一起清掉。
+"""
+import os
+import struct
+import logging
+from typing import Optional, Tuple
+
+from app.services import log_mirror_store
+from app.utils.log_timestamps import parse_leading_timestamp
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "timeindex.bin"
+RECORD = struct.Struct("<dq")  # (时间戳秒, 逻辑偏移)
+STRIDE = 16 * 1024  # 两条记录之间至少间隔的字节数
+
+
+def time_index_path(mirror_path: str) -> str:
+    return os.path.join(log_mirror_store.segment_dir(mirror_path), INDEX_NAME)
+
+
+def _record_count(f) -> int:
+    f.seek(0, os.SEEK_END)
+    return f.tell() // RECORD.size
+
+
+def _read_record(f, i: int) -> Tuple[float, int]:
+    f.seek(i * RECORD.size)
+    return RECORD.unpack(f.read(RECORD.size))
+
+
+def _last_record(path: str) -> Optional[Tuple[float, int]]:
+    try:
+        with open(path, "rb") as f:
+            n = _record_count(f)
+            return _read_record(f, n - 1) if n else None
+    except FileNotFoundError:
+        return None
+
+
+def has_timestamps(mirror_path: str) -> bool:
+    """镜像里是否有带时间戳的行（没有任何索引记录的文件，如 .count，无法参与按时间合并）"""
+    return _last_record(time_index_path(mirror_path)) is not None
+
+
+def index_chunk(mirror_path: str, start: int, text: str) -> None:
+    """为追加到镜像的内容 [start, start + len(text 的字节)) 补充时间索引记录"""
+    path = time_index_path(mirror_path)
+    last = _last_record(path)
+    if last and last[1] >= start:
+        return  # 这一段已经建过索引
+
+    last_ts, last_off = last if last else (None, None)
+    out = bytearray()
+    pos = start
+    for line in text.splitlines(True):
+        if last_off is None or pos - last_off >= STRIDE:
+            ts = parse_leading_timestamp(line)
+            if ts is not None:
+                if last_ts is not None and ts < last_ts:
+                    ts = last_ts
+                out += RECORD.pack(ts, pos)
+                last_ts, last_off = ts, pos
+        pos += len(line.encode('utf-8'))
+
+    if out:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "ab") as f:
+            f.write(out)
+
+
+def index_mirror_range(mirror_path: str, start: int, end: int) -> None:
+    """补建索引：按行边界读取镜像 [start, end) 写入（用于升级前已有的镜像）"""
+    pending = b""
+    block_start = start
+    for data in log_mirror_store.iter_range(mirror_path, start, end):
+        pending += data
+        cut = pending.rfind(b"\n") + 1
+        if cut == 0:
+            continue
+        index_chunk(mirror_path, block_start, pending[:cut].decode('utf-8', errors='replace'))
+        block_start += cut
+        pending = pending[cut:]
+    if pending:
+        index_chunk(mirror_path, block_start, pending.decode('utf-8', errors='replace'))
+    logger.info(f"[TIME_INDEX] Backfilled {mirror_path} [{start}, {end})")
+
+
+def seek(mirror_path: str, ts: float, end: int) -> Optional[Tuple[int, float]]:
+    """
+    返回镜像 [0, end) 中第一条时间戳 >= ts 的行的 (偏移, 时间戳)；所有行都早于 ts 时返回 None。
+    更早的数据已被保留策略淘汰时，从仍可读取的位置开始找。
+    """
+    scan_start, scan_end, scan_end_ts = 0, end, ts
+    try:
+        with open(time_index_path(mirror_path), "rb") as f:
+            lo, hi = 0, _record_count(f)
+            n = hi
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if _read_record(f, mid)[0] < ts:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            # 第 lo 条是第一条 >= ts 的记录，目标行一定落在 [第 lo-1 条, 第 lo 条] 之间
+            if lo > 0:
+                scan_start = _read_record(f, lo - 1)[1]
+            if lo < n:
+                scan_end_ts, scan_end = _read_record(f, lo)
+    except FileNotFoundError:
+        pass
+
+    scan_start = max(scan_start, log_mirror_store.available_start(mirror_path))
+    pending = b""
+    pos = scan_start
+    for data in log_mirror_store.iter_range(mirror_path, scan_start, end):
+        pending += data
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for raw in lines:
+            line_ts = parse_leading_timestamp(raw.decode('utf-8', errors='replace'))
+            if line_ts is not None and line_ts >= ts:
+                return pos, line_ts
+            pos += len(raw) + 1
+        if pos > scan_end:
+            break
+    if pending and pos <= scan_end:
+        line_ts = parse_leading_timestamp(pending.decode('utf-8', errors='replace'))
+        if line_ts is not None and line_ts >= ts:
+            return pos, line_ts
+    if scan_end < end:
+        # 区间内没有更晚的行（记录的时间戳被单调化过），落到第 lo 条记录所在的行
+        return scan_end, scan_end_ts
+    return None
@@ -0,0 +1,169 @@
+#app/services/log_timeline_service.py
+"""
+跨主机、跨文件按时间合并的日志视图。
+
+每个选中的镜像文件按块顺序读取，切成"记录"（一条带时间戳的行加上其后没有时间戳的续行），
+再用 heapq.merge 做 k 路归并。内存中每个文件只保留一个读缓冲块，不会整体读入。
+分页用游标：cursor_key -> 下一条记录的镜像偏移，下一页从游标处继续归并。
+完全没有时间戳的文件（如 .count）不参与默认的合并；显式指定时排在所有带时间戳的记录之后。
+"""
+import os
+import heapq
+import asyncio
+import logging
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.services import log_mirror_store, log_time_index
+from app.services.log_manager_service import (
+    LogManagerService, LOG_OFFSET_DIR, LOG_MIRROR_DIR, cursor_key, load_or_init_offsets, parse_offset_info
+)
+from app.utils.log_timestamps import parse_leading_timestamp
+
+logger = logging.getLogger(__name__)
+
+MAX_RECORD_BYTES = 64 * 1024  # 续行过多时强制截成多条记录
+
+# 记录：(排序时间, 偏移, 字节长度, 时间戳或 None, 文本)
+Record = Tuple[float, int, int, Optional[float], str]
+
+
+def iter_records(mirror_path: str, start: int, end: int, timed: bool = True) -> Iterator[Record]:
+    """
+    产出镜像 [start, end) 中的记录。游标处开头没有时间戳的续行单独成一条，排序时间取 -inf，
+    让它排在本页最前面，紧挨着上一页中它所属的那一行。timed 为 False（文件没有时间戳）时每行一条记录。
+    """
+    pending = b""
+    rec_start = start
+    rec_lines: List[bytes] = []
+    rec_len = 0
+    rec_ts: Optional[float] = None
+    pos = start
+
+    def flush() -> Record:
+        text = b"".join(rec_lines).decode('utf-8', errors='replace')
+        return (rec_ts if rec_ts is not None else float("-inf"), rec_start, rec_len, rec_ts, text)
+
+    chunks = log_mirror_store.iter_range(mirror_path, start, end)
+    while True:
+        data = next(chunks, None)
+        if data is not None:
+            pending += data
+            raw_lines = pending.split(b"\n")
+            pending = raw_lines.pop()
+            raw_lines = [raw + b"\n" for raw in raw_lines]
+        else:
+            raw_lines = [pending] if pending else []
+            pending = b""
+
+        for raw in raw_lines:
+            ts = parse_leading_timestamp(raw.decode('utf-8', errors='replace'))
+            if rec_lines and (ts is not None or not timed or rec_len + len(raw) > MAX_RECORD_BYTES):
+                yield flush()
+                rec_lines, rec_start, rec_len = [], pos, 0
+                if ts is None:
+                    ts = rec_ts  # 超长续行被截断时沿用所属行的时间
+                rec_ts = ts
+            elif not rec_lines:
+                rec_ts = ts
+            rec_lines.append(raw)
+            rec_len += len(raw)
+            pos += len(raw)
+
+        if data is None:
+            break
+
+    if rec_lines:
+        yield flush()
+
+
+def merge_page(sources: List[Dict[str, Any]], limit: int, end_time: Optional[float] = None) -> Dict[str, Any]:
+    """
+    sources: [{"key", "host_ip", "log_dir", "log_file", "path", "start", "end", "timed"}]。
+    timed 为 False 的文件没有时间戳，排序时间取 +inf，排在带时间戳的记录之后。
+    归并出最多 limit 条记录，返回 {"lines", "cursors", "has_more"}。
+    """
+    def tagged(source: Dict[str, Any]) -> Iterator[Tuple[Record, Dict[str, Any]]]:
+        timed = source.get("timed", True)
+        for record in iter_records(source["path"], source["start"], source["end"], timed):
+            if not timed:
+                record = (float("inf"),) + record[1:]
+            yield record, source
+
+    merged = heapq.merge(*(tagged(s) for s in sources), key=lambda item: (item[0][0], item[0][1]))
+    cursors = {s["key"]: s["start"] for s in sources}
+    lines = []
+    has_more = False
+    for (sort_ts, offset, length, ts, text), source in merged:
+        if end_time is not None and sort_ts > end_time:
+            break
+        if len(lines) >= limit:
+            has_more = True
+            break
+        lines.append({
+            "key": source["key"],
+            "host_ip": source["host_ip"],
+            "log_dir": source["log_dir"],
+            "log_file": source["log_file"],
+            "offset": offset,
+            "timestamp": ts,
+            "line": text.rstrip("\r\n")
+        })
+        cursors[source["key"]] = offset + length
+    return {"lines": lines, "cursors": cursors, "has_more": has_more}
+
+
+async def read_merged_timeline(group_id: str, files: Optional[List[str]] = None,
+                               cursors: Optional[Dict[str, int]] = None, start_time: Optional[float] = None,
+                               end_time: Optional[float] = None, limit: int = 500) -> Dict[str, Any]:
+    """
+    files 为 cursor_key（"{ip}:{log_dir}/{log_file}"）列表，不传则合并组内全部带时间戳的已镜像文件
+    （没有时间戳的文件列在结果的 "untimestamped" 里）。
+    cursors 中有的文件从游标处继续；没有的文件从 start_time 所在位置（未指定则从最早可读位置）开始。
+    """
+    hosts = await LogManagerService.get_hosts_for_group(group_id)
+    wanted = set(files) if files else None
+    sources = []
+    errors = []
+    untimestamped = []
+    for ip, log_dir in hosts:
+        dir_part = log_dir.lstrip("/")
+        offset_path = os.path.join(LOG_OFFSET_DIR, f"group_{group_id}_{ip}_{dir_part.replace('/', '_')}.json")
+        mirror_dir = os.path.join(LOG_MIRROR_DIR, f"group_{group_id}_{ip}", dir_part)
+        for log_file, info in load_or_init_offsets(offset_path).items():
+            key = cursor_key(ip, log_dir, log_file)
+            if wanted is not None and key not in wanted:
+                continue
+            path = os.path.join(mirror_dir, log_file)
+            end, _ = parse_offset_info(info)
+            if not os.path.exists(path):
+                errors.append({"host": ip, "error": f"Log file {log_file} not found"})
+                continue
+            timed = log_time_index.has_timestamps(path)
+            if not timed and wanted is None:
+                untimestamped.append(key)
+                continue
+            sources.append({"key": key, "host_ip": ip, "log_dir": log_dir, "log_file": log_file,
+                            "path": path, "start": 0, "end": end, "timed": timed})
+
+    if wanted is not None:
+        for key in wanted - {s["key"] for s in sources}:
+            errors.append({"host": key.split(":", 1)[0], "error": f"{key} not found in group {group_id}"})
+
+    def build() -> Dict[str, Any]:
+        for source in sources:
+            floor = log_mirror_store.available_start(source["path"])
+            if cursors and source["key"] in cursors:
+                start = cursors[source["key"]]
+            elif start_time is not None:
+                found = log_time_index.seek(source["path"], start_time, source["end"])
+                start = found[0] if found else source["end"]
+            else:
+                start = floor
+            source["start"] = min(max(start, floor), source["end"])
+        return merge_page(sources, limit, end_time)
+
+    logger.info(f"[TIMELINE] group_id={group_id}, merging {len(sources)} files, limit={limit}")
+    result = await asyncio.to_thread(build)
+    result["errors"] = errors
+    result["untimestamped"] = untimestamped
+    return result
@@ -0,0 +1,368 @@
+#app/services/retention_service.py
+import os
+import re
+import json
+import time
+import heapq
+import shutil
+import asyncio
+import logging
+import traceback
+from typing import Dict, List, Tuple, Any, Iterator, Optional
+
+from app.core.config import settings
+from app.services import log_mirror_store, log_search_service, config_store_service
+from app.services.log_manager_service import (
+    BASE_DIR, CONFIG_DIR, LOG_OFFSET_DIR, LOG_MIRROR_DIR, LOG_RAW_MIRROR_DIR, load_or_init_offsets
+)
+
+logger = logging.getLogger(__name__)
+
+FILES_DIR = os.path.join(BASE_DIR, 'files')
+MANIFEST_DIR = os.path.join(BASE_DIR, 'file-manifests')
+GROUP_DIR_RE = re.compile(r'^group_(\d+)_(.+)$')
+COMPACT_MIN_BYTES = 64 * 1024  # 活动段小于该值时不值得单独封存
+MB = 1024 * 1024
+DAY = 24 * 3600
+
+_retention_task: Optional[asyncio.Task] = None
+
+
+def _dir_size(path: str) -> Tuple[int, float]:
+    """返回目录总字节数和最新 mtime"""
+    total = 0
+    newest = 0.0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            total += st.st_size
+            newest = max(newest, st.st_mtime)
+    return total, newest
+
+
+def _configured_hosts() -> Dict[str, set]:
+    """net-conf 中配置的 group_id -> 主机 IP 集合"""
+    groups = {}
+    for fname in os.listdir(CONFIG_DIR):
+        if not fname.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(CONFIG_DIR, fname), 'r', encoding='utf-8') as f:
+                cfg = json.load(f)
+        except Exception as e:
+            logger.error(f"[RETENTION] Failed to parse config file {fname}: {e}")
+            continue
+        if "group_id" in cfg:
+            groups[str(cfg["group_id"])] = set(cfg.get("hosts", {}).keys())
+    return groups
+
+
+def _iter_mirrors() -> Iterator[Tuple[str, str, str]]:
+    """遍历所有镜像文件，产出 (group_id, 组目录名, 镜像路径)"""
+    for gname in sorted(os.listdir(LOG_MIRROR_DIR)):
+        m = GROUP_DIR_RE.match(gname)
+        gdir = os.path.join(LOG_MIRROR_DIR, gname)
+        if not m or not os.path.isdir(gdir):
+            continue
+        for root, dirs, files in os.walk(gdir):
+            dirs[:] = [d for d in dirs if d != log_mirror_store.SEGMENT_DIR_NAME]
+            for name in files:
+                if name.endswith(('.log', '.count')):
+                    yield m.group(1), gname, os.path.join(root, name)
+
+
+def _offset_entry(gname: str, mirror_path: str) -> Dict[str, Any]:
+    mirror_dir = os.path.dirname(mirror_path)
+    dir_part = os.path.relpath(mirror_dir, os.path.join(LOG_MIRROR_DIR, gname))
+    offset_path = os.path.join(LOG_OFFSET_DIR, f"{gname}_{dir_part.replace(os.sep, '_')}.json")
+    info = load_or_init_offsets(offset_path).get(os.path.basename(mirror_path))
+    return info if isinstance(info, dict) else {}
+
+
+def collect_usage() -> Dict[str, Any]:
+    groups: Dict[str, Dict[str, int]] = {}
+    mirror_bytes = 0
+    logical_bytes = 0
+    for group_id, _, mirror_path in _iter_mirrors():
+        logical, physical, sealed = log_mirror_store.mirror_disk_usage(mirror_path)
+        g = groups.setdefault(group_id, {"bytes": 0, "logical_bytes": 0, "files": 0, "sealed_segments": 0})
+        g["bytes"] += physical
+        g["logical_bytes"] += logical
+        g["files"] += 1
+        g["sealed_segments"] += sealed
+        mirror_bytes += physical
+        logical_bytes += logical
+
+    raw_bytes = _dir_size(LOG_RAW_MIRROR_DIR)[0] if os.path.isdir(LOG_RAW_MIRROR_DIR) else 0
+    offset_bytes, _ = _dir_size(LOG_OFFSET_DIR)
+    index_bytes, _ = _dir_size(log_search_service.LOG_INDEX_DIR)
+
+    file_hosts = {}
+    files_bytes = 0
+    if os.path.isdir(FILES_DIR):
+        for host_ip in sorted(os.listdir(FILES_DIR)):
+            host_dir = os.path.join(FILES_DIR, host_ip)
+            if os.path.isdir(host_dir):
+                size, _ = _dir_size(host_dir)
+                file_hosts[host_ip] = size
+                files_bytes += size
+
+    store_bytes, _ = _dir_size(config_store_service.STORE_DIR)
+
+    disk = shutil.disk_usage(BASE_DIR)
+    return {
+        "disk": {"total": disk.total, "used": disk.used, "free": disk.free},
+        "total_bytes": mirror_bytes + raw_bytes + offset_bytes + index_bytes + files_bytes + store_bytes,
+        "mirrors": {"bytes": mirror_bytes, "logical_bytes": logical_bytes, "groups": groups},
+        "raw_mirrors": {"bytes": raw_bytes},
+        "offsets": {"bytes": offset_bytes},
+        "search_index": {"bytes": index_bytes},
+        "files": {"bytes": files_bytes, "hosts": file_hosts},
+        "file_store": {"bytes": store_bytes},
+        "limits": {
+            "group_quota_mb": settings.RETENTION_GROUP_QUOTA_MB,
+            "global_quota_mb": settings.RETENTION_GLOBAL_QUOTA_MB,
+            "max_age_days": settings.RETENTION_MAX_AGE_DAYS,
+        },
+    }
+
+
+def _evict(group_id: str, mirror_path: str, segment: Dict) -> int:
+    # 索引删除需要原文，必须在段数据删除之前
+    log_search_service.drop_file_blocks(group_id, mirror_path, before=segment["end"])
+    return log_mirror_store.evict_segment(segment)
+
+
+async def _evict_oldest(group_id: str, mirror_path: str, start: int) -> Optional[int]:
+    """
+    在镜像锁内淘汰该镜像最早的未淘汰段，返回释放的字节数；
+    拿到锁时最早的段已不是 start 开头的（镜像被并发重置等）则放弃，返回 None。
+    """
+    async with log_mirror_store.mirror_lock(mirror_path):
+        live = [s for s in log_mirror_store.list_segments(mirror_path) if not s.get("evicted")]
+        if not live or live[0]["start"] != start:
+            return None
+        return await asyncio.to_thread(_evict, group_id, mirror_path, live[0])
+
+
+async def _evict_lru(mirrors: List[Tuple[str, str]], over_by: int) -> int:
+    """
+    按 LRU 淘汰封存段直到释放 over_by 字节。每个镜像只从最早的段开始淘汰，
+    保证剩余数据在逻辑流中连续；在不同镜像之间按最近访问时间挑选最冷的。
+    """
+    heap = []
+    for group_id, mirror_path in mirrors:
+        live = [s for s in log_mirror_store.list_segments(mirror_path) if not s.get("evicted")]
+        if live:
+            heap.append((log_mirror_store.segment_last_access(live[0]), group_id, mirror_path))
+    heapq.heapify(heap)
+
+    freed = 0
+    while heap and freed < over_by:
+        _, group_id, mirror_path = heapq.heappop(heap)
+        live = [s for s in log_mirror_store.list_segments(mirror_path) if not s.get("evicted")]
+        if not live:
+            continue
+        freed += await _evict_oldest(group_id, mirror_path, live[0]["start"]) or 0
+        if len(live) > 1:
+            heapq.heappush(heap, (log_mirror_store.segment_last_access(live[1]), group_id, mirror_path))
+    return freed
+
+
+def _offset_names(gname: str) -> set:
+    """组目录下各镜像目录对应的 offset 文件名（与 fetch_logs 的命名一致：<组目录名>_<log_dir 以 _ 连接>.json）"""
+    gdir = os.path.join(LOG_MIRROR_DIR, gname)
+    names = set()
+    for root, dirs, _ in os.walk(gdir):
+        dirs[:] = [d for d in dirs if d != log_mirror_store.SEGMENT_DIR_NAME]
+        if root != gdir:
+            names.add(f"{gname}_{os.path.relpath(root, gdir).replace(os.sep, '_')}.json")
+    return names
+
+
+def _remove_orphans(now: float, max_age: float) -> List[str]:
+    """清理已不在 net-conf 中、且超过 max_age 没有更新的组 / 主机目录，以及镜像目录已不存在的 offset 文件"""
+    removed = []
+    configured = _configured_hosts()
+    configured_ips = set().union(*configured.values()) if configured else set()
+    for gname in os.listdir(LOG_MIRROR_DIR):
+        m = GROUP_DIR_RE.match(gname)
+        if not m or m.group(2) in configured.get(m.group(1), ()):
+            continue
+        gdir = os.path.join(LOG_MIRROR_DIR, gname)
+        if now - _dir_size(gdir)[1] < max_age:
+            continue
+        for root, dirs, files in os.walk(gdir):
+            dirs[:] = [d for d in dirs if d != log_mirror_store.SEGMENT_DIR_NAME]
+            for name in files:
+                log_search_service.drop_file_blocks(m.group(1), os.path.join(root, name))
+        offset_names = _offset_names(gname)
+        shutil.rmtree(gdir, ignore_errors=True)
+        shutil.rmtree(os.path.join(LOG_RAW_MIRROR_DIR, gname), ignore_errors=True)
+        for fname in offset_names:
+            path = os.path.join(LOG_OFFSET_DIR, fname)
+            if os.path.exists(path):
+                os.remove(path)
+        removed.append(f"log-mirrors/{gname}")
+
+    if os.path.isdir(FILES_DIR):
+        for host_ip in os.listdir(FILES_DIR):
+            host_dir = os.path.join(FILES_DIR, host_ip)
+            if host_ip in configured_ips or not os.path.isdir(host_dir):
+                continue
+            if now - _dir_size(host_dir)[1] < max_age:
+                continue
+            shutil.rmtree(host_dir, ignore_errors=True)
+            manifest = os.path.join(MANIFEST_DIR, f"{host_ip}.json")
+            if os.path.exists(manifest):
+                os.remove(manifest)
+            config_store_service.remove_host(host_ip)
+            removed.append(f"files/{host_ip}")
+
+    # 镜像目录已不存在的 offset 文件：按组目录名 + 目录逐个精确匹配，不按前缀猜
+    live_names = set()
+    for gname in os.listdir(LOG_MIRROR_DIR):
+        if GROUP_DIR_RE.match(gname):
+            live_names |= _offset_names(gname)
+    for fname in os.listdir(LOG_OFFSET_DIR):
+        path = os.path.join(LOG_OFFSET_DIR, fname)
+        if fname.endswith('.json') and fname not in live_names and now - os.path.getmtime(path) >= max_age:
+            os.remove(path)
+            removed.append(f"log-offsets/{fname}")
+    return removed
+
+
+def _mirrors_by_group() -> Dict[str, List[str]]:
+    by_group: Dict[str, List[str]] = {}
+    for group_id, _, mirror_path in _iter_mirrors():
+        by_group.setdefault(group_id, []).append(mirror_path)
+    return by_group
+
+
+def _group_usage(mirrors: List[str]) -> int:
+    return sum(log_mirror_store.mirror_disk_usage(p)[1] for p in mirrors)
+
+
+async def enforce_limits() -> Dict[str, Any]:
+    """
+    按 settings 中的期限 / 配额淘汰封存段，三项默认都是 0（不启用）。
+    淘汰在对应镜像的 mirror_lock 内进行，与 fetch_logs 的追加、封存互斥；文件操作放到线程里执行。
+    孤立目录和 offset 文件的清理也只在设置了 RETENTION_MAX_AGE_DAYS 时进行。
+    """
+    report = {"expired_segments": 0, "evicted_bytes": 0, "removed_orphans": []}
+    now = time.time()
+    max_age = settings.RETENTION_MAX_AGE_DAYS * DAY
+    by_group = await asyncio.to_thread(_mirrors_by_group)
+
+    # ---------- 按时间淘汰：封存时间超过 max_age 的段 ----------
+    if max_age:
+        for group_id, mirrors in by_group.items():
+            for mirror_path in mirrors:
+                for segment in log_mirror_store.list_segments(mirror_path):
+                    if segment.get("evicted"):
+                        continue
+                    if now - os.path.getmtime(segment["path"]) < max_age:
+                        break
+                    freed = await _evict_oldest(group_id, mirror_path, segment["start"])
+                    if freed is None:
+                        break
+                    report["evicted_bytes"] += freed
+                    report["expired_segments"] += 1
+
+    # ---------- 按配额淘汰：先每组，再全局 ----------
+    group_quota = settings.RETENTION_GROUP_QUOTA_MB * MB
+    global_quota = settings.RETENTION_GLOBAL_QUOTA_MB * MB
+    if group_quota or global_quota:
+        total = 0
+        for group_id, mirrors in by_group.items():
+            used = await asyncio.to_thread(_group_usage, mirrors)
+            if group_quota and used > group_quota:
+                freed = await _evict_lru([(group_id, p) for p in mirrors], used - group_quota)
+                logger.info(f"[RETENTION] group {group_id} over quota by {used - group_quota} bytes, freed {freed}")
+                report["evicted_bytes"] += freed
+                used -= freed
+                if used > group_quota:
+                    logger.warning(f"[RETENTION] group {group_id} still over quota: only active segments left")
+            total += used
+
+        if global_quota and total > global_quota:
+            all_mirrors = [(g, p) for g, mirrors in by_group.items() for p in mirrors]
+            freed = await _evict_lru(all_mirrors, total - global_quota)
+            logger.info(f"[RETENTION] mirrors over global quota by {total - global_quota} bytes, freed {freed}")
+            report["evicted_bytes"] += freed
+
+    # ---------- 清理已不在 net-conf 中的组 / 主机、孤立的 offset 文件 ----------
+    if max_age:
+        report["removed_orphans"] = await asyncio.to_thread(_remove_orphans, now, max_age)
+
+    return report
+
+
+async def compact_idle_mirrors() -> Dict[str, Any]:
+    """
+    后台压缩：把长时间没有新内容的活动段封存成压缩段（RETENTION_COMPACT_IDLE_SECONDS 为 0 时不做）。
+    只处理已经是新格式（offsets 里有 mirror_offset）的镜像，和 fetch_logs 共用镜像锁。
+    """
+    idle = settings.RETENTION_COMPACT_IDLE_SECONDS
+    now = time.time()
+    sealed = 0
+    saved = 0
+    if idle <= 0:
+        return {"sealed_segments": sealed, "saved_bytes": saved}
+    for _, gname, mirror_path in list(_iter_mirrors()):
+        try:
+            st = os.stat(mirror_path)
+        except FileNotFoundError:
+            continue
+        if st.st_size < COMPACT_MIN_BYTES or now - st.st_mtime < idle:
+            continue
+        if "mirror_offset" not in _offset_entry(gname, mirror_path):
+            continue
+        async with log_mirror_store.mirror_lock(mirror_path):
+            end = log_mirror_store.active_base(mirror_path) + os.path.getsize(mirror_path)
+            index = await asyncio.to_thread(log_mirror_store.seal_active_segment, mirror_path, end)
+        if index:
+            sealed += 1
+            saved += (index["end"] - index["start"]) - sum(fr[2] for fr in index["frames"])
+    return {"sealed_segments": sealed, "saved_bytes": saved}
+
+
+async def run_retention_cycle() -> Dict[str, Any]:
+    logger.info("[RETENTION] Start retention cycle")
+    compaction = await compact_idle_mirrors()
+    limits = await enforce_limits()
+    file_store = await asyncio.to_thread(config_store_service.collect_garbage)
+    usage = await asyncio.to_thread(collect_usage)
+    logger.info(f"[RETENTION] Done: compaction={compaction}, limits={limits}, file_store={file_store}, "
+                f"total_bytes={usage['total_bytes']}")
+    return {"compaction": compaction, "limits": limits, "file_store": file_store, "usage": usage}
+
+
+async def _retention_loop():
+    while True:
+        await asyncio.sleep(settings.RETENTION_INTERVAL_SECONDS)
+        try:
+            await run_retention_cycle()
+        except Exception as e:
+            logger.error(f"[RETENTION] Retention cycle failed: {e}")
+            logger.error(traceback.format_exc())
+
+
+def start_retention_task():
+    global _retention_task
+    if settings.RETENTION_INTERVAL_SECONDS > 0 and (_retention_task is None or _retention_task.done()):
+        _retention_task = asyncio.create_task(_retention_loop())
+
+
+async def stop_retention_task():
+    global _retention_task
+    if _retention_task:
+        _retention_task.cancel()
+        try:
+            await _retention_task
+        except asyncio.CancelledError:
+            pass
+        _retention_task = None
@@ -1,54 +1,332 @@
 #app/services/sftp_utils.py
 import os
 import stat
+import shlex
+import time
+import uuid
+import hashlib
+import asyncio
 import logging
+import asyncssh
 
-async def sftp_get_dir(sftp, remote_dir, local_base_dir, copied_files, host_ip, base_remote_dir=None, logger=None):
-    if base_remote_dir is None:
-        base_remote_dir = remote_dir.rstrip('/')
+from app.utils.file_ops import file_sha256
 
-    if logger:
-        logger.info(f"Listing remote directory: {remote_dir}")
-        logger.info(f"Listing local directory: {local_base_dir}")
+MAX_PARALLEL_LISTS = 8  # 同时进行的 readdir 数
+MAX_PARALLEL_GETS = 8  # 同时进行的下载数（每个 get 自身还会流水线发多个读请求）
+REMOTE_HASH_TIMEOUT = 30  # 远端 sha256sum 的超时（秒）
+DELTA_MIN_BYTES = 256 * 1024  # 小于该大小的文件直接整文件上传
+DELTA_BLOCK_SIZE = 4096  # 块大小下限，与 SQLite 默认页大小一致
+DELTA_MAX_BLOCKS = 16384  # 块数超过该值时块大小翻倍，控制远端摘要列表的大小
+DELTA_MAX_CHANGED_RATIO = 0.5  # 变化的块超过该比例时不如整文件上传
 
+# 远端按固定块计算 md5，每块一行；只依赖 python3 标准库
+_REMOTE_BLOCK_HASH_SCRIPT = (
+    "import hashlib,sys\n"
+    "n=int(sys.argv[2])\n"
+    "with open(sys.argv[1],'rb') as f:\n"
+    "    for b in iter(lambda: f.read(n), b''):\n"
+    "        sys.stdout.write(hashlib.md5(b).hexdigest()+'\\n')\n"
+)
+
+
+def manifest_entry(attrs, local_path):
+    """
+    下载完成后的清单条目：远端的大小、mtime，内容摘要，以及本地副本落盘后的大小和 mtime。
+    本地副本之后被改写（推送前的修改、失败后的恢复）时大小或 mtime 会变，下次同步就会重新拉取。
+    """
+    sha256 = file_sha256(local_path)
+    st = os.stat(local_path)
+    return {"size": attrs.size, "mtime": attrs.mtime, "sha256": sha256,
+            "local_size": st.st_size, "local_mtime_ns": st.st_mtime_ns}
+
+
+def manifest_matches(entry, attrs, local_path):
+    """远端文件的大小、mtime 与上次同步时一致，且本地副本还是当时拉下来的那份"""
+    if entry is None or entry.get("size") != attrs.size or entry.get("mtime") != attrs.mtime:
+        return False
+    try:
+        st = os.stat(local_path)
+    except FileNotFoundError:
+        return False
+    return entry.get("local_size") == st.st_size and entry.get("local_mtime_ns") == st.st_mtime_ns
+
+
+async def remote_sha256(ssh, remote_path, timeout=REMOTE_HASH_TIMEOUT):
+    """在远端执行 sha256sum，返回十六进制摘要；命令不可用或失败时返回 None"""
+    try:
+        result = await ssh.run(f"sha256sum -- {shlex.quote(remote_path)}", check=False, timeout=timeout)
+    except Exception:
+        return None
+    if result.exit_status != 0 or not result.stdout:
+        return None
+    digest = result.stdout.split(maxsplit=1)[0].lstrip("\\").lower()
+    return digest if len(digest) == 64 else None
+
+
+async def verify_remote_file(ssh, sftp, local_path, remote_path):
+    """
+    比较本地文件和远端文件是否一致，不传输文件内容。
+    返回 "verified"（sha256 一致）/ "mismatch" / "unverified"（远端算不出摘要，只比对了大小）。
+    """
+    local_hash, remote_hash = await asyncio.gather(
+        asyncio.to_thread(file_sha256, local_path),
+        remote_sha256(ssh, remote_path)
+    )
+    if remote_hash is not None:
+        return "verified" if remote_hash == local_hash else "mismatch"
+    attrs = await sftp.stat(remote_path)
+    return "unverified" if attrs.size == os.path.getsize(local_path) else "mismatch"
+
+
+def staged_path(remote_path, token):
+    """与目标同目录的隐藏临时文件，保证 rename 不跨文件系统"""
+    directory, name = os.path.split(remote_path)
+    return os.path.join(directory, f".{name}.tmp-{token}")
+
+
+async def atomic_replace(ssh, sftp, staged, remote_path):
+    """
+    把已上传的临时文件原子替换到目标路径：沿用原文件的权限，
+    优先用 posix-rename 扩展（覆盖已存在的目标），服务端不支持时在远端执行 mv -f。
+    """
+    try:
+        current = await sftp.stat(remote_path)
+        if current.permissions is not None:
+            await sftp.chmod(staged, stat.S_IMODE(current.permissions))
+    except asyncssh.SFTPNoSuchFile:
+        pass
+    try:
+        await sftp.posix_rename(staged, remote_path)
+    except asyncssh.SFTPOpUnsupported:
+        result = await ssh.run(f"mv -f -- {shlex.quote(staged)} {shlex.quote(remote_path)}", check=False,
+                               timeout=REMOTE_HASH_TIMEOUT)
+        if result.exit_status != 0:
+            raise RuntimeError(f"mv failed: {(result.stderr or '').strip()}")
+
+
+async def remove_quietly(sftp, remote_path):
     try:
-        entries = await sftp.listdir(remote_dir)
-    except Exception as e:
-        if logger:
-            logger.error(f"Failed to list directory {remote_dir}: {e}")
-        return
+        await sftp.remove(remote_path)
+    except Exception:
+        pass
 
-    for filename in entries:
-        # 跳过当前目录 . 和父目录 ..
-        if filename in ('.', '..'):
-            continue
 
-        remote_path = os.path.normpath(os.path.join(remote_dir, filename))
-        relative_path = remote_path.lstrip('/')
-        local_path = os.path.join(local_base_dir, relative_path)
+def delta_block_size(size):
+    block = DELTA_BLOCK_SIZE
+    while size > block * DELTA_MAX_BLOCKS:
+        block *= 2
+    return block
+
+
+def local_block_hashes(local_path, block_size):
+    with open(local_path, "rb") as f:
+        return [hashlib.md5(b).hexdigest() for b in iter(lambda: f.read(block_size), b"")]
+
+
+async def remote_block_hashes(ssh, remote_path, block_size, timeout=REMOTE_HASH_TIMEOUT):
+    """远端文件每块的 md5；远端没有 python3、文件不存在等情况返回 None"""
+    cmd = f"python3 -c {shlex.quote(_REMOTE_BLOCK_HASH_SCRIPT)} {shlex.quote(remote_path)} {int(block_size)}"
+    try:
+        result = await ssh.run(cmd, check=False, timeout=timeout)
+    except Exception:
+        return None
+    if result.exit_status != 0:
+        return None
+    return (result.stdout or "").split()
+
 
-        if logger:
-            logger.info(f"Processing remote_path: {remote_path}, local_path: {local_path}")
+async def delta_stage(ssh, sftp, local_path, remote_path, target, logger=None):
+    """
+    块级增量写入：只把与本地不同的块写进 target 并截断到本地大小。
+    target 与 remote_path 不同时，远端先把当前文件复制成 target（服务器本地 cp，不经网络），
+    用于暂存后 rename；相同时直接改写远端文件（保持 inode 不变）。
+    块按固定偏移比较（SQLite 按页原地修改，改一行只动少数几页），不做 rsync 式的滑动匹配。
+    不适用（文件太小、远端算不出块摘要、变化太多、cp 失败）时返回 None，由调用方整文件上传；
+    成功返回 {"transfer": "delta", "block_size", "blocks", "changed_blocks", "sent_bytes"}。
+    target 的内容是否正确由调用方随后校验。
+    """
+    logger = logger or logging.getLogger(__name__)
+    size = os.path.getsize(local_path)
+    if size < DELTA_MIN_BYTES:
+        return None
 
+    block_size = delta_block_size(size)
+    local_hashes, remote_hashes = await asyncio.gather(
+        asyncio.to_thread(local_block_hashes, local_path, block_size),
+        remote_block_hashes(ssh, remote_path, block_size)
+    )
+    if remote_hashes is None:
+        logger.info(f"Block hashes unavailable for {remote_path}, falling back to full upload")
+        return None
+
+    changed = [i for i, h in enumerate(local_hashes) if i >= len(remote_hashes) or remote_hashes[i] != h]
+    if len(changed) > len(local_hashes) * DELTA_MAX_CHANGED_RATIO:
+        logger.info(f"{len(changed)}/{len(local_hashes)} blocks of {remote_path} changed, using full upload")
+        return None
+
+    staged = target != remote_path
+    if staged:
+        result = await ssh.run(f"cp -p -- {shlex.quote(remote_path)} {shlex.quote(target)}", check=False,
+                               timeout=REMOTE_HASH_TIMEOUT)
+        if result.exit_status != 0:
+            logger.warning(f"Remote copy of {remote_path} failed, falling back to full upload: "
+                           f"{(result.stderr or '').strip()}")
+            return None
+
+    sent = 0
+    try:
+        async with sftp.open(target, "r+b") as dst:
+            with open(local_path, "rb") as src:
+                for i in changed:
+                    src.seek(i * block_size)
+                    data = src.read(block_size)
+                    await dst.write(data, i * block_size)
+                    sent += len(data)
+            await dst.truncate(size)
+    except Exception:
+        if staged:
+            await remove_quietly(sftp, target)
+        raise
+
+    logger.info(f"Delta upload of {remote_path}: {len(changed)}/{len(local_hashes)} blocks, {sent} of {size} bytes")
+    return {"transfer": "delta", "block_size": block_size, "blocks": len(local_hashes),
+            "changed_blocks": len(changed), "sent_bytes": sent}
+
+
+async def delta_put(ssh, sftp, local_path, remote_path, logger=None):
+    """
+    更新远端文件但保持 inode 不变（如 HLR 一直打开着的数据库，换 inode 后进程仍读旧文件）。
+    不直接改线上文件：先在同目录的 cp -p 副本上写入变化的块（不适用时整文件上传到副本），校验副本，
+    再用一条远端 cp 把副本内容写回原文件（cp 覆盖已存在的目标时沿用其 inode），最后校验原文件。
+    增量写入出错或副本校验不一致时退回整文件上传，原因记在返回统计的 "fallback" 里；
+    整文件上传后仍不一致则抛 RuntimeError，此时线上文件未被改动。返回传输统计（含 "verify"）。
+    """
+    logger = logger or logging.getLogger(__name__)
+    staged = staged_path(remote_path, uuid.uuid4().hex[:8])
+    fallback = None
+    try:
         try:
-            attrs = await sftp.stat(remote_path)
+            stats = await delta_stage(ssh, sftp, local_path, remote_path, staged, logger=logger)
         except Exception as e:
-            if logger:
-                logger.error(f"Failed to stat {remote_path}: {e}")
-            continue
-
-        if stat.S_ISDIR(attrs.permissions):
-            os.makedirs(local_path, exist_ok=True)
-            if logger:
-                logger.info(f"Created local directory: {local_path}")
-            await sftp_get_dir(sftp, remote_path, local_base_dir, copied_files, host_ip, base_remote_dir, logger)
-        else:
-            os.makedirs(os.path.dirname(local_path), exist_ok=True)
-            if logger:
-                logger.info(f"Copying file from {remote_path} to {local_path}")
+            logger.warning(f"Delta upload of {remote_path} failed, falling back to full upload: {e}")
+            stats, fallback = None, f"delta failed: {e}"
+        if stats is not None and await verify_remote_file(ssh, sftp, local_path, staged) == "mismatch":
+            logger.warning(f"Checksum mismatch after delta upload of {remote_path}, falling back to full upload")
+            stats, fallback = None, "checksum mismatch after delta"
+        if stats is None:
+            await sftp.put(local_path, staged)
+            stats = {"transfer": "full", "sent_bytes": os.path.getsize(local_path)}
+            if fallback:
+                stats["fallback"] = fallback
+            if await verify_remote_file(ssh, sftp, local_path, staged) == "mismatch":
+                raise RuntimeError(f"Checksum mismatch after upload of {remote_path}, remote file left unchanged")
+
+        result = await ssh.run(f"cp -- {shlex.quote(staged)} {shlex.quote(remote_path)}", check=False,
+                               timeout=REMOTE_HASH_TIMEOUT)
+        if result.exit_status != 0:
+            raise RuntimeError(f"Failed to copy staged file over {remote_path}: {(result.stderr or '').strip()}")
+        stats["verify"] = await verify_remote_file(ssh, sftp, local_path, remote_path)
+        if stats["verify"] == "mismatch":
+            raise RuntimeError(f"Checksum mismatch after upload of {remote_path}")
+        return stats
+    finally:
+        await remove_quietly(sftp, staged)
+
+
+async def sftp_get_dir(sftp, remote_dir, local_base_dir, copied_files, host_ip, base_remote_dir=None, logger=None,
+                       max_parallel=MAX_PARALLEL_GETS, failures=None, manifest=None, seen=None):
+    """
+    把远端目录整棵拉到 local_base_dir/<remote_path>。
+    readdir 直接带回每个条目的属性，不再逐个 stat（符号链接除外，需要跟到目标）；
+    各子目录并发遍历，发现文件就交给有上限的下载池，遍历和下载同时进行。
+    传入 manifest（remote_path -> manifest_entry）时，远端大小和 mtime 都没变、本地副本也没被改写过的跳过，
+    下载过的文件更新进 manifest；seen 收集本次在远端看到的文件。
+    返回统计信息 {"dirs", "files", "skipped", "bytes", "errors", "failed_dirs", "seconds"}。
+    """
+    logger = logger or logging.getLogger(__name__)
+    stats = {"dirs": 0, "files": 0, "skipped": 0, "bytes": 0, "errors": 0, "failed_dirs": []}
+    list_sem = asyncio.Semaphore(MAX_PARALLEL_LISTS)
+    get_sem = asyncio.Semaphore(max_parallel)
+    downloads = []
+    started = time.monotonic()
+
+    def record_failure(remote_path, error):
+        stats["errors"] += 1
+        if failures is not None:
+            failures.append({"host": host_ip, "file": remote_path, "error": str(error)})
+
+    async def fetch(remote_path, local_path, attrs):
+        async with get_sem:
+            logger.debug(f"Copying file from {remote_path} to {local_path}")
             try:
+                if manifest is not None:
+                    manifest.pop(remote_path, None)  # 下载中断时本地文件可能不完整，下次必须重新拉
                 await sftp.get(remote_path, local_path)
                 copied_files.append(f"{host_ip}{remote_path}")
+                stats["files"] += 1
+                stats["bytes"] += attrs.size or 0
+                if manifest is not None:
+                    manifest[remote_path] = await asyncio.to_thread(manifest_entry, attrs, local_path)
+            except Exception as e:
+                logger.error(f"Failed to get file {remote_path}: {e}")
+                record_failure(remote_path, e)
+
+    async def walk(path):
+        async with list_sem:
+            try:
+                entries = await sftp.readdir(path)
             except Exception as e:
-                if logger:
-                    logger.error(f"Failed to get file {remote_path}: {e}")
+                logger.error(f"Failed to list directory {path}: {e}")
+                record_failure(path, e)
+                stats["failed_dirs"].append(path)
+                return
+        stats["dirs"] += 1
+
+        subdirs = []
+        for entry in entries:
+            # 跳过当前目录 . 和父目录 ..
+            if entry.filename in ('.', '..'):
+                continue
+
+            remote_path = os.path.normpath(os.path.join(path, entry.filename))
+            local_path = os.path.join(local_base_dir, remote_path.lstrip('/'))
+            attrs = entry.attrs
+            if attrs.permissions is None or stat.S_ISLNK(attrs.permissions):
+                try:
+                    attrs = await sftp.stat(remote_path)
+                except Exception as e:
+                    logger.error(f"Failed to stat {remote_path}: {e}")
+                    record_failure(remote_path, e)
+                    continue
+
+            if stat.S_ISDIR(attrs.permissions):
+                os.makedirs(local_path, exist_ok=True)
+                subdirs.append(remote_path)
+            else:
+                if seen is not None:
+                    seen.add(remote_path)
+                if manifest is not None and manifest_matches(manifest.get(remote_path), attrs, local_path):
+                    stats["skipped"] += 1
+                    continue
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                downloads.append(asyncio.create_task(fetch(remote_path, local_path, attrs)))
+
+        await asyncio.gather(*(walk(d) for d in subdirs))
+
+    try:
+        await walk(remote_dir)
+        await asyncio.gather(*downloads)
+    finally:
+        # 被取消（如整机同步超时）时不能让下载任务脱离调用方继续使用即将关闭的 SFTP 会话、改写本地文件和 manifest
+        for task in downloads:
+            task.cancel()
+        await asyncio.gather(*downloads, return_exceptions=True)
+
+    stats["seconds"] = round(time.monotonic() - started, 3)
+    rate = stats["bytes"] / 1024 / stats["seconds"] if stats["seconds"] else 0
+    logger.info(
+        f"Pulled {host_ip}:{remote_dir}: {stats['files']} files ({stats['skipped']} unchanged), "
+        f"{stats['bytes']} bytes in {stats['dirs']} dirs, "
+        f"{stats['seconds']}s ({rate:.1f} KB/s), {stats['errors']} errors"
+    )
+    return stats
@@ -1,9 +1,17 @@
 #app/services/update_file_service.py
 import os
+import glob
+import uuid
+import asyncio
 import logging
+from app.core.config import settings
 from app.services.async_ssh_pool import ssh_pool
+from app.services.sftp_utils import verify_remote_file, staged_path, atomic_replace, remove_quietly, delta_stage
 from typing import List
 from app.schemas.update_file import FileContentItem
+from app.services.config_transform_service import (
+    compile_rules, plmn_rules, rules_for_file, transform_file, unified_diff
+)
 
 
 
@@ -13,80 +21,280 @@ BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 FILES_DIR = os.path.join(BASE_DIR, 'files')
 os.makedirs(FILES_DIR, exist_ok=True)
 
-async def update_files(mcc: str, mnc: str, file_paths: list):
+def read_backup(local_file_path: str):
+    """修改前的本地副本，用于回滚；文件原本不存在时为 None"""
+    if not os.path.isfile(local_file_path):
+        return None
+    with open(local_file_path, "rb") as f:
+        return f.read()
+
+
+def restore_local(item: dict) -> None:
+    if item["backup"] is None:
+        if os.path.isfile(item["local_path"]):
+            os.remove(item["local_path"])
+        return
+    with open(item["local_path"], "wb") as f:
+        f.write(item["backup"])
+
+
+def _fail(items: list, error: str, only_pending: bool = False) -> None:
+    for item in items:
+        if not only_pending or item["result"]["status"] == "pending":
+            item["result"].update(status="failed", error=error)
+
+
+async def stage_host_files(ssh, sftp, items: list, token: str) -> None:
+    """第一阶段：上传到目标同目录下的临时文件并校验，线上文件不受影响；大文件只传变化的块"""
+    for item in items:
+        staged = item["staged"] = staged_path(item["remote_path"], token)
+        try:
+            logger.info(f"上传本地文件 {item['local_path']} 到远端临时文件 {staged}")
+            stats = await delta_stage(ssh, sftp, item["local_path"], item["remote_path"], staged, logger=logger)
+            if stats is None:
+                await sftp.put(item["local_path"], staged)
+                stats = {"transfer": "full", "sent_bytes": os.path.getsize(item["local_path"])}
+            status = await verify_remote_file(ssh, sftp, item["local_path"], staged)
+            if status == "mismatch":
+                raise RuntimeError("临时文件校验不一致")
+            item["result"].update(status="staged", verify=status, transfer=stats["transfer"],
+                                  sent_bytes=stats["sent_bytes"])
+        except Exception as e:
+            logger.error(f"暂存 {item['host']}:{item['remote_path']} 出错: {e}")
+            item["result"].update(status="failed", error=str(e))
+            await remove_quietly(sftp, staged)
+
+
+async def commit_host_files(ssh, sftp, items: list) -> None:
+    """第二阶段：同一主机的临时文件并发 rename 到位"""
+    async def commit(item):
+        try:
+            await atomic_replace(ssh, sftp, item["staged"], item["remote_path"])
+            item["result"]["status"] = "updated"
+        except Exception as e:
+            logger.error(f"替换 {item['host']}:{item['remote_path']} 出错: {e}")
+            item["result"].update(status="failed", error=str(e))
+            await remove_quietly(sftp, item["staged"])
+
+    await asyncio.gather(*(commit(item) for item in items))
+
+
+async def revert_host_files(ssh, sftp, items: list, token: str) -> None:
+    """
+    回滚已提交的文件：把修改前的内容以同样的暂存 + rename 推回远端，远端回滚成功后才恢复本地副本；
+    回滚不了的记为 failed（远端和本地副本都还是新内容）。
+    """
+    for item in items:
+        if item["backup"] is None:
+            item["result"].update(status="failed", error="没有修改前的本地副本，无法回滚")
+            continue
+        staged = staged_path(item["remote_path"], token)
+        try:
+            async with sftp.open(staged, "wb") as f:
+                await f.write(item["backup"])
+            await atomic_replace(ssh, sftp, staged, item["remote_path"])
+            restore_local(item)
+            item["result"]["status"] = "rolled_back"
+        except Exception as e:
+            logger.error(f"回滚 {item['host']}:{item['remote_path']} 出错: {e}")
+            item["result"].update(status="failed", error=f"回滚失败: {e}")
+            await remove_quietly(sftp, staged)
+
+
+async def rollout_files(items: list, rollback: bool = False) -> None:
+    """
+    两阶段推送：各主机并发把文件上传到临时文件并校验，全部暂存完成后再并发 rename 到位，
+    线上文件只在很短的提交窗口内变化，不会被读到写了一半的内容。每台主机一个 SFTP 会话。
+    rollback 为 True 时，任何文件暂存失败则整批放弃（删除临时文件，本地副本恢复为修改前的内容）；
+    提交阶段有失败则把已提交的文件推回修改前的内容，本地副本只在对应的远端恢复成功后才恢复。
+    """
+    by_host = {}
+    for item in items:
+        by_host.setdefault(item["host"], []).append(item)
+
+    token = uuid.uuid4().hex[:8]
+    semaphore = asyncio.Semaphore(max(settings.FILE_SYNC_MAX_HOSTS, 1))
+    sessions = {}
+
+    async def per_host(phase, host_ip: str, host_items: list, *args):
+        async with semaphore:
+            try:
+                ssh, sftp = sessions[host_ip]
+                await phase(ssh, sftp, host_items, *args)
+            except Exception as e:
+                logger.error(f"推送文件到 {host_ip} 出错: {e}")
+                _fail(host_items, str(e), only_pending=True)
+
+    async def open_session(host_ip: str, host_items: list):
+        async with semaphore:
+            try:
+                ssh = await ssh_pool.get_connection(host_ip)
+                if not ssh:
+                    logger.error(f"无法连接远端主机 {host_ip}")
+                    _fail(host_items, "SSH connection failed")
+                    return
+                sessions[host_ip] = (ssh, await ssh.start_sftp_client())
+            except Exception as e:
+                logger.error(f"SFTP 会话错误 {host_ip}: {e}")
+                _fail(host_items, str(e))
+
+    def select(status: str):
+        groups = {}
+        for item in items:
+            if item["result"]["status"] == status and item["host"] in sessions:
+                groups.setdefault(item["host"], []).append(item)
+        return groups
+
+    try:
+        await asyncio.gather(*(open_session(h, hi) for h, hi in by_host.items()))
+        await asyncio.gather(*(per_host(stage_host_files, h, hi, token) for h, hi in select("pending").items()))
+
+        staged = select("staged")
+        if rollback and any(item["result"]["status"] != "staged" for item in items):
+            # 整批放弃：删除已暂存的临时文件
+            for host_ip, host_items in staged.items():
+                _, sftp = sessions[host_ip]
+                await asyncio.gather(*(remove_quietly(sftp, item["staged"]) for item in host_items))
+                for item in host_items:
+                    item["result"]["status"] = "aborted"
+            for item in items:
+                restore_local(item)
+            return
+
+        await asyncio.gather(*(per_host(commit_host_files, h, hi) for h, hi in staged.items()))
+
+        failed = [item for item in items if item["result"]["status"] == "failed"]
+        if rollback and failed:
+            # 没能提交的文件远端还是旧内容，本地副本跟着恢复；已提交的逐个推回旧内容
+            for item in failed:
+                restore_local(item)
+            await asyncio.gather(*(per_host(revert_host_files, h, hi, token + "r")
+                                   for h, hi in select("updated").items()))
+    finally:
+        for _, sftp in sessions.values():
+            sftp.exit()
+
+
+def prepared_path(local_file_path: str, token: str) -> str:
+    return f"{local_file_path}.pending-{token}"
+
+
+async def prepare_transform(item: dict, rules: list, token: str) -> dict:
+    """把改写结果写到本地副本旁的临时文件 item["prepared"]，本地副本等整批都准备好后再由 apply_prepared 替换"""
+    item["prepared"] = prepared_path(item["local_path"], token)
+    summary = await asyncio.to_thread(transform_file, item["local_path"], rules, item["prepared"])
+    if not summary["changed"]:
+        item["prepared"] = None
+    return summary
+
+
+def apply_prepared(items: list) -> None:
+    for item in items:
+        if item.get("prepared"):
+            os.replace(item["prepared"], item["local_path"])
+            item["prepared"] = None
+
+
+def discard_prepared(items: list) -> None:
+    for item in items:
+        if item.get("prepared") and os.path.exists(item["prepared"]):
+            os.remove(item["prepared"])
+        item["prepared"] = None
+
+
+def _abort_prepared(items: list) -> None:
+    """rollback 模式下有文件准备失败：整批放弃，本地副本和远端都不动"""
+    discard_prepared(items)
+    for item in items:
+        item["result"]["status"] = "aborted"
+
+
+def _rollout_item(path: str, host_ip: str, relative_path: str, local_file_path: str, rollback: bool) -> dict:
+    """rollback 为 False 时用不到修改前的内容，不读入内存"""
+    item = {
+        "host": host_ip,
+        "path": path,
+        "local_path": local_file_path,
+        "remote_path": "/" + relative_path.lstrip("/"),
+        "result": {"path": path, "status": "pending"}
+    }
+    if rollback:
+        item["backup"] = read_backup(local_file_path)
+    return item
+
+
+async def update_files(mcc: str, mnc: str, file_paths: list, rollback: bool = False):
     if not mcc or not mnc or not file_paths:
         return {"status": "error", "message": "缺少必要参数：mcc, mnc, file_paths"}, 400
 
+    compiled = compile_rules(plmn_rules(mcc, mnc))
+    token = uuid.uuid4().hex[:8]
+    items = []
     try:
+        results = []
+        failed = False
         for full_path in file_paths:
             parts = full_path.split("/", 1)
             if len(parts) != 2:
                 logger.warning(f"文件路径格式错误: {full_path}")
+                results.append({"path": full_path, "status": "skipped", "error": "文件路径格式错误"})
                 continue
             host_ip, relative_path = parts
             local_file_path = os.path.join(FILES_DIR, host_ip, relative_path)
 
             if not os.path.isfile(local_file_path):
                 logger.warning(f"文件不存在: {local_file_path}")
+                results.append({"path": full_path, "status": "skipped", "error": "文件不存在"})
                 continue
 
-            # 读取并修改本地文件内容
-            with open(local_file_path, "r", encoding="utf-8") as f:
-                lines = f.readlines()
-
-            new_lines = []
-            for line in lines:
-                stripped = line.strip()
-                if stripped.startswith("network country code"):
-                    new_lines.append(f"network country code    {mcc}\n")
-                elif stripped.startswith("mobile network code"):
-                    new_lines.append(f"mobile network code     {mnc}\n")
-                else:
-                    new_lines.append(line)
-
-            with open(local_file_path, "w", encoding="utf-8") as f:
-                f.writelines(new_lines)
-
-            # 远程上传覆盖，远程下载同步
-            ssh = await ssh_pool.get_connection(host_ip)
-            if not ssh:
-                logger.error(f"无法连接远端主机 {host_ip}")
-                continue
-
+            # 流式改写到临时文件，没有改动的不再推送
+            item = _rollout_item(full_path, host_ip, relative_path, local_file_path, rollback)
             try:
-                sftp = await ssh.start_sftp_client()
-                remote_path = "/" + relative_path.lstrip("/")
-
-                logger.info(f"上传本地文件 {local_file_path} 到远端 {remote_path}")
-                await sftp.put(local_file_path, remote_path)
-
-                logger.info(f"从远端拉取最新文件 {remote_path} 到本地 {local_file_path}")
-                await sftp.get(remote_path, local_file_path)
-
-                await sftp.exit()
-            except Exception as e:
-                logger.error(f"SFTP 上传/下载错误: {e}")
+                summary = await prepare_transform(item, rules_for_file(compiled, relative_path), token)
+            except (OSError, UnicodeDecodeError) as e:
+                logger.error(f"改写 {local_file_path} 出错: {e}")
+                results.append({"path": full_path, "status": "failed", "error": str(e)})
+                failed = True
+                continue
+            if not summary["changed"]:
+                results.append({"path": full_path, "status": "unchanged"})
                 continue
+            items.append(item)
+            results.append(item["result"])
 
-        return {"status": "success", "message": "文件已更新并同步"}, 200
+        if rollback and failed:
+            _abort_prepared(items)
+        else:
+            # 整批准备完成后再替换本地副本，暂存到远端临时文件并校验，再统一替换
+            apply_prepared(items)
+            await rollout_files(items, rollback=rollback)
+
+        return {"status": "success", "message": "文件已更新并同步", "files": results}, 200
     except Exception as e:
         logger.error(f"更新文件出错: {e}")
         return {"status": "error", "message": str(e)}, 500
+    finally:
+        discard_prepared(items)
 
-async def update_files_full(files: List[FileContentItem]):
+async def update_files_full(files: List[FileContentItem], rollback: bool = False):
+    token = uuid.uuid4().hex[:8]
+    items = []
     try:
         if not files:
             return {"status": "error", "message": "未提供文件列表"}, 400
 
+        results = []
         for f in files:
             path = f.path
             content = f.content
 
             if not path or not content:
+                results.append({"path": path, "status": "skipped", "error": "路径或内容为空"})
                 continue
 
             parts = path.split("/", 1)
             if len(parts) != 2:
+                results.append({"path": path, "status": "skipped", "error": "文件路径格式错误"})
                 continue
 
             host_ip, relative_path = parts
@@ -94,33 +302,108 @@ async def update_files_full(files: List[FileContentItem]):
 
             os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
 
-            # 写入本地文件
-            with open(local_file_path, "w", encoding="utf-8") as fw:
+            # 先写到本地副本旁的临时文件，整批写完后再替换
+            item = _rollout_item(path, host_ip, relative_path, local_file_path, rollback)
+            item["prepared"] = prepared_path(local_file_path, token)
+            items.append(item)
+            with open(item["prepared"], "w", encoding="utf-8") as fw:
                 fw.write(content)
+            results.append(item["result"])
 
-            # 推送到远程并拉回
-            ssh = await ssh_pool.get_connection(host_ip)
-            if not ssh:
-                logger.error(f"无法连接远端主机 {host_ip}")
-                continue
+        # 暂存到远端临时文件并校验，再统一替换
+        apply_prepared(items)
+        await rollout_files(items, rollback=rollback)
 
-            try:
-                sftp = await ssh.start_sftp_client()
-                remote_path = "/" + relative_path.lstrip("/")
+        return {"status": "success", "message": "文件已保存、同步并校验", "files": results}, 200
 
-                logger.info(f"上传本地文件 {local_file_path} 到远端 {remote_path}")
-                await sftp.put(local_file_path, remote_path)
+    except Exception as e:
+        logger.error(f"处理 update_file_full 出错: {e}")
+        return {"status": "error", "message": str(e)}, 500
+    finally:
+        discard_prepared(items)
 
-                logger.info(f"从远端拉取最新文件 {remote_path} 到本地 {local_file_path}")
-                await sftp.get(remote_path, local_file_path)
 
-                await sftp.exit()
-            except Exception as e:
-                logger.error(f"SFTP 错误: {e}")
+def expand_file_paths(file_paths: List[str]) -> List[str]:
+    """展开 "主机/路径" 里的通配符（按本地副本匹配，如 "*/etc/osmocom/*.cfg"），不允许跳出 FILES_DIR"""
+    expanded = []
+    root = os.path.realpath(FILES_DIR)
+    for full_path in file_paths:
+        if not glob.has_magic(full_path):
+            expanded.append(full_path)
+            continue
+        for match in sorted(glob.glob(os.path.join(FILES_DIR, full_path.lstrip("/")))):
+            if os.path.isfile(match) and os.path.realpath(match).startswith(root + os.sep):
+                expanded.append(os.path.relpath(match, FILES_DIR))
+    return list(dict.fromkeys(expanded))
+
+
+async def transform_configs(rules: List[dict], file_paths: List[str], dry_run: bool = True, rollback: bool = False):
+    """
+    用一组声明式规则批量改写多台主机的配置文件（规则格式见 config_transform_service）。
+    dry_run 只返回每个文件的 diff；否则先把每个文件改写到临时文件，整批准备完成后才替换本地副本，
+    再按 rollout_files 两阶段推送到远端。单个文件改写失败（读不了、不是 UTF-8）记为 failed，
+    rollback 为 True 时整批放弃。
+    """
+    if not rules or not file_paths:
+        return {"status": "error", "message": "缺少必要参数：rules, file_paths"}, 400
+    try:
+        compiled = compile_rules(rules)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}, 400
+
+    token = uuid.uuid4().hex[:8]
+    items = []
+    try:
+        results = []
+        failed = False
+        root = os.path.realpath(FILES_DIR)
+        for full_path in expand_file_paths(file_paths):
+            parts = full_path.split("/", 1)
+            if len(parts) != 2:
+                results.append({"path": full_path, "status": "skipped", "error": "文件路径格式错误"})
                 continue
+            host_ip, relative_path = parts
+            local_file_path = os.path.join(FILES_DIR, host_ip, relative_path)
+            if not os.path.realpath(local_file_path).startswith(root + os.sep) or not os.path.isfile(local_file_path):
+                results.append({"path": full_path, "status": "skipped", "error": "文件不存在"})
+                continue
+
+            file_rules = rules_for_file(compiled, relative_path)
+            try:
+                if dry_run:
+                    summary = await asyncio.to_thread(transform_file, local_file_path, file_rules)
+                    results.append({
+                        "path": full_path,
+                        "status": "changed" if summary["changed"] else "unchanged",
+                        **summary,
+                        "diff": unified_diff(full_path, summary["changes"]) if summary["changed"] else ""
+                    })
+                    continue
 
-        return {"status": "success", "message": "文件已保存、同步并回传校验"}, 200
+                item = _rollout_item(full_path, host_ip, relative_path, local_file_path, rollback)
+                summary = await prepare_transform(item, file_rules, token)
+            except (OSError, UnicodeDecodeError) as e:
+                logger.error(f"改写 {local_file_path} 出错: {e}")
+                results.append({"path": full_path, "status": "failed", "error": str(e)})
+                failed = True
+                continue
+            if not summary["changed"]:
+                results.append({"path": full_path, "status": "unchanged"})
+                continue
+            item["result"]["changed"] = summary["changed"]
+            items.append(item)
+            results.append(item["result"])
 
+        if not dry_run:
+            if rollback and failed:
+                _abort_prepared(items)
+            else:
+                apply_prepared(items)
+                await rollout_files(items, rollback=rollback)
+
+        return {"status": "success", "dry_run": dry_run, "files": results}, 200
     except Exception as e:
-        logger.error(f"处理 update_file_full 出错: {e}")
+        logger.error(f"批量改写配置出错: {e}")
         return {"status": "error", "message": str(e)}, 500
+    finally:
+        discard_prepared(items)
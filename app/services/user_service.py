@@ -5,6 +5,7 @@ from datetime import datetime
 from .file_service import FILES_DIR, find_config_by_group_id
 from app.dependencies.zabbix import get_zapi
 from app.services.async_ssh_pool import ssh_pool
+from app.services.sftp_utils import delta_put
 
 
 class UserService:
@@ -48,9 +49,11 @@ class UserService:
             async with await ssh.start_sftp_client() as sftp:
                 remote_path = db_path_relative if db_path_relative.startswith("/") else "/" + db_path_relative
                 print(f"[DEBUG] Uploading local {local_file_path} to remote {remote_path}")
-                await sftp.put(local_file_path, remote_path)
-                print(f"[DEBUG] Downloading remote {remote_path} to local {local_file_path}")
-                await sftp.get(remote_path, local_file_path)
+                # HLR 进程一直打开着这个数据库，不能 rename 换掉 inode：增量写到远端副本并校验后再一次性复制回原文件
+                stats = await delta_put(ssh, sftp, local_file_path, remote_path)
+                if stats.get("fallback"):
+                    print(f"[WARN] Delta upload of {remote_path} fell back to full upload: {stats['fallback']}")
+                print(f"[DEBUG] Remote {remote_path} updated: {stats}")
                 print("[DEBUG] sync_db_file_to_remote success")
         except Exception as e:
             print(f"[ERROR] 同步失败: {e}")
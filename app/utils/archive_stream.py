@@ -0,0 +1,112 @@
+#app/utils/archive_stream.py
+"""
+边读边生成的 tar.gz / zip 流，不在磁盘上落临时归档，内存占用只有一个读块。
+entries 为 (归档内路径, 本地文件路径) 序列；生成过程中消失的文件跳过。
+"""
+import os
+import stat
+import time
+import zlib
+import tarfile
+import zipfile
+from typing import Iterable, Iterator, Tuple
+
+CHUNK_SIZE = 256 * 1024
+
+
+def _read_exact(f, size: int) -> Iterator[bytes]:
+    """按 tar 头里记录的大小读出文件内容：文件中途变短补零，变长截断"""
+    remaining = size
+    while remaining > 0:
+        data = f.read(min(CHUNK_SIZE, remaining))
+        if not data:
+            data = b"\0" * min(CHUNK_SIZE, remaining)
+        remaining -= len(data)
+        yield data
+
+
+def iter_tar_gz(entries: Iterable[Tuple[str, str]], compresslevel: int = 6) -> Iterator[bytes]:
+    gz = zlib.compressobj(compresslevel, zlib.DEFLATED, 31)  # wbits=31：gzip 封装
+
+    def emit(data: bytes) -> bytes:
+        return gz.compress(data)
+
+    for arcname, path in entries:
+        try:
+            f = open(path, "rb")
+        except (FileNotFoundError, IsADirectoryError):
+            continue
+        with f:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            info = tarfile.TarInfo(arcname)
+            info.size = st.st_size
+            info.mtime = int(st.st_mtime)
+            info.mode = stat.S_IMODE(st.st_mode)
+            out = emit(info.tobuf(format=tarfile.PAX_FORMAT))
+            if out:
+                yield out
+            for data in _read_exact(f, info.size):
+                out = emit(data)
+                if out:
+                    yield out
+            padding = -info.size % tarfile.BLOCKSIZE
+            if padding:
+                out = emit(b"\0" * padding)
+                if out:
+                    yield out
+
+    yield emit(b"\0" * (2 * tarfile.BLOCKSIZE)) + gz.flush()
+
+
+class _Sink:
+    """zipfile 的输出端：不可 seek，写入的数据攒着等生成器取走"""
+
+    def __init__(self):
+        self.parts = []
+        self.offset = 0
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def iter_zip(entries: Iterable[Tuple[str, str]], compresslevel: int = 6) -> Iterator[bytes]:
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zf:
+        for arcname, path in entries:
+            try:
+                f = open(path, "rb")
+            except (FileNotFoundError, IsADirectoryError):
+                continue
+            with f:
+                st = os.fstat(f.fileno())
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                info = zipfile.ZipInfo(arcname, date_time=time.localtime(max(st.st_mtime, 315532800))[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = (st.st_mode & 0xFFFF) << 16
+                info.file_size = st.st_size
+                with zf.open(info, "w", force_zip64=st.st_size > zipfile.ZIP64_LIMIT // 2) as dst:
+                    for data in iter(lambda: f.read(CHUNK_SIZE), b""):
+                        dst.write(data)
+                        out = sink.drain()
+                        if out:
+                            yield out
+            out = sink.drain()
+            if out:
+                yield out
+    yield sink.drain()
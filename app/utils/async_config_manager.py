@@ -39,7 +39,8 @@ async def write_config(config: dict):
 
 async def add_host_config(host_ip: str, username: str, password: str):
     config = await read_config()
-    config[host_ip] = {"username": username, "password": password}
+    # 保留该主机已有的其它选项（compression_algs / log_transfer 等）
+    config[host_ip] = {**config.get(host_ip, {}), "username": username, "password": password}
     await write_config(config)
 
 async def get_host_config(host_ip: str):
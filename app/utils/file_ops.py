@@ -1,6 +1,7 @@
 #app/utils/file_ops.py
 import os
 import json
+import hashlib
 
 def ensure_dir(path: str):
     if not os.path.exists(path):
@@ -9,3 +10,10 @@ def ensure_dir(path: str):
 def write_json_file(path: str, data: dict):
     with open(path, 'w', encoding='utf-8') as f:
         json.dump(data, f, indent=2)
+
+def file_sha256(path: str, block_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
@@ -0,0 +1,46 @@
+#app/utils/http_range.py
+from typing import Optional, Tuple
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单段 Range 头（bytes=a-b / bytes=a- / bytes=-n），返回 [start, end) 区间。
+    没有 Range、格式不认识、区间写反（如 bytes=5-3）或是多段区间时返回 None，调用方按整段响应处理（RFC 9110 允许忽略）。
+    起点超出文件大小时抛 RangeNotSatisfiable（416）。
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec or "-" not in spec:
+        return None
+
+    first, last = (part.strip() for part in spec.split("-", 1))
+    if (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+        return None
+    if first == "":
+        suffix = int(last)
+        if suffix <= 0:
+            raise RangeNotSatisfiable()
+        return max(size - suffix, 0), size
+    start = int(first)
+    end = int(last) + 1 if last else size
+    if last and end <= start:
+        # last-pos < first-pos 是无效的区间写法，按 RFC 9110 忽略 Range，返回整段
+        return None
+
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return etag in tags or f"W/{etag}" in tags
@@ -0,0 +1,56 @@
+#app/utils/json_stream.py
+import json
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # 没装 orjson 时退回标准库
+    orjson = None
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+async def stream_grouped_entries(items: AsyncIterator[Tuple[str, Optional[str], Dict[str, Any]]],
+                                 tail: Dict[str, Any],
+                                 empty: Union[Dict[str, Any], Callable[[], Optional[Dict[str, Any]]], None] = None
+                                 ) -> AsyncIterator[bytes]:
+    """
+    把 (分组键, 子键, 值) 流编码成 {"logs": {分组键: {子键: 值}}, "errors": [...], **tail}，边读边输出。
+    子键为 None 的项放进 errors；同一分组的项需要连续产出。
+    tail 在所有项产出之后才编码（可以是生成过程中填充的 dict）；
+    一项都没有且给了 empty 时只输出 empty。empty 可以是函数，在所有项产出之后调用，返回 None 表示照常输出。
+    """
+    errors = []
+    current = None
+    started = False
+    async for group, key, value in items:
+        if key is None:
+            errors.append(value)
+            continue
+        if not started:
+            yield b'{"logs":{'
+            started = True
+        if group != current:
+            yield (b'},' if current is not None else b'') + dumps(group) + b':{'
+            current = group
+        else:
+            yield b','
+        yield dumps(key) + b':' + dumps(value)
+
+    if not started:
+        if callable(empty):
+            empty = empty()
+        if empty is not None and not errors:
+            yield dumps(empty)
+            return
+        yield b'{"logs":{'
+    if current is not None:
+        yield b'}'
+    yield b'},"errors":' + dumps(errors)
+    for name, value in tail.items():
+        yield b',' + dumps(name) + b':' + dumps(value)
+    yield b'}'
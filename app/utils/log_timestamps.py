@@ -0,0 +1,63 @@
+#app/utils/log_timestamps.py
+import re
+from datetime import datetime, timezone
+from typing import Optional, Union
+
+# 日志行首常见时间格式。远端时区未知，统一按 UTC 换算成秒，查询参数用同样方式换算，比较结果一致。
+_ISO_RE = re.compile(r'^\[?(\d{4})-(\d{2})-(\d{2})[ T](\d{2}):(\d{2}):(\d{2})(?:[.,](\d{1,6}))?')
+_OSMO_RE = re.compile(r'^(\d{4})(\d{2})(\d{2})(\d{2})(\d{2})(\d{2})(\d{3})\b')   # 20250718183955123 DLCC ...
+_OPEN5GS_RE = re.compile(r'^(\d{2})/(\d{2}) (\d{2}):(\d{2}):(\d{2})\.(\d{3}):')   # 07/18 14:51:30.567: [amf] ...
+_SYSLOG_RE = re.compile(r'^([A-Z][a-z]{2}) +(\d{1,2}) (\d{2}):(\d{2}):(\d{2})\b')  # Jul 18 18:52:37 ...
+_MONTHS = {m: i for i, m in enumerate(
+    ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"], start=1)}
+
+
+def _to_epoch(year, month, day, hour, minute, second, micro=0) -> Optional[float]:
+    try:
+        return datetime(year, month, day, hour, minute, second, micro, tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+
+def parse_leading_timestamp(line: str, year: Optional[int] = None) -> Optional[float]:
+    """解析行首时间戳，返回秒；没有可识别的时间戳时返回 None。不带年份的格式使用 year（默认今年）"""
+    if not line or not (line[0].isdigit() or line[0] in "[ADFJMNOS"):
+        return None
+
+    m = _ISO_RE.match(line)
+    if m:
+        frac = m.group(7) or "0"
+        return _to_epoch(*(int(g) for g in m.groups()[:6]), int(frac.ljust(6, "0")))
+
+    m = _OSMO_RE.match(line)
+    if m:
+        g = [int(x) for x in m.groups()]
+        return _to_epoch(*g[:6], g[6] * 1000)
+
+    year = year or datetime.now(timezone.utc).year
+    m = _OPEN5GS_RE.match(line)
+    if m:
+        g = [int(x) for x in m.groups()]
+        return _to_epoch(year, *g[:5], g[5] * 1000)
+
+    m = _SYSLOG_RE.match(line)
+    if m and m.group(1) in _MONTHS:
+        return _to_epoch(year, _MONTHS[m.group(1)], *(int(x) for x in m.groups()[1:]))
+
+    return None
+
+
+def parse_time_arg(value: Union[str, int, float, None]) -> Optional[float]:
+    """解析接口里的时间参数：秒级时间戳，或与日志相同的 'YYYY-MM-DD HH:MM:SS[.ffffff]' 格式"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    ts = parse_leading_timestamp(value.strip())
+    if ts is None:
+        raise ValueError(f"Unrecognized time: {value}")
+    return ts